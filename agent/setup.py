@@ -38,6 +38,7 @@ setup(
         "fastapi",
         "uvicorn",
     ],
+    extras_require={"orjson": ["orjson"]},
     package_data={"og_agent": ["*.bnf"]},
     entry_points={
         "console_scripts": [
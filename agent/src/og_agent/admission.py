@@ -0,0 +1,162 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+"""
+The admission controller of the tasks of the agent server
+
+A task runs when both the running tasks of its key and all the running tasks are
+under the caps, otherwise it waits in the queue of its key. The keys with waiting
+tasks are served in round robin, so the batch jobs of one key can not starve the
+others
+
+Typical usage example:
+    controller = AdmissionController(max_running=32, max_running_per_key=4)
+    ticket = controller.enqueue(api_key)
+    try:
+        while not await ticket.wait(1):
+            position, queued = controller.position(ticket)
+        run_the_task()
+    finally:
+        controller.release(ticket)
+"""
+
+
+class AdmissionQueueFullError(RuntimeError):
+    pass
+
+
+class Ticket:
+
+    def __init__(self, key):
+        self.key = key
+        self.admitted = False
+        self.released = False
+        self.event = asyncio.Event()
+
+    async def wait(self, timeout=None):
+        """
+        return True if the task is admitted within the timeout in seconds
+        """
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.admitted
+
+
+class AdmissionController:
+
+    def __init__(self, max_running=32, max_running_per_key=4, max_queued=256):
+        # 0 means no cap
+        self.max_running = max_running
+        self.max_running_per_key = max_running_per_key
+        self.max_queued = max_queued
+        self.running = 0
+        self.running_by_key = {}
+        # the key -> the waiting tickets of the key
+        self.waiting = {}
+        # the round robin order of the keys with waiting tickets
+        self.rotation = deque()
+        self.queued = 0
+
+    def _can_run(self, key):
+        if self.max_running and self.running >= self.max_running:
+            return False
+        return (
+            not self.max_running_per_key
+            or self.running_by_key.get(key, 0) < self.max_running_per_key
+        )
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        self.running += 1
+        self.running_by_key[ticket.key] = self.running_by_key.get(ticket.key, 0) + 1
+        ticket.event.set()
+
+    def _schedule(self):
+        """
+        admit the waiting tickets in round robin until no key can run
+        """
+        skipped = 0
+        while self.rotation and skipped < len(self.rotation):
+            if self.max_running and self.running >= self.max_running:
+                break
+            key = self.rotation[0]
+            self.rotation.rotate(-1)
+            if not self._can_run(key):
+                skipped += 1
+                continue
+            skipped = 0
+            tickets = self.waiting[key]
+            self._admit(tickets.popleft())
+            self.queued -= 1
+            if not tickets:
+                del self.waiting[key]
+                self.rotation.remove(key)
+
+    def enqueue(self, key) -> Ticket:
+        """
+        return the ticket of a new task, it's admitted at once if the caps allow
+        """
+        ticket = Ticket(key)
+        if not self.waiting.get(key) and self._can_run(key):
+            self._admit(ticket)
+            return ticket
+        if self.max_queued and self.queued >= self.max_queued:
+            raise AdmissionQueueFullError("too many waiting tasks")
+        if key not in self.waiting:
+            self.waiting[key] = deque()
+            self.rotation.append(key)
+        self.waiting[key].append(ticket)
+        self.queued += 1
+        return ticket
+
+    def position(self, ticket):
+        """
+        return the 1-based position of the waiting ticket in the round robin order
+        and the number of the waiting tickets
+        """
+        tickets = self.waiting.get(ticket.key)
+        if ticket.admitted or not tickets or ticket not in tickets:
+            return 0, self.queued
+        index = tickets.index(ticket)
+        order = list(self.rotation)
+        own = order.index(ticket.key)
+        position = 1 + index
+        for i, key in enumerate(order):
+            if key == ticket.key:
+                continue
+            # the keys before the key of the ticket run one more task in its round
+            rounds = index + 1 if i < own else index
+            position += min(len(self.waiting[key]), rounds)
+        return position, self.queued
+
+    def release(self, ticket):
+        """
+        release the running slot of the ticket or remove it from the queue
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted:
+            self.running -= 1
+            self.running_by_key[ticket.key] -= 1
+            if not self.running_by_key[ticket.key]:
+                del self.running_by_key[ticket.key]
+        else:
+            tickets = self.waiting[ticket.key]
+            tickets.remove(ticket)
+            self.queued -= 1
+            if not tickets:
+                del self.waiting[ticket.key]
+                self.rotation.remove(ticket.key)
+        self._schedule()
+
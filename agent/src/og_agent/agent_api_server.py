@@ -52,6 +52,8 @@ class StepResponseType(str, Enum):
     OnStepActionStderr = "OnStepActionStderr"
     OnStepActionEnd = "OnStepActionEnd"
     OnFinalAnswer = "OnFinalAnswer"
+    OnTaskQueued = "OnTaskQueued"
+    OnTaskTimeout = "OnTaskTimeout"
 
 
 class ContextState(BaseModel):
@@ -72,6 +74,15 @@ class ContextState(BaseModel):
             llm_response_duration=state.llm_response_duration,
         )
 
+    @classmethod
+    def new_from_response(cls, response):
+        """
+        the state is only attached to some responses of the task
+        """
+        if not response.HasField("state"):
+            return None
+        return cls.new_from(response.state)
+
 
 class StepActionEnd(BaseModel):
     output: str
@@ -87,6 +98,15 @@ class StepActionEnd(BaseModel):
         )
 
 
+class TaskQueued(BaseModel):
+    position: int
+    queued: int
+
+    @classmethod
+    def new_from(cls, on_task_queued: agent_server_pb2.OnTaskQueued):
+        return cls(position=on_task_queued.position, queued=on_task_queued.queued)
+
+
 class FinalAnswer(BaseModel):
     answer: str
 
@@ -106,20 +126,22 @@ class StepActionStart(BaseModel):
 
 class StepResponse(BaseModel):
     step_type: StepResponseType
-    step_state: ContextState
+    step_state: ContextState | None = None
     typing_content: str | None = None
     step_action_stdout: str | None = None
     step_action_stderr: str | None = None
     step_action_start: StepActionStart | None = None
     step_action_end: StepActionEnd | None = None
     final_answer: FinalAnswer | None = None
+    task_queued: TaskQueued | None = None
+    error_msg: str | None = None
 
     @classmethod
     def new_from(cls, response: agent_server_pb2.TaskResponse):
         if response.response_type == agent_server_pb2.TaskResponse.OnStepActionStart:
             return cls(
                 step_type=StepResponseType.OnStepActionStart,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 step_action_start=StepActionStart.new_from(
                     response.on_step_action_start
                 ),
@@ -127,14 +149,14 @@ class StepResponse(BaseModel):
         elif response.response_type == agent_server_pb2.TaskResponse.OnModelTypeCode:
             return cls(
                 step_type=StepResponseType.OnStepCodeTyping,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 typing_content=response.typing_content.content,
             )
 
         elif response.response_type == agent_server_pb2.TaskResponse.OnModelTypeText:
             return cls(
                 step_type=StepResponseType.OnStepTextTyping,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 typing_content=response.typing_content.content,
             )
         elif (
@@ -143,7 +165,7 @@ class StepResponse(BaseModel):
         ):
             return cls(
                 step_type=StepResponseType.OnStepActionStdout,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 step_action_stdout=response.console_stdout,
             )
         elif (
@@ -152,21 +174,33 @@ class StepResponse(BaseModel):
         ):
             return cls(
                 step_type=StepResponseType.OnStepActionStderr,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 step_action_stderr=response.console_stderr,
             )
         elif response.response_type == agent_server_pb2.TaskResponse.OnStepActionEnd:
             return cls(
                 step_type=StepResponseType.OnStepActionEnd,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 step_action_end=StepActionEnd.new_from(response.on_step_action_end),
             )
         elif response.response_type == agent_server_pb2.TaskResponse.OnFinalAnswer:
             return cls(
                 step_type=StepResponseType.OnFinalAnswer,
-                step_state=ContextState.new_from(response.state),
+                step_state=ContextState.new_from_response(response),
                 final_answer=FinalAnswer.new_from(response.final_answer),
             )
+        elif response.response_type == agent_server_pb2.TaskResponse.OnTaskQueued:
+            return cls(
+                step_type=StepResponseType.OnTaskQueued,
+                step_state=ContextState.new_from_response(response),
+                task_queued=TaskQueued.new_from(response.on_task_queued),
+            )
+        elif response.response_type == agent_server_pb2.TaskResponse.OnTaskTimeout:
+            return cls(
+                step_type=StepResponseType.OnTaskTimeout,
+                step_state=ContextState.new_from_response(response),
+                error_msg=response.error_msg,
+            )
 
 
 class TaskRequest(BaseModel):
@@ -181,7 +215,11 @@ async def run_task(task: TaskRequest, key):
     async for respond in agent_sdk.prompt(
         task.prompt, key, files=task.input_files, context_id=task.context_id
     ):
-        response = StepResponse.new_from(respond).model_dump(exclude_none=True)
+        step_response = StepResponse.new_from(respond)
+        # skip the responses without a step type
+        if not step_response:
+            continue
+        response = step_response.model_dump(exclude_none=True)
         yield "data: %s\n" % json.dumps(response)
 
 
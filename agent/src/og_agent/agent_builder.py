@@ -10,24 +10,78 @@ from .openai_agent import OpenaiAgent
 from .llama_client import LlamaClient
 from .mock_agent import MockAgent
 
+# the context windows in tokens of the models, the first matched prefix of the
+# model name is used
+MODEL_CONTEXT_WINDOWS = [
+    ("gpt-4-32k", 32768),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo-16k", 16384),
+    ("gpt-35-turbo-16k", 16384),
+    ("codellama", 16384),
+]
+DEFAULT_CONTEXT_WINDOW = 4096
 
-def build_llama_agent(endpoint, key, sdk, grammer_path):
+
+def get_context_token_limit(model_name, output_token_count=1024):
+    """
+    return the token budget of the messages, the rest of the context window of
+    the model is left for the output
+    """
+    context_window = DEFAULT_CONTEXT_WINDOW
+    for prefix, window in MODEL_CONTEXT_WINDOWS:
+        if model_name and model_name.startswith(prefix):
+            context_window = window
+            break
+    return context_window - output_token_count
+
+
+def build_llama_agent(
+    endpoint,
+    key,
+    sdk,
+    grammer_path,
+    context_token_limit=None,
+    memory_store=None,
+    pool_size=16,
+    request_timeout=600,
+):
     """
-    build llama agent
+    build llama agent, the context token limit defaults to the context window
+    of codellama and 0 turns off the context window
     """
     with open(grammer_path, "r") as fd:
         grammar = fd.read()
-    client = LlamaClient(endpoint, key, grammar)
+    client = LlamaClient(
+        endpoint, key, grammar, pool_size=pool_size, request_timeout=request_timeout
+    )
+    if context_token_limit is None:
+        # the llama agent asks for 2048 tokens at most
+        context_token_limit = get_context_token_limit("codellama", 2048)
     # init the agent
-    return LlamaAgent(client, sdk)
+    return LlamaAgent(
+        client,
+        sdk,
+        context_token_limit=context_token_limit,
+        memory_store=memory_store,
+    )
 
 
-def build_openai_agent(sdk, model_name, is_azure=True):
-    """build openai function call agent"""
+def build_openai_agent(
+    sdk, model_name, is_azure=True, context_token_limit=None, memory_store=None
+):
+    """build openai function call agent, the context token limit defaults to the
+    context window of the model and 0 turns off the context window"""
     # TODO a data dir per user
     # init the agent
-
-    agent = OpenaiAgent(model_name, sdk, is_azure=is_azure)
+    if context_token_limit is None:
+        context_token_limit = get_context_token_limit(model_name)
+    agent = OpenaiAgent(
+        model_name,
+        sdk,
+        is_azure=is_azure,
+        context_token_limit=context_token_limit,
+        memory_store=memory_store,
+    )
     return agent
 
 
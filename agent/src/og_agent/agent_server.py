@@ -9,6 +9,7 @@ import sys
 import os
 import pathlib
 import hashlib
+import time
 import grpc
 import json
 from grpc.aio import AioRpcError
@@ -23,8 +24,13 @@ from tempfile import gettempdir
 from grpc.aio import ServicerContext, server
 from og_sdk.kernel_sdk import KernelSDK
 from og_sdk.utils import parse_image_filename
+from og_kernel.server.transfer_token import issue_token
 from .agent_llm import LLMManager
 from .agent_builder import build_mock_agent, build_openai_agent, build_llama_agent
+from .memory_store import OrmMemoryStore
+from .response_queue import ResponseQueue, ResponseQueueMetrics
+from .admission import AdmissionController, AdmissionQueueFullError
+from og_memory.store import MemoryStore
 import databases
 import orm
 from datetime import datetime
@@ -61,14 +67,75 @@ class LiteApp(orm.Model):
     }
 
 
+class AgentMemoryRecord(orm.Model):
+    tablename = "agent_memory"
+    registry = models
+    fields = {
+        "id": orm.Integer(primary_key=True),
+        "memory_id": orm.String(max_length=64, index=True, unique=True),
+        # the base64 of the serialized AgentMemory message
+        "memory": orm.Text(),
+        "time": orm.DateTime(),
+    }
+
+
 class AgentRpcServer(AgentServerServicer):
 
     def __init__(self):
         self.agents = {}
         self.max_file_size = int(config["max_file_size"])
+        # let the clients transfer the files with the kernels directly
+        self.direct_transfer = config.get("direct_transfer", "false").lower() == "true"
+        self.transfer_token_ttl = int(config.get("transfer_token_ttl", "300"))
+        # the timeout(s) of the tasks without the timeout option
+        self.task_timeout = int(config.get("task_timeout", "600"))
+        # the token budget of the messages, the empty one is the context window of
+        # the model and 0 turns off the context window
+        context_token_limit = config.get("context_token_limit", "")
+        self.context_token_limit = (
+            int(context_token_limit) if context_token_limit else None
+        )
         self.verbose = config.get("verbose", False)
         self.llm_manager = LLMManager(config)
         self.llm = self.llm_manager.get_llm()
+        # the memories of all agents, the cold memories are spilled to the database
+        self.memory_store = MemoryStore(
+            spill_store=OrmMemoryStore(AgentMemoryRecord),
+            max_size=int(config.get("memory_cache_size", "64")),
+            ttl=int(config.get("memory_ttl", "1800")),
+        )
+        # the bounded response queue of a task, the coalesce policy merges the
+        # typing and stdout deltas when the client is slow
+        self.response_queue_size = int(config.get("response_queue_size", "256"))
+        self.response_queue_policy = config.get(
+            "response_queue_policy", ResponseQueue.COALESCE
+        )
+        self.response_queue_metrics = ResponseQueueMetrics()
+        # merge the typing deltas of the llm within the window or up to the size
+        self.typing_coalesce_window = (
+            int(config.get("typing_coalesce_window", "30")) / 1000
+        )
+        self.typing_coalesce_size = int(config.get("typing_coalesce_size", "256"))
+        # the min interval(ms) between the context states of the streaming responses
+        self.context_state_interval = (
+            int(config.get("context_state_interval", "500")) / 1000
+        )
+        # the caps of the running tasks, the other tasks wait in a fair queue
+        self.admission = AdmissionController(
+            max_running=int(config.get("max_running_tasks", "32")),
+            max_running_per_key=int(config.get("max_running_tasks_per_key", "4")),
+            max_queued=int(config.get("max_queued_tasks", "256")),
+        )
+        # the interval(s) of the position messages of the waiting tasks
+        self.queued_status_interval = float(config.get("queued_status_interval", "1"))
+
+    async def close(self):
+        """
+        close the agents when the server shuts down
+        """
+        for value in self.agents.values():
+            if value:
+                await value["agent"].close()
 
     async def ping(
         self, request: agent_server_pb2.PingRequest, context: ServicerContext
@@ -97,7 +164,9 @@ class AgentRpcServer(AgentServerServicer):
         if request.key in self.agents and self.agents[request.key]:
             return agent_server_pb2.AddKernelResponse(code=0, msg="ok")
         # init the sdk
-        sdk = KernelSDK(request.endpoint, request.key)
+        # the kernels and workspaces of the agents are isolated by the session
+        session_id = hashlib.sha256(request.key.encode("utf-8")).hexdigest()[:32]
+        sdk = KernelSDK(request.endpoint, request.key, session_id=session_id)
         try:
             sdk.connect()
             await sdk.is_alive()
@@ -109,6 +178,8 @@ class AgentRpcServer(AgentServerServicer):
                 sdk,
                 config["openai_api_model"],
                 is_azure=True if config["llm_key"] == "azure_openai" else False,
+                context_token_limit=self.context_token_limit,
+                memory_store=self.memory_store,
             )
             self.agents[request.key] = {"sdk": sdk, "agent": agent}
         elif config["llm_key"] == "mock":
@@ -121,9 +192,23 @@ class AgentRpcServer(AgentServerServicer):
                 pathlib.Path(__file__).parent.resolve(), "grammar.bnf"
             )
             agent = build_llama_agent(
-                config["llama_api_base"], config["llama_api_key"], sdk, grammer_path
+                config["llama_api_base"],
+                config["llama_api_key"],
+                sdk,
+                grammer_path,
+                context_token_limit=self.context_token_limit,
+                memory_store=self.memory_store,
+                pool_size=int(config.get("llama_pool_size", "16")),
+                request_timeout=int(config.get("llama_request_timeout", "600")),
             )
             self.agents[request.key] = {"sdk": sdk, "agent": agent}
+        if request.key in self.agents:
+            self.agents[request.key]["agent"].state_interval = (
+                self.context_state_interval
+            )
+            # the memory store is shared by the agents, own the memories by the
+            # session rather than the raw key
+            self.agents[request.key]["agent"].user_id = session_id
         return agent_server_pb2.AddKernelResponse(code=0, msg="ok")
 
     async def process_task(
@@ -144,10 +229,29 @@ class AgentRpcServer(AgentServerServicer):
         logger.debug("receive the task %s ", request.task)
         agent = self.agents[metadata["api_key"]]["agent"]
         sdk = self.agents[metadata["api_key"]]["sdk"]
-        queue = asyncio.Queue()
+        queue = ResponseQueue(
+            maxsize=self.response_queue_size,
+            policy=self.response_queue_policy,
+            metrics=self.response_queue_metrics,
+        )
 
         async def worker(request, agent, queue, context, task_opt):
-            return await agent.arun(request, queue, context, task_opt)
+            """
+            return False if the task exceeds the timeout
+            """
+            try:
+                # the kernel interrupts the running code when the agent is cancelled
+                await asyncio.wait_for(
+                    agent.arun(request, queue, context, task_opt), task_opt.timeout
+                )
+                return True
+            except asyncio.TimeoutError:
+                logger.warning("the task exceeds the timeout %ds", task_opt.timeout)
+                return False
+            finally:
+                # the agent may end without the end of the queue, e.g. it's
+                # cancelled before it starts or the context id is invalid
+                await queue.put(None)
 
         options = (
             request.options
@@ -163,23 +267,64 @@ class AgentRpcServer(AgentServerServicer):
                 output_token_limit=4000
                 if not request.options.output_token_limit
                 else request.options.output_token_limit,
-                timeout=10,
+                timeout=request.options.timeout,
+                state_on_every_message=request.options.state_on_every_message,
             )
         )
 
-        logger.debug("create the agent task")
-        task = asyncio.create_task(worker(request, agent, queue, context, options))
-        while True:
-            logger.debug("start wait the queue message")
-            # TODO add timeout
-            respond = await queue.get()
-            if not respond:
-                logger.debug("exit the queue")
-                break
-            logger.debug(f"respond {respond}")
-            queue.task_done()
-            yield respond
-        await task
+        if options.timeout <= 0:
+            options.timeout = self.task_timeout
+        try:
+            ticket = self.admission.enqueue(metadata["api_key"])
+        except AdmissionQueueFullError as ex:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED.value[0], str(ex))
+        task = None
+        try:
+            while not ticket.admitted:
+                position, queued = self.admission.position(ticket)
+                yield agent_server_pb2.TaskResponse(
+                    response_type=agent_server_pb2.TaskResponse.OnTaskQueued,
+                    on_task_queued=agent_server_pb2.OnTaskQueued(
+                        position=position, queued=queued
+                    ),
+                    context_id=request.context_id,
+                )
+                await ticket.wait(self.queued_status_interval)
+            logger.debug("create the agent task")
+            task = asyncio.create_task(worker(request, agent, queue, context, options))
+            while True:
+                logger.debug("start wait the queue message")
+                respond = await queue.get_coalesced(
+                    self.typing_coalesce_window, self.typing_coalesce_size
+                )
+                if not respond:
+                    logger.debug("exit the queue")
+                    break
+                logger.debug(f"respond {respond}")
+                queue.task_done()
+                yield respond
+            if not await task:
+                yield agent_server_pb2.TaskResponse(
+                    response_type=agent_server_pb2.TaskResponse.OnTaskTimeout,
+                    error_msg=f"the task exceeds the timeout {options.timeout}s",
+                    context_id=request.context_id,
+                )
+        finally:
+            # the agent may wait on the full queue after the client has gone
+            if task and not task.done():
+                task.cancel()
+                # free the slot after the agent has stopped the running code
+                task.add_done_callback(lambda _: self.admission.release(ticket))
+            else:
+                self.admission.release(ticket)
+            queue.close()
+            logger.info(
+                "the response queue of task max depth %d, coalesced %d, blocked %d, merged %d",
+                queue.max_depth,
+                queue.coalesced,
+                queue.blocked,
+                queue.typing_merged,
+            )
 
     async def download(
         self, request: common_pb2.DownloadRequest, context: ServicerContext
@@ -195,9 +340,65 @@ class AgentRpcServer(AgentServerServicer):
         ):
             await context.abort(10, "invalid api key")
         sdk = self.agents[metadata["api_key"]]["sdk"]
-        async for chunk in sdk.download_file(request.filename):
+        async for chunk in sdk.download_file(request.filename, request.offset):
             yield chunk
 
+    async def stat_file(
+        self, request: common_pb2.StatFileRequest, context: ServicerContext
+    ) -> common_pb2.StatFileResponse:
+        """
+        return the state of the uploaded file in the kernel workspace
+        """
+        metadata = dict(context.invocation_metadata())
+        if (
+            "api_key" not in metadata
+            or metadata["api_key"] not in self.agents
+            or not self.agents[metadata["api_key"]]
+        ):
+            await context.abort(10, "invalid api key")
+        sdk = self.agents[metadata["api_key"]]["sdk"]
+        return await sdk.stat_file(request.filename, request.with_digest)
+
+    async def create_transfer_token(
+        self, request: agent_server_pb2.TransferTokenRequest, context: ServicerContext
+    ) -> agent_server_pb2.TransferTokenResponse:
+        """
+        issue a short-lived token for the client to transfer the file with the
+        kernel directly
+        """
+        metadata = dict(context.invocation_metadata())
+        if (
+            "api_key" not in metadata
+            or metadata["api_key"] not in self.agents
+            or not self.agents[metadata["api_key"]]
+        ):
+            await context.abort(10, "invalid api key")
+        if not self.direct_transfer:
+            return agent_server_pb2.TransferTokenResponse(
+                code=1, msg="the direct transfer is disabled"
+            )
+        if request.op not in ["upload", "download"] or not request.filename:
+            await context.abort(
+                grpc.StatusCode.INVALID_ARGUMENT.value[0], "invalid arguments"
+            )
+        sdk = self.agents[metadata["api_key"]]["sdk"]
+        # the token is signed with the api key of the kernel
+        token = issue_token(
+            metadata["api_key"],
+            sdk.session_id,
+            request.op,
+            request.filename,
+            ttl=self.transfer_token_ttl,
+            max_size=self.max_file_size,
+        )
+        return agent_server_pb2.TransferTokenResponse(
+            code=0,
+            msg="ok",
+            token=token,
+            endpoint=sdk.endpoint,
+            expire_at=int(time.time()) + self.transfer_token_ttl,
+        )
+
     async def upload(
         self,
         request: AsyncIterable[common_pb2.FileChunk],
@@ -218,7 +419,13 @@ class AgentRpcServer(AgentServerServicer):
         async def generate_chunk(proxy_request, context, limit):
             length = 0
             async for chunk in proxy_request:
+                # the resumed upload starts from the offset of the first chunk
+                if not length:
+                    length = chunk.offset
                 if length + len(chunk.buffer) > limit:
+                    # drain the request, the client still sending fails with an internal error
+                    async for _ in proxy_request:
+                        pass
                     await context.abort(
                         grpc.StatusCode.INVALID_ARGUMENT.value[0],
                         "exceed the max file limit",
@@ -226,9 +433,13 @@ class AgentRpcServer(AgentServerServicer):
                 length += len(chunk.buffer)
                 yield chunk
 
-        return await sdk.upload_binary(
-            generate_chunk(request, context, self.max_file_size)
-        )
+        try:
+            return await sdk.upload_binary(
+                generate_chunk(request, context, self.max_file_size)
+            )
+        except AioRpcError as ex:
+            # the client resumes the upload by the status of the kernel
+            await context.abort(ex.code(), ex.details())
 
 
 async def serve() -> None:
@@ -239,11 +450,15 @@ async def serve() -> None:
     )
     await models.create_all()
     serv = server()
-    add_AgentServerServicer_to_server(AgentRpcServer(), serv)
+    agent_server = AgentRpcServer()
+    add_AgentServerServicer_to_server(agent_server, serv)
     listen_addr = "%s:%s" % (config["rpc_host"], config["rpc_port"])
     serv.add_insecure_port(listen_addr)
     await serv.start()
-    await serv.wait_for_termination()
+    try:
+        await serv.wait_for_termination()
+    finally:
+        await agent_server.close()
 
 
 def server_main():
@@ -6,6 +6,7 @@
 """ """
 import uuid
 import json
+import asyncio
 import io
 import logging
 import time
@@ -13,12 +14,14 @@ from typing import List
 from pydantic import BaseModel, Field
 from og_proto.kernel_server_pb2 import ExecuteResponse
 from og_proto.agent_server_pb2 import TaskResponse, ContextState
-from og_sdk.utils import parse_image_filename, process_char_stream
+from og_sdk.utils import get_execute_output, parse_image_filename, process_char_stream
 from og_proto.agent_server_pb2 import OnStepActionStart, TaskResponse, OnStepActionEnd, FinalAnswer, TypingContent
 from og_proto.prompt_pb2 import AgentPrompt
-from .tokenizer import tokenize
+from .tokenizer import Tokenizer, TokenType
+from .token_counter import TokenCounter
 from .prompt import ROLE, RULES, ACTIONS, OUTPUT_FORMAT
 from og_memory.memory import MemoryAgentMemory
+from og_memory.store import MemoryStore
 import tiktoken
 
 encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
@@ -42,10 +45,27 @@ class TaskContext(BaseModel):
     llm_name: str = ""
     llm_response_duration: int = 0
     context_id: str = ""
+    # the min seconds between the states of the streaming responses
+    state_interval: float = 0.5
+    state_on_every_message: bool = False
+    state_sent_at: float = 0
+    state_sent_counts: tuple = ()
+    # the time.time() when the task times out, 0 means no deadline
+    deadline: float = 0
+
+    def _state_counts(self):
+        return (
+            self.output_token_count,
+            self.input_token_count,
+            self.llm_response_duration,
+        )
 
     def to_context_state_proto(self):
+        now = time.time()
+        self.state_sent_at = now
+        self.state_sent_counts = self._state_counts()
         # in ms
-        total_duration = int((time.time() - self.start_time) * 1000)
+        total_duration = int((now - self.start_time) * 1000)
         return ContextState(
             output_token_count=self.output_token_count,
             input_token_count=self.input_token_count,
@@ -54,6 +74,29 @@ class TaskContext(BaseModel):
             llm_response_duration=self.llm_response_duration,
         )
 
+    def remaining_time(self):
+        """
+        return the seconds before the deadline of the task or None if the task has
+        no deadline
+        """
+        if not self.deadline:
+            return None
+        # a call with a non-positive timeout fails at once
+        return max(self.deadline - time.time(), 0.001)
+
+    def to_streaming_state_proto(self):
+        """
+        return the state for the typing and output deltas only if the counts have
+        changed and the state interval has passed, otherwise None
+        """
+        if self.state_on_every_message:
+            return self.to_context_state_proto()
+        if self._state_counts() == self.state_sent_counts:
+            return None
+        if time.time() - self.state_sent_at < self.state_interval:
+            return None
+        return self.to_context_state_proto()
+
 
 class TypingState:
     START = 0
@@ -64,14 +107,118 @@ class TypingState:
     OTHER = 5
 
 
+class TypingParser:
+    """
+    The incremental parser for the streaming function arguments. It holds the
+    tokenizer state of an in-flight message, so only the new delta is fed and the
+    increments of explanation, code, language and message are returned
+
+    Typical usage example:
+        typing_parser = TypingParser()
+        for delta in deltas:
+            for typing_state, typed_chars in typing_parser.feed(delta):
+                ...
+    """
+
+    FIELDS = {
+        "explanation": TypingState.EXPLANATION,
+        "code": TypingState.CODE,
+        "language": TypingState.LANGUAGE,
+        "message": TypingState.MESSAGE,
+    }
+
+    def __init__(self, is_code=False):
+        # the arguments are the raw code if is_code is True
+        self.is_code = is_code
+        self.tokenizer = Tokenizer()
+        # True for the object and False for the array
+        self.containers = []
+        self.expect_key = False
+        self.key = None
+        # the typing state of the current value
+        self.field = None
+        # the count of chars of the current value that have been returned
+        self.typed_count = 0
+        self.is_broken = False
+
+    def feed(self, delta):
+        """
+        feed the delta and return a list of (typing_state, typed_chars)
+        """
+        if not delta:
+            return []
+        if self.is_code:
+            return [(TypingState.CODE, delta)]
+        if self.is_broken:
+            return []
+        increments = []
+        try:
+            for _, token in self.tokenizer.feed(delta):
+                self._on_token(token, increments)
+        except ValueError as ex:
+            logger.debug(f"stop parsing the bad arguments for {ex}")
+            self.is_broken = True
+            return increments
+        if (
+            self.field
+            and self.field != TypingState.LANGUAGE
+            and self.tokenizer.in_string()
+            and len(self.tokenizer.token) > self.typed_count
+        ):
+            increments.append(
+                (self.field, "".join(self.tokenizer.token[self.typed_count :]))
+            )
+            self.typed_count = len(self.tokenizer.token)
+        return increments
+
+    def _on_token(self, token, increments):
+        token_type, value = token
+        if token_type == TokenType.OPERATOR:
+            if value == "{":
+                self.containers.append(True)
+                self.expect_key = True
+            elif value == "[":
+                self.containers.append(False)
+            elif value in ["}", "]"]:
+                if self.containers:
+                    self.containers.pop()
+            elif value == ",":
+                self.expect_key = bool(self.containers) and self.containers[-1]
+            elif value == ":":
+                self.field = self.FIELDS.get(self.key)
+                self.typed_count = 0
+            if value != ":":
+                self.field = None
+            return
+        if token_type == TokenType.STRING and self.expect_key:
+            self.key = value
+            self.expect_key = False
+            return
+        if token_type == TokenType.STRING and self.field and len(value) > self.typed_count:
+            increments.append((self.field, value[self.typed_count :]))
+        self.field = None
+        self.typed_count = 0
+
+
 class BaseAgent:
 
-    def __init__(self, sdk):
+    def __init__(self, sdk, memory_store=None):
         self.kernel_sdk = sdk
         self.model_name = ""
-        self.agent_memories = {}
+        # the min seconds between the states of the streaming responses
+        self.state_interval = 0.5
+        self.memory_store = memory_store if memory_store else MemoryStore()
+        # the owner of the memories, the agents sharing the memory store can
+        # only load the memories of their own
+        self.user_id = ""
+
+    async def close(self):
+        """
+        release the resources of the agent
+        """
+        pass
 
-    def create_new_memory_with_default_prompt(
+    async def create_new_memory_with_default_prompt(
         self, user_name, user_id, actions=ACTIONS
     ):
         """
@@ -87,16 +234,28 @@ class BaseAgent:
         )
         agent_memory = MemoryAgentMemory(memory_id, user_name, user_id)
         agent_memory.swap_instruction(agent_prompt)
-        self.agent_memories[memory_id] = agent_memory
+        await self.memory_store.put(agent_memory)
         logger.info(f"create a new memory {memory_id} for user {user_name}")
         return memory_id
 
-    def reset_memory(self, memory_id):
+    async def get_memory(self, memory_id):
+        """
+        return the memory or None if it does not exist or belongs to another user
+        """
+        agent_memory = await self.memory_store.get(memory_id)
+        if agent_memory and agent_memory.user_id != self.user_id:
+            logger.warning(f"the memory {memory_id} belongs to another user")
+            return None
+        return agent_memory
+
+    async def reset_memory(self, memory_id):
         """
         reset the memory
         """
-        if memory_id in self.agent_memories:
-            self.agent_memories[memory_id].reset_memory()
+        agent_memory = await self.get_memory(memory_id)
+        if agent_memory:
+            agent_memory.reset_memory()
+            await self.memory_store.put(agent_memory)
             logger.info(f"reset the memory {memory_id}")
         else:
             logger.info(f"the memory {memory_id} does not exist")
@@ -121,203 +280,52 @@ class BaseAgent:
         if delta.get("content"):
             message["content"] = content + delta["content"]
 
-    def _parse_arguments(
-        self,
-        arguments,
-        is_code=False,
-    ):
-        """
-        parse the partial key with string value from json
-        """
-        if is_code:
-            return TypingState.CODE, "", arguments, "python", ""
-        state = TypingState.START
-        explanation_str = ""
-        code_str = ""
-        language_str = ""
-        message_str = ""
-        logger.debug(f"the arguments {arguments}")
-        for token_state, token in tokenize(io.StringIO(arguments)):
-            if token_state == None:
-                if state == TypingState.EXPLANATION and token[0] == 1:
-                    explanation_str = token[1]
-                    state = TypingState.START
-                if state == TypingState.CODE and token[0] == 1:
-                    code_str = token[1]
-                    state = TypingState.START
-                if state == TypingState.LANGUAGE and token[0] == 1:
-                    language_str = token[1]
-                    state = TypingState.START
-                if state == TypingState.MESSAGE and token[0] == 1:
-                    message_str = token[1]
-                    state = TypingState.START
-                if state == TypingState.OTHER and token[0] == 1:
-                    state = TypingState.START
-
-                if token[1] == "explanation":
-                    state = TypingState.EXPLANATION
-                if token[1] == "code":
-                    state = TypingState.CODE
-                if token[1] == "language":
-                    state = TypingState.LANGUAGE
-                if token[1] == "message":
-                    state = TypingState.MESSAGE
-                if token[1] == "saved_filenames":
-                    state = TypingState.OTHER
-            else:
-                # String
-                if token_state == 9 and state == TypingState.EXPLANATION:
-                    explanation_str = "".join(token)
-                elif token_state == 9 and state == TypingState.CODE:
-                    code_str = "".join(token)
-                elif token_state == 9 and state == TypingState.LANGUAGE:
-                    language_str = "".join(token)
-                elif token_state == 9 and state == TypingState.MESSAGE:
-                    message_str = "".join(token)
-        return (state, explanation_str, code_str, language_str, message_str)
-
-    def _get_message_token_count(self, message):
-        response_token_count = 0
-        if "function_call" in message and message["function_call"]:
-            arguments = message["function_call"].get("arguments", "")
-            response_token_count += len(encoding.encode(arguments))
-        if "content" in message and message["content"]:
-            response_token_count += len(encoding.encode(message.get("content")))
-        return response_token_count
-
-    async def _read_function_call_message(
-        self,
-        message,
-        queue,
-        old_text_content,
-        old_code_content,
-        old_message_str,
-        language_str,
-        task_context,
-        task_opt,
-    ):
-        typing_language = "text"
-        is_code = False
-        if message["function_call"].get("name", "") == "python":
-            is_code = True
-        arguments = message["function_call"].get("arguments", "")
-        return await self._send_typing_message(
-            arguments,
-            queue,
-            old_text_content,
-            old_code_content,
-            old_message_str,
-            language_str,
-            task_context,
-            task_opt,
-            is_code=is_code,
-        )
-
-    async def _read_json_message(
-        self,
-        message,
-        queue,
-        old_text_content,
-        old_code_content,
-        old_message_str,
-        old_language_str,
-        task_context,
-        task_opt,
-    ):
-        return await self._send_typing_message(
-            message.get("content", ""),
-            queue,
-            old_text_content,
-            old_code_content,
-            old_message_str,
-            old_language_str,
-            task_context,
-            task_opt,
-        )
-
     async def _send_typing_message(
         self,
-        arguments,
+        typing_parser,
+        delta,
         queue,
-        old_text_content,
-        old_code_content,
-        old_message_str,
-        old_language_str,
         task_context,
         task_opt,
-        is_code=False,
     ):
         """
-        send the typing message to the client
+        feed the delta to the typing parser and send the typed chars to the client
         """
-        (
-            state,
-            explanation_str,
-            code_str,
-            language_str,
-            message_str,
-        ) = self._parse_arguments(arguments, is_code)
-
-        logger.debug(
-            f"argument explanation:{explanation_str} code:{code_str} language_str:{language_str} text_content:{old_text_content} old_message_str:{old_message_str}"
-        )
-
-        if explanation_str and old_text_content != explanation_str:
-            typed_chars = explanation_str[len(old_text_content) :]
-            new_text_content = explanation_str
-            if task_opt.streaming and len(typed_chars) > 0:
-                task_response = TaskResponse(
-                    state=task_context.to_context_state_proto(),
-                    response_type=TaskResponse.OnModelTypeText,
-                    typing_content=TypingContent(content=typed_chars, language="text"),
-                    context_id=task_context.context_id,
-                )
-                await queue.put(task_response)
-            return new_text_content, old_code_content, old_language_str, old_message_str
-        if code_str and old_code_content != code_str:
-            typed_chars = code_str[len(old_code_content) :]
-            code_content = code_str
-            if task_opt.streaming and len(typed_chars) > 0:
+        if not task_opt.streaming or not delta:
+            return
+        for typing_state, typed_chars in typing_parser.feed(delta):
+            if typing_state in [TypingState.EXPLANATION, TypingState.MESSAGE]:
                 await queue.put(
                     TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnModelTypeCode,
+                        state=task_context.to_streaming_state_proto(),
+                        response_type=TaskResponse.OnModelTypeText,
                         typing_content=TypingContent(
                             content=typed_chars, language="text"
                         ),
                         context_id=task_context.context_id,
                     )
                 )
-            return old_text_content, code_content, old_language_str, old_message_str
-        if language_str and old_language_str != language_str:
-            typed_chars = language_str[len(old_language_str) :]
-            if task_opt.streaming and len(typed_chars) > 0:
+            elif typing_state == TypingState.CODE:
                 await queue.put(
                     TaskResponse(
-                        state=task_context.to_context_state_proto(),
+                        state=task_context.to_streaming_state_proto(),
                         response_type=TaskResponse.OnModelTypeCode,
-                        typing_content=TypingContent(content="", language=language_str),
+                        typing_content=TypingContent(
+                            content=typed_chars, language="text"
+                        ),
                         context_id=task_context.context_id,
                     )
                 )
-            return old_text_content, old_code_content, language_str, old_message_str
-        if message_str and old_message_str != message_str:
-            typed_chars = message_str[len(old_message_str) :]
-            if task_opt.streaming and len(typed_chars) > 0:
+            elif typing_state == TypingState.LANGUAGE:
                 await queue.put(
                     TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnModelTypeText,
-                        typing_content=TypingContent(
-                            content=typed_chars, language="text"
-                        ),
+                        state=task_context.to_streaming_state_proto(),
+                        response_type=TaskResponse.OnModelTypeCode,
+                        typing_content=TypingContent(content="", language=typed_chars),
                         context_id=task_context.context_id,
                     )
                 )
 
-            return old_text_content, old_code_content, old_language_str, message_str
-        return old_text_content, old_code_content, old_language_str, old_message_str
-
     async def extract_message(
         self,
         response_generator,
@@ -332,11 +340,9 @@ class BaseAgent:
         extract the chunk from the response generator
         """
         message = {}
-        text_content = ""
-        code_content = ""
-        language_str = ""
-        message_str = ""
-        context_output_token_count = task_context.output_token_count
+        typing_parser = None
+        arguments_token_counter = TokenCounter(encoding)
+        content_token_counter = TokenCounter(encoding)
         start_time = time.time()
         async for chunk in response_generator:
             if rpc_context.done():
@@ -349,34 +355,22 @@ class BaseAgent:
             self.model_name = chunk.get("model", "")
             delta = chunk["choices"][0]["delta"]
             if "function_call" in delta:
+                arguments_delta = delta["function_call"].get("arguments", "")
                 self._merge_delta_for_function_call(message, delta)
-                response_token_count = self._get_message_token_count(message)
-                task_context.output_token_count = (
-                    response_token_count + context_output_token_count
+                task_context.output_token_count += arguments_token_counter.feed(
+                    arguments_delta
                 )
                 task_context.llm_response_duration += int(
                     (time.time() - start_time) * 1000
                 )
                 start_time = time.time()
-                (
-                    new_text_content,
-                    new_code_content,
-                    new_language_str,
-                    new_message_str,
-                ) = await self._read_function_call_message(
-                    message,
-                    queue,
-                    text_content,
-                    code_content,
-                    message_str,
-                    language_str,
-                    task_context,
-                    task_opt,
+                if not typing_parser:
+                    typing_parser = TypingParser(
+                        is_code=message["function_call"].get("name", "") == "python"
+                    )
+                await self._send_typing_message(
+                    typing_parser, arguments_delta, queue, task_context, task_opt
                 )
-                text_content = new_text_content
-                code_content = new_code_content
-                message_str = new_message_str
-                language_str = new_language_str
             else:
                 self._merge_delta_for_content(message, delta)
                 task_context.llm_response_duration += int(
@@ -384,35 +378,23 @@ class BaseAgent:
                 )
                 start_time = time.time()
                 if message.get("content") != None:
-                    response_token_count = self._get_message_token_count(message)
-                    task_context.output_token_count = (
-                        response_token_count + context_output_token_count
+                    task_context.output_token_count += content_token_counter.feed(
+                        delta.get("content")
                     )
                     if is_json_format:
-                        (
-                            new_text_content,
-                            new_code_content,
-                            new_language_str,
-                            new_message_str,
-                        ) = await self._read_json_message(
-                            message,
+                        if not typing_parser:
+                            typing_parser = TypingParser()
+                        await self._send_typing_message(
+                            typing_parser,
+                            delta.get("content"),
                             queue,
-                            text_content,
-                            code_content,
-                            message_str,
-                            language_str,
                             task_context,
                             task_opt,
                         )
-                        text_content = new_text_content
-                        code_content = new_code_content
-                        message_str = new_message_str
-                        language_str = new_language_str
-
                     elif task_opt.streaming and delta.get("content"):
                         await queue.put(
                             TaskResponse(
-                                state=task_context.to_context_state_proto(),
+                                state=task_context.to_streaming_state_proto(),
                                 response_type=TaskResponse.OnModelTypeText,
                                 typing_content=TypingContent(
                                     content=delta["content"], language="text"
@@ -436,80 +418,90 @@ class BaseAgent:
         is_alive = await self.kernel_sdk.is_alive()
         if not is_alive:
             await self.kernel_sdk.start(kernel_name="python3")
-        async for kernel_respond in self.kernel_sdk.execute(code=code):
-            if context.done():
-                logger.debug(
-                    "the context is not active and the client cancelled the request"
-                )
-                break
-            # process the stdout
-            if kernel_respond.output_type == ExecuteResponse.StdoutType:
-                kernel_output = json.loads(kernel_respond.output)["text"]
-                console_stdout += kernel_output
-                console_stdout = process_char_stream(console_stdout)
-                logger.debug(f"the new stdout {console_stdout}")
-                yield (
-                    None,
-                    TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnStepActionStreamStdout,
-                        console_stdout=kernel_output,
-                        context_id=task_context.context_id,
-                    ),
-                )
-            # process the stderr
-            elif kernel_respond.output_type == ExecuteResponse.StderrType:
-                kernel_err = json.loads(kernel_respond.output)["text"]
-                console_stderr += kernel_err
-                console_stderr = process_char_stream(console_stderr)
-                logger.debug(f"the new stderr {console_stderr}")
-                yield (
-                    None,
-                    TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnStepActionStreamStderr,
-                        console_stderr=kernel_err,
-                        context_id=task_context.context_id,
-                    ),
-                )
-            elif kernel_respond.output_type == ExecuteResponse.TracebackType:
-                traceback = json.loads(kernel_respond.output)["traceback"]
-                console_stderr += traceback
-                logger.debug(f"the new traceback {console_stderr}")
-                has_error = True
-                yield (
-                    None,
-                    TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnStepActionStreamStderr,
-                        console_stderr=traceback,
-                        context_id=task_context.context_id,
-                    ),
-                )
-            else:
-                has_result = True
-                result = json.loads(kernel_respond.output)
-                logger.debug(f"the result {result}")
-                if "image/gif" in result:
-                    console_stdout = result["image/gif"]
-                elif "image/png" in result:
-                    console_stdout = result["image/png"]
-                elif "text/plain" in result:
-                    console_stdout = result["text/plain"]
-                    console_stdout = bytes(console_stdout, "utf-8").decode(
-                        "unicode_escape"
+        kernel_responds = self.kernel_sdk.execute(
+            code=code,
+            typed_output=True,
+            timeout=task_context.remaining_time(),
+        )
+        try:
+            async for kernel_respond in kernel_responds:
+                if context.done():
+                    logger.debug(
+                        "the context is not active and the client cancelled the request"
                     )
-                    if console_stdout.startswith("'") and console_stdout.endswith("'"):
-                        console_stdout = console_stdout[1 : len(console_stdout) - 1]
-                yield (
-                    None,
-                    TaskResponse(
-                        state=task_context.to_context_state_proto(),
-                        response_type=TaskResponse.OnStepActionStreamStdout,
-                        console_stdout=console_stdout,
-                        context_id=task_context.context_id,
-                    ),
-                )
+                    break
+                # process the stdout
+                if kernel_respond.output_type == ExecuteResponse.StdoutType:
+                    kernel_output = get_execute_output(kernel_respond)
+                    console_stdout += kernel_output
+                    console_stdout = process_char_stream(console_stdout)
+                    logger.debug(f"the new stdout {console_stdout}")
+                    yield (
+                        None,
+                        TaskResponse(
+                            state=task_context.to_streaming_state_proto(),
+                            response_type=TaskResponse.OnStepActionStreamStdout,
+                            console_stdout=kernel_output,
+                            context_id=task_context.context_id,
+                        ),
+                    )
+                # process the stderr
+                elif kernel_respond.output_type == ExecuteResponse.StderrType:
+                    kernel_err = get_execute_output(kernel_respond)
+                    console_stderr += kernel_err
+                    console_stderr = process_char_stream(console_stderr)
+                    logger.debug(f"the new stderr {console_stderr}")
+                    yield (
+                        None,
+                        TaskResponse(
+                            state=task_context.to_streaming_state_proto(),
+                            response_type=TaskResponse.OnStepActionStreamStderr,
+                            console_stderr=kernel_err,
+                            context_id=task_context.context_id,
+                        ),
+                    )
+                elif kernel_respond.output_type == ExecuteResponse.TracebackType:
+                    traceback = get_execute_output(kernel_respond)
+                    console_stderr += traceback
+                    logger.debug(f"the new traceback {console_stderr}")
+                    has_error = True
+                    yield (
+                        None,
+                        TaskResponse(
+                            state=task_context.to_streaming_state_proto(),
+                            response_type=TaskResponse.OnStepActionStreamStderr,
+                            console_stderr=traceback,
+                            context_id=task_context.context_id,
+                        ),
+                    )
+                else:
+                    has_result = True
+                    result = get_execute_output(kernel_respond)
+                    logger.debug(f"the result {result}")
+                    if "image/gif" in result:
+                        console_stdout = result["image/gif"]
+                    elif "image/png" in result:
+                        console_stdout = result["image/png"]
+                    elif "text/plain" in result:
+                        console_stdout = result["text/plain"]
+                        console_stdout = bytes(console_stdout, "utf-8").decode(
+                            "unicode_escape"
+                        )
+                        if console_stdout.startswith("'") and console_stdout.endswith("'"):
+                            console_stdout = console_stdout[1 : len(console_stdout) - 1]
+                    yield (
+                        None,
+                        TaskResponse(
+                            state=task_context.to_streaming_state_proto(),
+                            response_type=TaskResponse.OnStepActionStreamStdout,
+                            console_stdout=console_stdout,
+                            context_id=task_context.context_id,
+                        ),
+                    )
+        finally:
+            # the kernel server interrupts only the code of this call, the kernel
+            # is shared with the other tasks of the key
+            await kernel_responds.aclose()
         output_files = []
         filename = parse_image_filename(console_stdout)
         if filename:
@@ -4,7 +4,6 @@
 # SPDX-License-Identifier: Elastic-2.0
 
 """ """
-import json
 import aiohttp
 import logging
 
@@ -12,18 +11,86 @@ logger = logging.getLogger(__name__)
 
 
 class BaseStreamClient:
+    """
+    The stream client with a long-lived session, the connections to the endpoint
+    are kept alive and reused by the requests
+    """
 
-    def __init__(self, endpoint, key):
+    def __init__(
+        self,
+        endpoint,
+        key,
+        pool_size=16,
+        keepalive_timeout=60,
+        dns_cache_ttl=300,
+        request_timeout=600,
+        connect_timeout=10,
+    ):
         self.endpoint = endpoint
         self.key = key
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.timeout = aiohttp.ClientTimeout(
+            total=request_timeout, sock_connect=connect_timeout
+        )
+        self.session = None
 
-    async def arun(self, request_data):
-        logging.debug(f"{request_data}")
-        headers = {"Authorization": self.key}
-        async with aiohttp.ClientSession(
-            headers=headers, raise_for_status=True
-        ) as session:
-            async with session.post(self.endpoint, json=request_data) as r:
-                async for line in r.content:
-                    if line:
-                        yield line
+    def _get_session(self):
+        # the session must be created in the running event loop
+        if not self.session or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self.session = aiohttp.ClientSession(
+                headers={"Authorization": self.key},
+                connector=connector,
+                timeout=self.timeout,
+                raise_for_status=True,
+            )
+        return self.session
+
+    def _request_options(self, timeout):
+        options = {}
+        if timeout:
+            options["timeout"] = aiohttp.ClientTimeout(
+                total=timeout, sock_connect=self.timeout.sock_connect
+            )
+        return options
+
+    async def arun(self, request_data, timeout=None):
+        """
+        post the request and yield the lines of the response
+        timeout: the total timeout in seconds of this request
+        """
+        logger.debug("request data %s", request_data)
+        session = self._get_session()
+        async with session.post(
+            self.endpoint, json=request_data, **self._request_options(timeout)
+        ) as r:
+            async for line in r.content:
+                if line:
+                    yield line
+
+    async def arun_chunks(self, request_data, timeout=None):
+        """
+        post the request and yield the chunks of the response as they arrive
+        timeout: the total timeout in seconds of this request
+        """
+        logger.debug("request data %s", request_data)
+        session = self._get_session()
+        async with session.post(
+            self.endpoint, json=request_data, **self._request_options(timeout)
+        ) as r:
+            async for chunk in r.content.iter_any():
+                yield chunk
+
+    async def close(self):
+        """
+        close the session and the pooled connections
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
@@ -16,21 +16,24 @@ from .base_agent import BaseAgent, TypingState, TaskContext
 from og_memory.memory import AgentMemoryOption
 from .prompt import FUNCTION_DIRECT_MESSAGE, FUNCTION_EXECUTE
 from .tokenizer import tokenize
-import tiktoken
 
 logger = logging.getLogger(__name__)
-encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 
 class LlamaAgent(BaseAgent):
 
-    def __init__(self, client, kernel_sdk):
-        super().__init__(kernel_sdk)
+    def __init__(self, client, kernel_sdk, context_token_limit=0, memory_store=None):
+        super().__init__(kernel_sdk, memory_store=memory_store)
         self.client = client
         self.memory_option = AgentMemoryOption(
-            show_function_instruction=True, disable_output_format=False
+            show_function_instruction=True,
+            disable_output_format=False,
+            context_token_limit=context_token_limit,
         )
 
+    async def close(self):
+        await self.client.close()
+
     def _output_exception(self):
         return (
             "Sorry, the LLM did return nothing, You can use a better performance model"
@@ -103,15 +106,12 @@ class LlamaAgent(BaseAgent):
         """
         call llama api
         """
-        input_token_count = 0
-        messages = agent_memory.to_messages()
-        for message in messages:
-            if not message["content"]:
-                continue
-            input_token_count += len(encoding.encode(message["content"]))
+        messages, input_token_count = agent_memory.to_messages_with_token_count()
         task_context.input_token_count += input_token_count
         start_time = time.time()
-        response = self.client.chat(messages, "llama", max_tokens=2048)
+        response = self.client.chat(
+            messages, "llama", max_tokens=2048, timeout=task_context.remaining_time()
+        )
         message = await self.extract_message(
             response,
             queue,
@@ -131,11 +131,22 @@ class LlamaAgent(BaseAgent):
         context_id = (
             request.context_id
             if request.context_id
-            else self.create_new_memory_with_default_prompt(
-                "", "", actions=[FUNCTION_EXECUTE, FUNCTION_DIRECT_MESSAGE]
+            else await self.create_new_memory_with_default_prompt(
+                "", self.user_id, actions=[FUNCTION_EXECUTE, FUNCTION_DIRECT_MESSAGE]
             )
         )
-        if context_id not in self.agent_memories:
+        task_context = TaskContext(
+            start_time=time.time(),
+            output_token_count=0,
+            input_token_count=0,
+            llm_name="llama",
+            llm_respond_duration=0,
+            state_interval=self.state_interval,
+            state_on_every_message=task_opt.state_on_every_message,
+            deadline=time.time() + task_opt.timeout if task_opt.timeout else 0,
+        )
+        agent_memory = await self.get_memory(context_id)
+        if not agent_memory:
             await queue.put(
                 TaskResponse(
                     state=task_context.to_context_state_proto(),
@@ -145,18 +156,10 @@ class LlamaAgent(BaseAgent):
                 )
             )
             return
-        agent_memory = self.agent_memories[context_id]
         agent_memory.update_options(self.memory_option)
         agent_memory.append_chat_message(
             {"role": "user", "content": question},
         )
-        task_context = TaskContext(
-            start_time=time.time(),
-            output_token_count=0,
-            input_token_count=0,
-            llm_name="llama",
-            llm_respond_duration=0,
-        )
         try:
             while not context.done():
                 if task_context.input_token_count >= task_opt.input_token_limit:
@@ -291,4 +294,5 @@ class LlamaAgent(BaseAgent):
             )
             await queue.put(response)
         finally:
+            await self.memory_store.put(agent_memory)
             await queue.put(None)
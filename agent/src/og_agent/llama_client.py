@@ -6,21 +6,27 @@
 
 """ """
 
-import json
-import aiohttp
 import logging
 from .base_stream_client import BaseStreamClient
+from .sse_decoder import SSEDecoder, json_loads
 
 logger = logging.getLogger(__name__)
 
 
 class LlamaClient(BaseStreamClient):
 
-    def __init__(self, endpoint, key, grammar):
-        super().__init__(endpoint + "/v1/chat/completions", key)
+    def __init__(self, endpoint, key, grammar, pool_size=16, request_timeout=600):
+        super().__init__(
+            endpoint + "/v1/chat/completions",
+            key,
+            pool_size=pool_size,
+            request_timeout=request_timeout,
+        )
         self.grammar = grammar
 
-    async def chat(self, messages, model, temperature=0, max_tokens=1024, stop=["\n"]):
+    async def chat(
+        self, messages, model, temperature=0, max_tokens=1024, stop=["\n"], timeout=None
+    ):
         data = {
             "messages": messages,
             "temperature": temperature,
@@ -32,14 +38,20 @@ class LlamaClient(BaseStreamClient):
         }
         if stop:
             data["stop"] = stop
-        async for line in self.arun(data):
-            if len(line) < 6:
-                continue
-            try:
-                content = line[6:]
-                logger.debug(f"llama response content: {content}")
-                message = json.loads(content)
+        decoder = SSEDecoder()
+        async for chunk in self.arun_chunks(data, timeout=timeout):
+            for event in decoder.feed(chunk):
+                message = self._decode(event)
+                if message is not None:
+                    yield message
+        for event in decoder.close():
+            message = self._decode(event)
+            if message is not None:
                 yield message
-            except Exception as e:
-                logger.error("error: %s, content: %s", e, content)
-                continue
+
+    def _decode(self, event):
+        try:
+            return json_loads(event)
+        except Exception as e:
+            logger.error("error: %s, content: %s", e, event)
+            return None
@@ -0,0 +1,70 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+import base64
+import logging
+from datetime import datetime
+from og_memory.memory import MemoryAgentMemory
+from og_memory.store import BaseMemoryStore
+from og_proto.memory_pb2 import AgentMemory
+
+logger = logging.getLogger(__name__)
+
+
+class OrmMemoryStore(BaseMemoryStore):
+    """
+    The memory store based on the orm model with the following fields
+    memory_id: the id of memory
+    memory: the base64 of the serialized AgentMemory message
+    time: the last update time
+
+    The queries are built with the table of the model and executed by the
+    database of the model registry
+    """
+
+    def __init__(self, model):
+        self.table = model.table
+        self.database = model.registry.database
+
+    async def _connect(self):
+        if not self.database.is_connected:
+            await self.database.connect()
+
+    async def get(self, memory_id):
+        await self._connect()
+        record = await self.database.fetch_one(
+            self.table.select().where(self.table.c.memory_id == memory_id)
+        )
+        if not record:
+            return None
+        memory_proto = AgentMemory()
+        memory_proto.ParseFromString(base64.b64decode(record.memory))
+        return MemoryAgentMemory.from_proto(memory_proto)
+
+    async def put(self, memory):
+        await self._connect()
+        data = base64.b64encode(memory.to_proto().SerializeToString()).decode()
+        async with self.database.transaction():
+            record = await self.database.fetch_one(
+                self.table.select().where(self.table.c.memory_id == memory.memory_id)
+            )
+            if record:
+                query = self.table.update().where(
+                    self.table.c.memory_id == memory.memory_id
+                )
+            else:
+                query = self.table.insert()
+            await self.database.execute(
+                query.values(
+                    memory_id=memory.memory_id, memory=data, time=datetime.now()
+                )
+            )
+
+    async def delete(self, memory_id):
+        await self._connect()
+        await self.database.execute(
+            self.table.delete().where(self.table.c.memory_id == memory_id)
+        )
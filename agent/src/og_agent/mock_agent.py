@@ -31,7 +31,7 @@ class MockAgent(BaseAgent):
         if message.get("explanation", None):
             await queue.put(
                 TaskResponse(
-                    state=task_context.to_context_state_proto(),
+                    state=task_context.to_streaming_state_proto(),
                     response_type=TaskResponse.OnModelTypeText,
                     typing_content=TypingContent(
                         content=message["explanation"], language="text"
@@ -41,7 +41,7 @@ class MockAgent(BaseAgent):
         if message.get("code", None):
             await queue.put(
                 TaskResponse(
-                    state=task_context.to_context_state_proto(),
+                    state=task_context.to_streaming_state_proto(),
                     response_type=TaskResponse.OnModelTypeCode,
                     typing_content=TypingContent(
                         content=message["code"], language="python"
@@ -87,6 +87,9 @@ class MockAgent(BaseAgent):
             input_token_count=10,
             llm_name="mock",
             llm_respond_duration=1000,
+            state_interval=self.state_interval,
+            state_on_every_message=task_opt.state_on_every_message,
+            deadline=time.time() + task_opt.timeout if task_opt.timeout else 0,
         )
         iteration = 0
         try:
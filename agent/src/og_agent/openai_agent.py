@@ -14,35 +14,38 @@ from og_proto.agent_server_pb2 import OnStepActionStart, TaskResponse, OnStepAct
 from .base_agent import BaseAgent, TypingState, TaskContext
 from .tokenizer import tokenize
 from og_memory.memory import AgentMemoryOption
-import tiktoken
 
 logger = logging.getLogger(__name__)
-encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 
 class OpenaiAgent(BaseAgent):
 
-    def __init__(self, model, sdk, is_azure=True):
-        super().__init__(sdk)
+    def __init__(
+        self, model, sdk, is_azure=True, context_token_limit=0, memory_store=None
+    ):
+        super().__init__(sdk, memory_store=memory_store)
         self.model = model
         logger.info(f"use openai model {model} is_azure {is_azure}")
         self.is_azure = is_azure
         self.model_name = model if not is_azure else ""
         self.memory_option = AgentMemoryOption(
-            show_function_instruction=False, disable_output_format=True
+            show_function_instruction=False,
+            disable_output_format=True,
+            context_token_limit=context_token_limit,
         )
 
+    def _function_output(self, output):
+        # the memory trims the output to the context token limit if it is set
+        if self.memory_option.context_token_limit > 0:
+            return output
+        return output[0:500]
+
     async def call_openai(self, agent_memory, queue, context, task_context, task_opt):
         """
         call the openai api
         """
-        input_token_count = 0
-        messages = agent_memory.to_messages()
+        messages, input_token_count = agent_memory.to_messages_with_token_count()
         logger.debug(f"call openai with messages {messages}")
-        for message in messages:
-            if not message["content"]:
-                continue
-            input_token_count += len(encoding.encode(message["content"]))
         task_context.input_token_count += input_token_count
         start_time = time.time()
         if self.is_azure:
@@ -53,6 +56,7 @@ class OpenaiAgent(BaseAgent):
                 functions=agent_memory.get_functions(),
                 function_call="auto",
                 stream=True,
+                request_timeout=task_context.remaining_time(),
             )
         else:
             response = await openai.ChatCompletion.acreate(
@@ -62,6 +66,7 @@ class OpenaiAgent(BaseAgent):
                 functions=agent_memory.get_functions(),
                 function_call="auto",
                 stream=True,
+                request_timeout=task_context.remaining_time(),
             )
         message = await self.extract_message(
             response, queue, context, task_context, task_opt, start_time
@@ -147,7 +152,7 @@ class OpenaiAgent(BaseAgent):
         context_id = (
             request.context_id
             if request.context_id
-            else self.create_new_memory_with_default_prompt("", "")
+            else await self.create_new_memory_with_default_prompt("", self.user_id)
         )
         task_context = TaskContext(
             start_time=time.time(),
@@ -156,8 +161,12 @@ class OpenaiAgent(BaseAgent):
             llm_name=self.model_name,
             llm_respond_duration=0,
             context_id=context_id,
+            state_interval=self.state_interval,
+            state_on_every_message=task_opt.state_on_every_message,
+            deadline=time.time() + task_opt.timeout if task_opt.timeout else 0,
         )
-        if context_id not in self.agent_memories:
+        agent_memory = await self.get_memory(context_id)
+        if not agent_memory:
             await queue.put(
                 TaskResponse(
                     state=task_context.to_context_state_proto(),
@@ -167,7 +176,6 @@ class OpenaiAgent(BaseAgent):
                 )
             )
             return
-        agent_memory = self.agent_memories[context_id]
         agent_memory.update_options(self.memory_option)
         agent_memory.append_chat_message(
             {"role": "user", "content": task},
@@ -225,24 +233,29 @@ class OpenaiAgent(BaseAgent):
                         )
                     )
                     function_name = chat_message["function_call"]["name"]
-                    # TODO optimize the token limitation
                     if function_result.has_result:
                         agent_memory.append_chat_message({
                             "role": "function",
                             "name": function_name,
-                            "content": function_result.console_stdout[0:500],
+                            "content": self._function_output(
+                                function_result.console_stdout
+                            ),
                         })
                     elif function_result.has_error:
                         agent_memory.append_chat_message({
                             "role": "function",
                             "name": function_name,
-                            "content": function_result.console_stderr[0:500],
+                            "content": self._function_output(
+                                function_result.console_stderr
+                            ),
                         })
                     else:
                         agent_memory.append_chat_message({
                             "role": "function",
                             "name": function_name,
-                            "content": function_result.console_stdout[0:500],
+                            "content": self._function_output(
+                                function_result.console_stdout
+                            ),
                         })
                 else:
                     # end task
@@ -268,4 +281,5 @@ class OpenaiAgent(BaseAgent):
             )
             await queue.put(response)
         finally:
+            await self.memory_store.put(agent_memory)
             await queue.put(None)
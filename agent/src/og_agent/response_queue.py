@@ -0,0 +1,165 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import asyncio
+import logging
+from collections import deque
+from og_proto.agent_server_pb2 import TaskResponse
+
+logger = logging.getLogger(__name__)
+
+"""
+The bounded queue between the agent and the grpc stream of a task
+
+When the queue is full, the block policy makes the agent wait for the client and
+the coalesce policy merges the typing or stdout delta into the last queued
+response of the same type, the agent only waits if the response can not be merged
+
+The consumer can also merge the consecutive typing deltas arriving within a short
+window into one response with get_coalesced
+
+Typical usage example:
+    queue = ResponseQueue(maxsize=256, policy=ResponseQueue.COALESCE)
+    await queue.put(respond)
+    respond = await queue.get_coalesced(window=0.03, max_chars=256)
+"""
+
+# the response types whose text can be appended to the previous one
+MERGEABLE_TYPES = {
+    TaskResponse.OnModelTypeText: "typing_content",
+    TaskResponse.OnModelTypeCode: "typing_content",
+    TaskResponse.OnStepActionStreamStdout: "console_stdout",
+    TaskResponse.OnStepActionStreamStderr: "console_stderr",
+}
+
+TYPING_TYPES = {TaskResponse.OnModelTypeText, TaskResponse.OnModelTypeCode}
+
+# the marker of no pending response, None is the end of the task
+_NO_PENDING = object()
+
+
+def merge_response(last, respond) -> bool:
+    """
+    append the text of the respond to the last one and return False if they can
+    not be merged
+    """
+    if last is None or respond is None:
+        return False
+    field = MERGEABLE_TYPES.get(respond.response_type)
+    if (
+        not field
+        or last.response_type != respond.response_type
+        or last.context_id != respond.context_id
+        or last.WhichOneof("body") != respond.WhichOneof("body")
+    ):
+        return False
+    if field == "typing_content":
+        # the language change of the code is not merged
+        if last.typing_content.language != respond.typing_content.language:
+            return False
+        last.typing_content.content += respond.typing_content.content
+    else:
+        setattr(last, field, getattr(last, field) + getattr(respond, field))
+    if respond.HasField("state"):
+        last.state.CopyFrom(respond.state)
+    return True
+
+
+class ResponseQueueMetrics:
+    """
+    the metrics of the response queues of the agent server
+    """
+
+    def __init__(self):
+        # the number of the queued responses of all the tasks
+        self.depth = 0
+        self.max_depth = 0
+        # the number of the responses merged into the queued ones
+        self.coalesced = 0
+        # the number of the puts waiting for a full queue
+        self.blocked = 0
+        # the number of the typing deltas merged by the consumer
+        self.typing_merged = 0
+
+
+class ResponseQueue(asyncio.Queue):
+    BLOCK = "block"
+    COALESCE = "coalesce"
+
+    def __init__(self, maxsize=256, policy=COALESCE, metrics=None):
+        if policy not in [self.BLOCK, self.COALESCE]:
+            raise ValueError(f"unsupported response queue policy {policy}")
+        super().__init__(maxsize)
+        self.policy = policy
+        self.metrics = metrics if metrics else ResponseQueueMetrics()
+        self.max_depth = 0
+        self.coalesced = 0
+        self.blocked = 0
+        self.typing_merged = 0
+        # the response got by get_coalesced but not merged
+        self.pending = _NO_PENDING
+
+    def _init(self, maxsize):
+        self._queue = deque()
+
+    def _put(self, item):
+        self._queue.append(item)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self.metrics.depth += 1
+        self.metrics.max_depth = max(self.metrics.max_depth, self.metrics.depth)
+
+    def _get(self):
+        self.metrics.depth -= 1
+        return self._queue.popleft()
+
+    async def put(self, item):
+        if self.full():
+            if (
+                self.policy == self.COALESCE
+                and self._queue
+                and merge_response(self._queue[-1], item)
+            ):
+                self.coalesced += 1
+                self.metrics.coalesced += 1
+                return
+            self.blocked += 1
+            self.metrics.blocked += 1
+        await super().put(item)
+
+    async def get_coalesced(self, window: float = 0.03, max_chars: int = 256):
+        """
+        get the next response and merge the following typing deltas into it until
+        the window in seconds expires or the content reaches max_chars
+        """
+        if self.pending is not _NO_PENDING:
+            respond, self.pending = self.pending, _NO_PENDING
+        else:
+            respond = await self.get()
+        if not respond or respond.response_type not in TYPING_TYPES or window <= 0:
+            return respond
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + window
+        while len(respond.typing_content.content) < max_chars:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                following = await asyncio.wait_for(self.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if not merge_response(respond, following):
+                self.pending = following
+                break
+            self.typing_merged += 1
+            self.metrics.typing_merged += 1
+        return respond
+
+    def close(self):
+        """
+        drop the queued responses when the task ends
+        """
+        self.metrics.depth -= len(self._queue)
+        self._queue.clear()
+        self.pending = _NO_PENDING
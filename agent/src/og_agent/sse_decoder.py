@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# decode the json with orjson if it is available
+json_loads = orjson.loads if orjson else json.loads
+
+DONE = b"[DONE]"
+
+
+class SSEDecoder:
+    """
+    Decode the server-sent events from the chunks of a byte stream
+
+    The chunk can end in the middle of a line, the partial line is buffered until
+    the next chunk. The data lines of an event are joined with a newline and the
+    event is dispatched at a blank line. The [DONE] event ends the stream
+
+    Typical usage example:
+        decoder = SSEDecoder()
+        async for chunk in response.content.iter_any():
+            for data in decoder.feed(chunk):
+                message = json_loads(data)
+        for data in decoder.close():
+            message = json_loads(data)
+    """
+
+    def __init__(self):
+        self.buffer = b""
+        self.data_lines = []
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        feed a chunk and return the data of the completed events
+        """
+        if self.done:
+            return []
+        lines = (self.buffer + chunk).split(b"\n")
+        self.buffer = lines.pop()
+        events = []
+        for line in lines:
+            self._process_line(line, events)
+            if self.done:
+                break
+        return events
+
+    def close(self):
+        """
+        dispatch the pending event at the end of the stream
+        """
+        events = []
+        if not self.done and self.buffer:
+            self._process_line(self.buffer, events)
+        self.buffer = b""
+        if not self.done:
+            self._dispatch(events)
+        return events
+
+    def _process_line(self, line, events):
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        if not line:
+            self._dispatch(events)
+        elif line.startswith(b"data:"):
+            value = line[5:]
+            self.data_lines.append(value[1:] if value.startswith(b" ") else value)
+        # the comments and the other fields eg event, id and retry are ignored
+
+    def _dispatch(self, events):
+        if not self.data_lines:
+            return
+        data = (
+            self.data_lines[0]
+            if len(self.data_lines) == 1
+            else b"\n".join(self.data_lines)
+        )
+        self.data_lines = []
+        if data == DONE:
+            self.done = True
+            return
+        events.append(data)
@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+from itertools import accumulate
+
+
+class TokenCounter:
+    """
+    Count the tokens of a streaming text incrementally
+
+    Only a small tail of the text is re-encoded for every delta. The prefix of the
+    tail is committed at a safe boundary(a token followed by a token starting
+    with a space), so the BPE merges across the chunk boundaries are counted
+    the same as encoding the whole text
+
+    Typical usage example:
+        counter = TokenCounter(encoding)
+        for delta in deltas:
+            task_context.output_token_count += counter.feed(delta)
+    """
+
+    def __init__(self, encoding, tail_size=32):
+        self.encoding = encoding
+        self.tail_size = tail_size
+        self.committed_count = 0
+        self.tail = ""
+        self.count = 0
+
+    def feed(self, delta):
+        """
+        feed the delta and return the change of the token count
+        """
+        if not delta:
+            return 0
+        self.tail += delta
+        tokens = self.encoding.encode(self.tail)
+        old_count = self.count
+        self.count = self.committed_count + len(tokens)
+        if len(tokens) > self.tail_size * 2:
+            self._commit(tokens)
+        return self.count - old_count
+
+    def _commit(self, tokens):
+        token_bytes = [self.encoding.decode_single_token_bytes(t) for t in tokens]
+        offsets = list(accumulate([len(b) for b in token_bytes]))
+        cut = None
+        for index in range(len(tokens) - self.tail_size - 1, -1, -1):
+            if token_bytes[index + 1].startswith(b" ") and not (
+                token_bytes[index][-1:].isspace()
+            ):
+                cut = index + 1
+                break
+        raw = self.tail.encode("utf-8")
+        if cut is None and len(tokens) > self.tail_size * 8:
+            # no safe boundary in a long run of text eg the chinese text, so
+            # fallback to a token boundary that is also a char boundary
+            for index in range(len(tokens) - self.tail_size - 1, -1, -1):
+                if raw[offsets[index] : offsets[index] + 1][0] & 0xC0 != 0x80:
+                    cut = index + 1
+                    break
+        if cut is None:
+            return
+        self.committed_count += cut
+        self.tail = raw[offsets[cut - 1] :].decode("utf-8")
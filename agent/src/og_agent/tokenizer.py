@@ -52,6 +52,16 @@ class State:
     UNICODE_SURROGATE = 25
 
 
+# the states that the tokenizer is in the middle of a string
+STRING_STATES = (
+    State.STRING,
+    State.STRING_ESCAPE,
+    State.UNICODE,
+    State.UNICODE_SURROGATE_START,
+    State.UNICODE_SURROGATE_STRING_ESCAPE,
+    State.UNICODE_SURROGATE,
+)
+
 class SpecialChar:
     # Kind of a hack but simple: if we used the empty string "" to represent
     # EOF, expressions like `char in "0123456789"` would be true for EOF, which
@@ -90,41 +100,83 @@ def _ensure_text(stream):
     return stream
 
 
-def tokenize(stream):
-    stream = _ensure_text(stream)
+def _is_delimiter(char):
+    return char.isspace() or char in "{}[]:," or char == SpecialChar.EOF
+
+
+class Tokenizer:
+    """
+    A resumable json tokenizer, the text can be fed piece by piece and the state
+    will be kept between the calls of `feed`
+
+    Typical usage example:
+        tokenizer = Tokenizer()
+        for delta in stream:
+            for _, token in tokenizer.feed(delta):
+                ...
+    """
 
-    def is_delimiter(char):
-        return char.isspace() or char in "{}[]:," or char == SpecialChar.EOF
+    def __init__(self):
+        self.state = State.WHITESPACE
+        self.token = []
+        self.unicode_buffer = ""
+        self.completed = False
+        self.now_token = ""
 
-    token = []
-    unicode_buffer = ""
-    completed = False
-    now_token = ""
+    def in_string(self):
+        """
+        return True if the tokenizer is in the middle of a string
+        """
+        return self.state in STRING_STATES
 
-    def process_char(char):
-        nonlocal token, completed, now_token, unicode_buffer
+    def feed(self, text):
+        """
+        Feed a piece of json text and yield the completed tokens with (None, token)
+
+        Raise ValueError if the text is not a valid json
+        """
+        index = 0
+        while index < len(text):
+            advance, self.state = self._process_char(text[index])
+            if self.completed:
+                self.completed = False
+                self.token = []
+                yield (None, self.now_token)
+            if advance:
+                index += 1
+
+    def close(self):
+        """
+        Notify the tokenizer that the end of text is reached
+        """
+        advance, self.state = self._process_char(SpecialChar.EOF)
+        if self.completed:
+            self.completed = False
+            yield (None, self.now_token)
+
+    def _process_char(self, char):
         advance = True
         add_char = False
-        next_state = state
-        if state == State.WHITESPACE:
+        next_state = self.state
+        if self.state == State.WHITESPACE:
             if char == "{":
-                completed = True
-                now_token = (TokenType.OPERATOR, "{")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, "{")
             elif char == "}":
-                completed = True
-                now_token = (TokenType.OPERATOR, "}")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, "}")
             elif char == "[":
-                completed = True
-                now_token = (TokenType.OPERATOR, "[")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, "[")
             elif char == "]":
-                completed = True
-                now_token = (TokenType.OPERATOR, "]")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, "]")
             elif char == ",":
-                completed = True
-                now_token = (TokenType.OPERATOR, ",")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, ",")
             elif char == ":":
-                completed = True
-                now_token = (TokenType.OPERATOR, ":")
+                self.completed = True
+                self.now_token = (TokenType.OPERATOR, ":")
             elif char == '"':
                 next_state = State.STRING
             elif char in "123456789":
@@ -144,7 +196,7 @@ def tokenize(stream):
                 next_state = State.NULL_1
             elif not char.isspace() and not char == SpecialChar.EOF:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.INTEGER:
+        elif self.state == State.INTEGER:
             if char in "0123456789":
                 add_char = True
             elif char == ".":
@@ -153,32 +205,32 @@ def tokenize(stream):
             elif char == "e" or char == "E":
                 next_state = State.INTEGER_EXP_0
                 add_char = True
-            elif is_delimiter(char):
+            elif _is_delimiter(char):
                 next_state = State.WHITESPACE
-                completed = True
-                now_token = (TokenType.NUMBER, int("".join(token)))
+                self.completed = True
+                self.now_token = (TokenType.NUMBER, int("".join(self.token)))
                 advance = False
             else:
                 raise ValueError(
                     "A number must contain only digits.  Got '{}'".format(char)
                 )
-        elif state == State.INTEGER_0:
+        elif self.state == State.INTEGER_0:
             if char == ".":
                 next_state = State.FLOATING_POINT_0
                 add_char = True
             elif char == "e" or char == "E":
                 next_state = State.INTEGER_EXP_0
                 add_char = True
-            elif is_delimiter(char):
+            elif _is_delimiter(char):
                 next_state = State.WHITESPACE
-                completed = True
-                now_token = (TokenType.NUMBER, 0)
+                self.completed = True
+                self.now_token = (TokenType.NUMBER, 0)
                 advance = False
             else:
                 raise ValueError(
                     "A 0 must be followed by a '.' or a 'e'.  Got '{0}'".format(char)
                 )
-        elif state == State.INTEGER_SIGN:
+        elif self.state == State.INTEGER_SIGN:
             if char == "0":
                 next_state = State.INTEGER_0
                 add_char = True
@@ -189,7 +241,7 @@ def tokenize(stream):
                 raise ValueError(
                     "A - must be followed by a digit.  Got '{0}'".format(char)
                 )
-        elif state == State.INTEGER_EXP_0:
+        elif self.state == State.INTEGER_EXP_0:
             if char == "+" or char == "-" or char in "0123456789":
                 next_state = State.INTEGER_EXP
                 add_char = True
@@ -199,12 +251,12 @@ def tokenize(stream):
                         char
                     )
                 )
-        elif state == State.INTEGER_EXP:
+        elif self.state == State.INTEGER_EXP:
             if char in "0123456789":
                 add_char = True
-            elif is_delimiter(char):
-                completed = True
-                now_token = (TokenType.NUMBER, float("".join(token)))
+            elif _is_delimiter(char):
+                self.completed = True
+                self.now_token = (TokenType.NUMBER, float("".join(self.token)))
                 next_state = State.WHITESPACE
                 advance = False
             else:
@@ -213,20 +265,20 @@ def tokenize(stream):
                         char
                     )
                 )
-        elif state == State.FLOATING_POINT:
+        elif self.state == State.FLOATING_POINT:
             if char in "0123456789":
                 add_char = True
             elif char == "e" or char == "E":
                 next_state = State.INTEGER_EXP_0
                 add_char = True
-            elif is_delimiter(char):
-                completed = True
-                now_token = (TokenType.NUMBER, float("".join(token)))
+            elif _is_delimiter(char):
+                self.completed = True
+                self.now_token = (TokenType.NUMBER, float("".join(self.token)))
                 next_state = State.WHITESPACE
                 advance = False
             else:
                 raise ValueError("A number must include only digits")
-        elif state == State.FLOATING_POINT_0:
+        elif self.state == State.FLOATING_POINT_0:
             if char in "0123456789":
                 next_state = State.FLOATING_POINT
                 add_char = True
@@ -234,66 +286,66 @@ def tokenize(stream):
                 raise ValueError(
                     "A number with a decimal point must be followed by a fractional part"
                 )
-        elif state == State.FALSE_1:
+        elif self.state == State.FALSE_1:
             if char == "a":
                 next_state = State.FALSE_2
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.FALSE_2:
+        elif self.state == State.FALSE_2:
             if char == "l":
                 next_state = State.FALSE_3
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.FALSE_3:
+        elif self.state == State.FALSE_3:
             if char == "s":
                 next_state = State.FALSE_4
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.FALSE_4:
+        elif self.state == State.FALSE_4:
             if char == "e":
                 next_state = State.WHITESPACE
-                completed = True
-                now_token = (TokenType.BOOLEAN, False)
+                self.completed = True
+                self.now_token = (TokenType.BOOLEAN, False)
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.TRUE_1:
+        elif self.state == State.TRUE_1:
             if char == "r":
                 next_state = State.TRUE_2
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.TRUE_2:
+        elif self.state == State.TRUE_2:
             if char == "u":
                 next_state = State.TRUE_3
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.TRUE_3:
+        elif self.state == State.TRUE_3:
             if char == "e":
                 next_state = State.WHITESPACE
-                completed = True
-                now_token = (TokenType.BOOLEAN, True)
+                self.completed = True
+                self.now_token = (TokenType.BOOLEAN, True)
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.NULL_1:
+        elif self.state == State.NULL_1:
             if char == "u":
                 next_state = State.NULL_2
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.NULL_2:
+        elif self.state == State.NULL_2:
             if char == "l":
                 next_state = State.NULL_3
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.NULL_3:
+        elif self.state == State.NULL_3:
             if char == "l":
                 next_state = State.WHITESPACE
-                completed = True
-                now_token = (TokenType.NULL, None)
+                self.completed = True
+                self.now_token = (TokenType.NULL, None)
             else:
                 raise ValueError("Invalid JSON character: '{0}'".format(char))
-        elif state == State.STRING:
+        elif self.state == State.STRING:
             if char == '"':
-                completed = True
-                now_token = (TokenType.STRING, "".join(token))
+                self.completed = True
+                self.now_token = (TokenType.STRING, "".join(self.token))
                 next_state = State.STRING_END
             elif char == "\\":
                 next_state = State.STRING_ESCAPE
@@ -301,8 +353,8 @@ def tokenize(stream):
                 raise ValueError("Unterminated string at end of file")
             else:
                 add_char = True
-        elif state == State.STRING_END:
-            if is_delimiter(char):
+        elif self.state == State.STRING_END:
+            if _is_delimiter(char):
                 advance = False
                 next_state = State.WHITESPACE
             else:
@@ -311,7 +363,7 @@ def tokenize(stream):
                         char
                     )
                 )
-        elif state == State.STRING_ESCAPE:
+        elif self.state == State.STRING_ESCAPE:
             next_state = State.STRING
             if char == "\\" or char == '"':
                 add_char = True
@@ -335,25 +387,25 @@ def tokenize(stream):
                 add_char = True
             elif char == "u":
                 next_state = State.UNICODE
-                unicode_buffer = ""
+                self.unicode_buffer = ""
             else:
                 raise ValueError("Invalid string escape: {}".format(char))
-        elif state == State.UNICODE:
+        elif self.state == State.UNICODE:
             if char == SpecialChar.EOF:
                 raise ValueError("Unterminated unicode literal at end of file")
-            unicode_buffer += char
-            if len(unicode_buffer) == 4:
+            self.unicode_buffer += char
+            if len(self.unicode_buffer) == 4:
                 try:
-                    code_point = int(unicode_buffer, 16)
+                    code_point = int(self.unicode_buffer, 16)
                 except ValueError:
-                    raise ValueError(f"Invalid unicode literal: \\u{unicode_buffer}")
+                    raise ValueError(f"Invalid unicode literal: \\u{self.unicode_buffer}")
                 char = chr(code_point)
                 if unicodedata.category(char) == SURROGATE:
                     next_state = State.UNICODE_SURROGATE_START
                 else:
                     next_state = State.STRING
                     add_char = True
-        elif state == State.UNICODE_SURROGATE_START:
+        elif self.state == State.UNICODE_SURROGATE_START:
             if char == "\\":
                 next_state = State.UNICODE_SURROGATE_STRING_ESCAPE
             elif char == SpecialChar.EOF:
@@ -361,7 +413,7 @@ def tokenize(stream):
             else:
                 raise ValueError(f"Unpaired UTF-16 surrogate")
 
-        elif state == State.UNICODE_SURROGATE_STRING_ESCAPE:
+        elif self.state == State.UNICODE_SURROGATE_STRING_ESCAPE:
             if char == "u":
                 next_state = State.UNICODE_SURROGATE
             elif char == SpecialChar.EOF:
@@ -369,17 +421,17 @@ def tokenize(stream):
             else:
                 raise ValueError(f"Unpaired UTF-16 surrogate")
 
-        elif state == State.UNICODE_SURROGATE:
+        elif self.state == State.UNICODE_SURROGATE:
             if char == SpecialChar.EOF:
                 raise ValueError("Unterminated unicode literal at end of file")
-            unicode_buffer += char
-            if len(unicode_buffer) == 8:
-                code_point_1 = int(unicode_buffer[:4], 16)
+            self.unicode_buffer += char
+            if len(self.unicode_buffer) == 8:
+                code_point_1 = int(self.unicode_buffer[:4], 16)
                 try:
-                    code_point_2 = int(unicode_buffer[4:], 16)
+                    code_point_2 = int(self.unicode_buffer[4:], 16)
                 except ValueError:
                     raise ValueError(
-                        f"Invalid unicode literal: \\u{unicode_buffer[4:]}"
+                        f"Invalid unicode literal: \\u{self.unicode_buffer[4:]}"
                     )
                 char = chr(code_point_2)
                 if unicodedata.category(char) != SURROGATE:
@@ -393,35 +445,22 @@ def tokenize(stream):
                     char = pair.decode("utf-16-le")
                 except ValueError:
                     raise ValueError(
-                        f"Error decoding UTF-16 surrogate pair \\u{unicode_buffer[:4]}\\u{unicode_buffer[4:]}"
+                        f"Error decoding UTF-16 surrogate pair \\u{self.unicode_buffer[:4]}\\u{self.unicode_buffer[4:]}"
                     )
                 next_state = State.STRING
                 add_char = True
 
         if add_char:
-            token.append(char)
+            self.token.append(char)
 
         return advance, next_state
 
-    state = State.WHITESPACE
-    c = stream.read(1)
-    index = 0
-    while c:
-        try:
-            advance, state = process_char(c)
-        except Exception as e:
-            yield (state, token)
-            break
-        if completed:
-            completed = False
-            token = []
-            yield (None, now_token)
-        if advance:
-            c = stream.read(1)
-            index += 1
+
+def tokenize(stream):
+    stream = _ensure_text(stream)
+    tokenizer = Tokenizer()
     try:
-        process_char(SpecialChar.EOF)
-        if completed:
-            yield (None, now_token)
+        yield from tokenizer.feed(stream.read())
+        yield from tokenizer.close()
     except Exception as e:
-        yield (state, token)
+        yield (tokenizer.state, tokenizer.token)
@@ -0,0 +1,63 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+
+import asyncio
+import logging
+import pytest
+from og_agent.admission import AdmissionController, AdmissionQueueFullError
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.asyncio
+async def test_per_key_cap():
+    controller = AdmissionController(max_running=4, max_running_per_key=1)
+    first = controller.enqueue("a")
+    second = controller.enqueue("a")
+    other = controller.enqueue("b")
+    assert first.admitted and other.admitted
+    assert not second.admitted
+    assert controller.position(second) == (1, 1)
+    controller.release(first)
+    assert await second.wait(1)
+    assert controller.running == 2
+
+
+@pytest.mark.asyncio
+async def test_round_robin():
+    controller = AdmissionController(max_running=1, max_running_per_key=0)
+    running = controller.enqueue("batch")
+    batch = [controller.enqueue("batch") for i in range(3)]
+    interactive = controller.enqueue("user")
+    assert controller.position(batch[0]) == (1, 4)
+    assert controller.position(interactive) == (2, 4)
+    assert controller.position(batch[2]) == (4, 4)
+    order = []
+    current = running
+    for i in range(4):
+        controller.release(current)
+        current = [t for t in batch + [interactive] if t.admitted and not t.released][0]
+        order.append(current)
+    assert order == [batch[0], interactive, batch[1], batch[2]]
+
+
+@pytest.mark.asyncio
+async def test_release_waiting_ticket():
+    controller = AdmissionController(max_running=1, max_queued=1)
+    running = controller.enqueue("a")
+    waiting = controller.enqueue("b")
+    with pytest.raises(AdmissionQueueFullError):
+        controller.enqueue("c")
+    assert not await waiting.wait(0.01)
+    controller.release(waiting)
+    controller.release(running)
+    assert controller.running == 0
+    assert controller.queued == 0
+    assert not controller.rotation
+    assert controller.enqueue("c").admitted
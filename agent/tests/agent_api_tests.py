@@ -17,6 +17,7 @@ from pathlib import Path
 from og_sdk.agent_sdk import AgentProxySDK
 from og_sdk.utils import random_str
 from og_agent import agent_api_server
+from og_proto import agent_server_pb2
 
 logger = logging.getLogger(__name__)
 api_base = "127.0.0.1:9528"
@@ -30,6 +31,18 @@ def agent_sdk():
     yield sdk
 
 
+def test_task_timeout_response():
+    respond = agent_server_pb2.TaskResponse(
+        response_type=agent_server_pb2.TaskResponse.OnTaskTimeout,
+        error_msg="the task has been running for more than 10 seconds",
+    )
+    response = agent_api_server.StepResponse.new_from(respond).model_dump(
+        exclude_none=True
+    )
+    assert response["step_type"] == agent_api_server.StepResponseType.OnTaskTimeout
+    assert response["error_msg"] == "the task has been running for more than 10 seconds"
+
+
 @pytest.mark.asyncio
 async def test_helloworld_test(agent_sdk):
     await agent_sdk.add_kernel(api_key, "127.0.0.1:9527", api_key)
@@ -0,0 +1,57 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+
+import json
+import logging
+import pytest
+from aiohttp import web
+from og_agent.llama_client import LlamaClient
+
+logger = logging.getLogger(__name__)
+
+
+async def start_llama_server(peers):
+    async def chat(request):
+        peers.append(request.transport.get_extra_info("peername"))
+        response = web.StreamResponse()
+        await response.prepare(request)
+        for content in ["hello", " world"]:
+            message = {"choices": [{"delta": {"content": content}}]}
+            await response.write(("data: %s\n\n" % json.dumps(message)).encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://127.0.0.1:%d" % port
+
+
+@pytest.mark.asyncio
+async def test_llama_client_reuse_connection():
+    peers = []
+    runner, endpoint = await start_llama_server(peers)
+    client = LlamaClient(endpoint, "key", "")
+    try:
+        for i in range(3):
+            messages = [m async for m in client.chat([], "llama")]
+            assert len(messages) == 2
+            assert messages[0]["choices"][0]["delta"]["content"] == "hello"
+        assert len(peers) == 3
+        # all the requests are sent by the same connection
+        assert len(set(peers)) == 1
+    finally:
+        await client.close()
+        await runner.cleanup()
+    assert client.session is None
@@ -12,6 +12,8 @@ import logging
 import pytest
 from og_sdk.kernel_sdk import KernelSDK
 from og_agent import openai_agent
+from og_memory.store import MemoryStore
+from og_agent.agent_builder import build_openai_agent, get_context_token_limit
 from og_proto.agent_server_pb2 import ProcessOptions, TaskResponse, ProcessTaskRequest
 from openai.openai_object import OpenAIObject
 import asyncio
@@ -247,3 +249,69 @@ async def test_openai_agent_smoke_test(mocker, kernel_sdk):
         ), "bad response type"
         assert responses[-1].state.input_token_count == 153
         assert responses[-1].state.output_token_count == 8
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("state_on_every_message", [False, True])
+async def test_openai_agent_lazy_state(mocker, kernel_sdk, state_on_every_message):
+    sentence = "Hello, how can I help you?"
+    stream = PayloadStream(sentence)
+    with mocker.patch(
+        "og_agent.openai_agent.openai.ChatCompletion.acreate", return_value=stream
+    ) as mock_openai:
+        agent = openai_agent.OpenaiAgent("gpt4", kernel_sdk, is_azure=False)
+        queue = asyncio.Queue()
+        task_opt = ProcessOptions(
+            streaming=True,
+            llm_name="gpt4",
+            input_token_limit=100000,
+            output_token_limit=100000,
+            timeout=5,
+            state_on_every_message=state_on_every_message,
+        )
+        request = ProcessTaskRequest(
+            input_files=[], task="hello", context_id="", options=task_opt
+        )
+        await agent.arun(request, queue, MockContext(), task_opt)
+        responses = []
+        while True:
+            response = await queue.get()
+            if not response:
+                break
+            responses.append(response)
+        states = [response.HasField("state") for response in responses]
+        assert states[-1], "the final answer should have the state"
+        if state_on_every_message:
+            assert all(states)
+        else:
+            # the typing deltas within the state interval have no state
+            assert states[0]
+            assert states.count(True) < len(states) / 2
+
+
+def test_context_token_limit(kernel_sdk):
+    assert get_context_token_limit("gpt-3.5-turbo") == 4096 - 1024
+    assert get_context_token_limit("gpt-4-0613") == 8192 - 1024
+    assert get_context_token_limit("gpt-4-32k") == 32768 - 1024
+    # the context window is on by default and 0 turns it off
+    agent = build_openai_agent(kernel_sdk, "gpt-3.5-turbo-16k", is_azure=False)
+    assert agent.memory_option.context_token_limit == 16384 - 1024
+    agent = build_openai_agent(kernel_sdk, "gpt-4", context_token_limit=0)
+    assert agent.memory_option.context_token_limit == 0
+
+
+@pytest.mark.asyncio
+async def test_memory_isolated_by_user(kernel_sdk):
+    memory_store = MemoryStore()
+    agent1 = openai_agent.OpenaiAgent(
+        "gpt4", kernel_sdk, is_azure=False, memory_store=memory_store
+    )
+    agent1.user_id = "user1"
+    agent2 = openai_agent.OpenaiAgent(
+        "gpt4", kernel_sdk, is_azure=False, memory_store=memory_store
+    )
+    agent2.user_id = "user2"
+    memory_id = await agent1.create_new_memory_with_default_prompt("", agent1.user_id)
+    assert await agent1.get_memory(memory_id)
+    # the memory of another user can not be loaded with its context id
+    assert not await agent2.get_memory(memory_id)
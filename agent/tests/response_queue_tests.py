@@ -0,0 +1,113 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+
+import asyncio
+import logging
+import pytest
+from og_proto.agent_server_pb2 import TaskResponse, TypingContent
+from og_agent.response_queue import ResponseQueue, ResponseQueueMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def _typing(content, language="python"):
+    return TaskResponse(
+        response_type=TaskResponse.OnModelTypeCode,
+        typing_content=TypingContent(content=content, language=language),
+    )
+
+
+def _stdout(content):
+    return TaskResponse(
+        response_type=TaskResponse.OnStepActionStreamStdout, console_stdout=content
+    )
+
+
+@pytest.mark.asyncio
+async def test_coalesce_when_full():
+    metrics = ResponseQueueMetrics()
+    queue = ResponseQueue(maxsize=2, metrics=metrics)
+    await queue.put(_stdout("a"))
+    await queue.put(_typing("print("))
+    await asyncio.wait_for(queue.put(_typing("1)")), 1)
+    await asyncio.wait_for(queue.put(_typing("\n")), 1)
+    assert queue.qsize() == 2
+    assert queue.coalesced == 2
+    assert metrics.max_depth == 2
+    assert (await queue.get()).console_stdout == "a"
+    assert (await queue.get()).typing_content.content == "print(1)\n"
+    assert metrics.depth == 0
+
+
+@pytest.mark.asyncio
+async def test_block_when_not_mergeable():
+    queue = ResponseQueue(maxsize=1)
+    await queue.put(_typing("x = 1", "python"))
+    put = asyncio.create_task(queue.put(_typing("ls", "bash")))
+    await asyncio.sleep(0.05)
+    assert not put.done()
+    assert queue.blocked == 1
+    assert (await queue.get()).typing_content.content == "x = 1"
+    await asyncio.wait_for(put, 1)
+    assert (await queue.get()).typing_content.language == "bash"
+
+
+@pytest.mark.asyncio
+async def test_block_policy():
+    queue = ResponseQueue(maxsize=1, policy=ResponseQueue.BLOCK)
+    await queue.put(_stdout("a"))
+    put = asyncio.create_task(queue.put(_stdout("b")))
+    await asyncio.sleep(0.05)
+    assert not put.done()
+    assert (await queue.get()).console_stdout == "a"
+    await asyncio.wait_for(put, 1)
+    assert (await queue.get()).console_stdout == "b"
+    assert queue.coalesced == 0
+
+
+def test_invalid_policy():
+    with pytest.raises(ValueError):
+        ResponseQueue(policy="drop")
+
+
+@pytest.mark.asyncio
+async def test_get_coalesced_typing():
+    queue = ResponseQueue(maxsize=16)
+    await queue.put(_typing("", "python"))
+    for chars in ["im", "port", " os"]:
+        await queue.put(_typing(chars, "text"))
+    await queue.put(_stdout("a"))
+    await queue.put(None)
+    assert (await queue.get_coalesced(0.03)).typing_content.language == "python"
+    respond = await queue.get_coalesced(0.03)
+    assert respond.typing_content.content == "import os"
+    assert queue.typing_merged == 2
+    assert (await queue.get_coalesced(0.03)).console_stdout == "a"
+    assert await queue.get_coalesced(0.03) is None
+
+
+@pytest.mark.asyncio
+async def test_get_coalesced_window():
+    queue = ResponseQueue(maxsize=16)
+    await queue.put(_typing("a"))
+
+    async def produce():
+        await asyncio.sleep(0.01)
+        await queue.put(_typing("b"))
+        await asyncio.sleep(0.2)
+        await queue.put(_typing("c"))
+
+    task = asyncio.create_task(produce())
+    assert (await queue.get_coalesced(0.05)).typing_content.content == "ab"
+    assert (await queue.get_coalesced(0.05)).typing_content.content == "c"
+    await task
+    await queue.put(_typing("abc"))
+    await queue.put(_typing("d"))
+    respond = await queue.get_coalesced(0.05, max_chars=2)
+    assert respond.typing_content.content == "abc"
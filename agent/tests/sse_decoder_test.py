@@ -0,0 +1,43 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+
+import json
+from og_agent.sse_decoder import SSEDecoder, json_loads
+
+
+def test_sse_decoder_with_partial_chunks():
+    messages = [{"content": "hello"}, {"content": "世界"}]
+    stream = b"".join(
+        [b"data: %s\n\n" % json.dumps(m, ensure_ascii=False).encode() for m in messages]
+    )
+    for size in [1, 3, 7, len(stream)]:
+        decoder = SSEDecoder()
+        events = []
+        for i in range(0, len(stream), size):
+            events.extend(decoder.feed(stream[i : i + size]))
+        events.extend(decoder.close())
+        assert [json_loads(e) for e in events] == messages
+
+
+def test_sse_decoder_with_multiline_event():
+    decoder = SSEDecoder()
+    stream = b': comment\r\nevent: message\r\ndata: {"a":\r\ndata:1}\r\n\r\ndata: 2'
+    events = decoder.feed(stream)
+    assert events == [b'{"a":\n1}']
+    assert json_loads(events[0]) == {"a": 1}
+    # the last event without the blank line is dispatched on close
+    assert decoder.close() == [b"2"]
+
+
+def test_sse_decoder_with_done():
+    decoder = SSEDecoder()
+    events = decoder.feed(b"data: 1\n\ndata: [DONE]\n\ndata: 2\n\n")
+    assert events == [b"1"]
+    assert decoder.feed(b"data: 3\n\n") == []
+    assert decoder.close() == []
@@ -0,0 +1,50 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+
+import json
+import logging
+import tiktoken
+from og_agent.token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+def _count_by_deltas(text, size):
+    counter = TokenCounter(encoding, tail_size=8)
+    total = 0
+    for i in range(0, len(text), size):
+        total += counter.feed(text[i : i + size])
+    return total, counter
+
+
+def test_count_code_arguments():
+    code = "\n".join(
+        [f"df_{i} = pd.read_csv('data_{i}.csv')\nprint(df_{i}.head())" for i in range(50)]
+    )
+    arguments = json.dumps({"explanation": "load the data", "code": code})
+    for size in [1, 2, 3, 7]:
+        total, counter = _count_by_deltas(arguments, size)
+        assert total == len(encoding.encode(arguments))
+        assert counter.count == total
+        assert len(counter.tail) < len(arguments)
+
+
+def test_count_text_without_space():
+    text = "你好世界，这是一个测试。" * 100
+    total, counter = _count_by_deltas(text, 3)
+    assert abs(total - len(encoding.encode(text))) <= 2
+    assert len(counter.tail) < len(text)
+
+
+def test_count_empty_delta():
+    counter = TokenCounter(encoding)
+    assert counter.feed("") == 0
+    assert counter.feed(None) == 0
+    assert counter.count == 0
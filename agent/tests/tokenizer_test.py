@@ -9,7 +9,9 @@
 
 import logging
 import io
-from og_agent.tokenizer import tokenize
+import json
+from og_agent.tokenizer import tokenize, Tokenizer
+from og_agent.base_agent import TypingParser, TypingState
 
 logger = logging.getLogger(__name__)
 
@@ -18,3 +20,56 @@ def test_parse_explanation():
     arguments = """{"function_call":"execute", "arguments": {"explanation":"h"""
     for token_state, token in tokenize(io.StringIO(arguments)):
         logger.info(f"token_state: {token_state}, token: {token}")
+
+
+def test_tokenizer_feed_by_char():
+    arguments = json.dumps({
+        "explanation": 'say "hello"',
+        "code": "print('hello')\n",
+        "saved_filenames": ["a.png"],
+        "count": 12,
+    })
+    expected = list(tokenize(io.StringIO(arguments)))
+    tokenizer = Tokenizer()
+    tokens = []
+    for c in arguments:
+        tokens.extend(tokenizer.feed(c))
+    tokens.extend(tokenizer.close())
+    assert tokens == expected
+
+
+def test_typing_parser_with_deltas():
+    arguments = json.dumps({
+        "explanation": "print 你好",
+        "code": "print('你好')\n",
+        "language": "python",
+        "saved_filenames": ["code", "explanation"],
+    })
+    typing_parser = TypingParser()
+    increments = []
+    for i in range(0, len(arguments), 3):
+        increments.extend(typing_parser.feed(arguments[i : i + 3]))
+    explanation = "".join(
+        [chars for state, chars in increments if state == TypingState.EXPLANATION]
+    )
+    code = "".join([chars for state, chars in increments if state == TypingState.CODE])
+    languages = [chars for state, chars in increments if state == TypingState.LANGUAGE]
+    assert explanation == "print 你好"
+    assert code == "print('你好')\n"
+    assert languages == ["python"]
+
+
+def test_typing_parser_with_nested_arguments():
+    content = """{"function_call":"direct_message", "arguments": {"message":"hi \\"there\\""}}"""
+    typing_parser = TypingParser()
+    increments = []
+    for c in content:
+        increments.extend(typing_parser.feed(c))
+    assert all([state == TypingState.MESSAGE for state, _ in increments])
+    assert "".join([chars for _, chars in increments]) == 'hi "there"'
+
+
+def test_typing_parser_with_raw_code():
+    typing_parser = TypingParser(is_code=True)
+    assert typing_parser.feed("import os") == [(TypingState.CODE, "import os")]
+    assert typing_parser.feed("") == []
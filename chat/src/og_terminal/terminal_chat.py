@@ -348,6 +348,7 @@ def run_chat(prompt, session, console, values, filedir=None):
                 agent_server_pb2.TaskResponse.OnSystemError,
                 agent_server_pb2.TaskResponse.OnInputTokenLimitExceed,
                 agent_server_pb2.TaskResponse.OnOutputTokenLimitExceed,
+                agent_server_pb2.TaskResponse.OnTaskTimeout,
             ]:
                 error_responses.append(respond)
                 task_blocks.finish_current_all_blocks()
@@ -357,8 +358,10 @@ def run_chat(prompt, session, console, values, filedir=None):
             handle_action_output(task_blocks, respond)
             handle_action_end(task_blocks, respond, images)
             handle_final_answer(task_blocks, respond)
-            task_state = respond.state
-            refresh(live, task_blocks, task_state=respond.state)
+            # the state is only attached when it changes
+            if respond.HasField("state"):
+                task_state = respond.state
+            refresh(live, task_blocks, task_state=task_state)
         refresh(live, task_blocks, task_state=task_state)
     if error_responses:
         task_blocks = TaskBlocks(values)
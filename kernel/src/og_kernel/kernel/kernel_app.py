@@ -11,9 +11,10 @@ import uuid
 
 from jupyter_core.application import JupyterApp, base_flags
 from tornado.ioloop import IOLoop
-from traitlets import Unicode
+from traitlets import Integer, Unicode
 from jupyter_client.kernelspec import NATIVE_KERNEL_NAME, KernelSpecManager
 from jupyter_client.manager import KernelManager
+from .resource_limit import KernelCgroup, set_rlimits
 
 
 class KernelApp(JupyterApp):
@@ -25,6 +26,10 @@ class KernelApp(JupyterApp):
         "kernel": "KernelApp.kernel_name",
         "ip": "KernelManager.ip",
         "connection_file": "KernelApp.connection_file",
+        "ready_fd": "KernelApp.ready_fd",
+        "memory_limit": "KernelApp.memory_limit",
+        "cpu_time_limit": "KernelApp.cpu_time_limit",
+        "cgroup": "KernelApp.cgroup",
     }
     flags = {"debug": base_flags["debug"]}
     kernel_name = Unicode(
@@ -33,6 +38,18 @@ class KernelApp(JupyterApp):
     connection_file = Unicode("", help="The connection file path of the kernel").tag(
         config=True
     )
+    ready_fd = Integer(
+        -1, help="The pipe fd to notify that the connection file has been written"
+    ).tag(config=True)
+    memory_limit = Integer(
+        0, help="The max memory in bytes of the kernel process, 0 means no limit"
+    ).tag(config=True)
+    cpu_time_limit = Integer(
+        0, help="The max cpu time in seconds of the kernel process, 0 means no limit"
+    ).tag(config=True)
+    cgroup = Unicode("", help="The cgroup v2 path to run the kernel in").tag(
+        config=True
+    )
 
     def initialize(self, argv=None):
         """Initialize the application."""
@@ -83,12 +100,27 @@ class KernelApp(JupyterApp):
             with open(fn, "wb"):
                 pass
 
+    def _notify_ready(self) -> None:
+        """Notify the parent process that the kernel has been started"""
+        if self.ready_fd < 0:
+            return
+        try:
+            os.write(self.ready_fd, b"1")
+        finally:
+            os.close(self.ready_fd)
+            self.ready_fd = -1
+
     def start(self) -> None:
         """Start the application."""
         self.log.info("Starting kernel %r", self.kernel_name)
         try:
+            # the kernel process inherits the limits of the launcher
+            if self.cgroup:
+                KernelCgroup(self.cgroup).join()
+            set_rlimits(self.memory_limit, self.cpu_time_limit)
             self.km.start_kernel()
             self.log_connection_info()
+            self._notify_ready()
             self.setup_signals()
             self.loop.start()
         finally:
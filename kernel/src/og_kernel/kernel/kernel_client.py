@@ -9,6 +9,7 @@ import inspect
 import asyncio
 import queue
 import json
+import time
 from jupyter_client import AsyncKernelClient
 
 logger = logging.getLogger(__name__)
@@ -19,8 +20,18 @@ the kernel client for watching the output of kernel
 
 
 class KernelClient:
+    """
+    The iopub messages are read by a single router task and dispatched to the
+    queue of the execution by the msg id in the parent header, so the
+    executions on the kernel do not steal the messages of each other. The
+    queue of an execution is bounded and the router waits when it is full
 
-    def __init__(self, connection_file):
+    The executions of the sessions share the kernel, so the running one is
+    tracked by the busy and idle status and a cancelled execution is interrupted
+    only when it is the running one
+    """
+
+    def __init__(self, connection_file, queue_size=1024, time_to_dead=5.0):
         if not connection_file:
             raise ValueError(f"connection_file={connection_file} is empty")
         if not os.path.exists(connection_file):
@@ -30,8 +41,22 @@ class KernelClient:
         )
         self.client = None
         self.is_running = False
-        self.task = None
         self.connection_file = connection_file
+        self.queue_size = queue_size
+        # the kernel is treated as dead after missing the heartbeat for the seconds
+        self.time_to_dead = time_to_dead
+        # msg id -> the queue of the iopub messages
+        self.queues = {}
+        self.router_task = None
+        self.on_message_fn = None
+        # the replies of the concurrent interrupts share the control channel
+        self.interrupt_lock = asyncio.Lock()
+        # the msg ids of the executions that have not become idle
+        self.pending = set()
+        self.running_msg_id = None
+        # the msg ids of the cancelled executions waiting in the kernel queue
+        self.cancelled = set()
+        self.interrupt_tasks = set()
 
     async def is_alive(self):
         return await self.client.is_alive()
@@ -39,34 +64,63 @@ class KernelClient:
     async def start_client(self):
         self.client = AsyncKernelClient(connection_file=self.connection_file)
         self.client.load_connection_file()
+        # the kernels starting at the same time can miss the default 1s heartbeat
+        self.client.hb_channel.time_to_dead = self.time_to_dead
         self.client.start_channels()
         await self.client.wait_for_ready()
+        self.router_task = asyncio.create_task(self._route())
 
-    async def _loop(self, on_message_fn):
-        logger.debug("start loop the kernel message")
-        try:
-            while self.is_running and self.client:
+    async def _route(self):
+        logger.debug("start routing the kernel message")
+        while self.client:
+            try:
+                msg = await self.client.get_iopub_msg(timeout=1)
+            except queue.Empty:
+                continue
+            except (ValueError, IndexError):
+                # get_iopub_msg suffers from message fetch errors
+                logger.error("fail to get message")
+                continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("fail to wait for message %s", e)
+                break
+            if self.on_message_fn:
                 try:
-                    logger.debug("start wait message")
-                    msg = await self.client.get_iopub_msg(timeout=1)
-                    logger.debug("msg %s", msg)
-                    try:
-                        await on_message_fn(msg)
-                    except Exception as e:
-                        logger.error("fail to call on message function for error %s", e)
-                        continue
-                except queue.Empty:
-                    logger.debug("empty message")
-                    continue
-                except (ValueError, IndexError):
-                    # get_iopub_msg suffers from message fetch errors
-                    logger.error("fail to get message")
-                    break
+                    await self.on_message_fn(msg)
                 except Exception as e:
-                    logger.error("fail to wait for message %s", e)
-                    break
-        except Exception as e:
-            logger.error("loop exception", e)
+                    logger.error("fail to call on message function for error %s", e)
+            if msg["msg_type"] == "status":
+                self._track_status(msg)
+            msg_queue = self.queues.get(msg["parent_header"].get("msg_id"))
+            if msg_queue:
+                await msg_queue.put(msg)
+        # wake up the readers
+        for msg_queue in self.queues.values():
+            if not msg_queue.full():
+                msg_queue.put_nowait(None)
+
+    def _track_status(self, msg):
+        """
+        track the running execution by the busy and idle status of the kernel
+        """
+        msg_id = msg["parent_header"].get("msg_id")
+        if msg_id not in self.pending:
+            return
+        state = msg["content"]["execution_state"]
+        if state == "busy":
+            self.running_msg_id = msg_id
+            if msg_id in self.cancelled:
+                logger.info("interrupt the cancelled execution %s", msg_id)
+                task = asyncio.create_task(self._stop_execution(msg_id))
+                self.interrupt_tasks.add(task)
+                task.add_done_callback(self.interrupt_tasks.discard)
+        elif state == "idle":
+            self.pending.discard(msg_id)
+            self.cancelled.discard(msg_id)
+            if self.running_msg_id == msg_id:
+                self.running_msg_id = None
 
     async def watching(self, on_message_fn):
         """
@@ -83,34 +137,153 @@ class KernelClient:
         if not inspect.iscoroutinefunction(on_message_fn):
             raise ValueError(f"on_message_fn must be async function")
         self.is_running = True
-        self.task = asyncio.create_task(self._loop(on_message_fn))
+        self.on_message_fn = on_message_fn
 
-    async def read_response(self, context, tries=1):
+    async def read_response(self, context, msg_id, timeout=None, tick_interval=None):
+        """
+        Read the messages of the execution until the kernel becomes idle
+
+        Arguments
+        context - the request context, the reading stops when it is done
+        msg_id - the msg id of the execute request
+        timeout - the overall timeout in seconds of the execution, a TimeoutError
+        will be raised when it is exceeded
+        tick_interval - yield a message with the tick msg type when no message
+        arrives in the seconds, the caller can flush its buffered output
+        """
+        msg_queue = self.queues.get(msg_id)
+        if not msg_queue:
+            raise ValueError(f"the execution {msg_id} does not exist")
+        deadline = time.monotonic() + timeout if timeout else None
         try:
-            hit_empty = 0
             while self.client:
+                wait_timeout = tick_interval if tick_interval else 1
+                if deadline:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"the execution has not finished in {timeout} seconds"
+                        )
+                    wait_timeout = min(wait_timeout, remaining)
                 try:
-                    msg = await self.client.get_iopub_msg(timeout=1)
+                    msg = await asyncio.wait_for(msg_queue.get(), wait_timeout)
+                except asyncio.TimeoutError:
                     if context.done():
                         logger.debug("the client  has cancelled the request")
                         break
-                    logger.debug(f"{msg}")
-                    yield msg
-                except queue.Empty:
-                    hit_empty += 1
-                    if hit_empty >= tries:
+                    if not await self.client.is_alive():
+                        # the kernel never becomes idle after it dies
+                        logger.warning("the kernel died in the execution %s", msg_id)
+                        yield self._new_dead_kernel_error(msg_id)
                         break
-                except (ValueError, IndexError):
-                    # get_iopub_msg suffers from message fetch errors
-                    logger.error("fail to get message")
+                    if tick_interval:
+                        yield {"msg_type": "tick"}
+                    continue
+                if not msg:
                     break
-                except Exception as e:
-                    logger.error("fail to wait for message %s", e)
+                if context.done():
+                    logger.debug("the client  has cancelled the request")
+                    break
+                logger.debug("%s", msg)
+                yield msg
+                if (
+                    msg["msg_type"] == "status"
+                    and msg["content"]["execution_state"] == "idle"
+                ):
                     break
             yield None
-        except Exception as e:
-            logger.error("loop exception", e)
-            yield None
+        finally:
+            self.queues.pop(msg_id, None)
+            # unblock the router if it is waiting for the full queue
+            while not msg_queue.empty():
+                msg_queue.get_nowait()
+
+    def _new_dead_kernel_error(self, msg_id):
+        return {
+            "msg_type": "error",
+            "parent_header": {"msg_id": msg_id},
+            "content": {
+                "ename": "DeadKernelError",
+                "evalue": "the kernel died",
+                "traceback": [
+                    "DeadKernelError: the kernel died while executing the code,"
+                    " it may exceed the memory or cpu limit"
+                ],
+            },
+        }
+
+    async def run_silently(self, code, timeout=60):
+        """
+        Run the code without any output and wait for the reply
+        """
+        if not self.client:
+            raise ValueError(f"no client is avaliable")
+        reply = await self.client.execute(
+            code, silent=True, store_history=False, reply=True, timeout=timeout
+        )
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                "fail to run the code for %s" % reply["content"].get("evalue", "")
+            )
+        return reply
+
+    async def interrupt(self, timeout=5, msg_id=None):
+        """
+        Interrupt the running execution with the interrupt request on the control
+        channel, return False if the kernel does not reply in the timeout. With
+        msg_id the kernel is interrupted only if the execution is running
+        """
+        if not self.client:
+            raise ValueError(f"no client is avaliable")
+        async with self.interrupt_lock:
+            if msg_id and self.running_msg_id != msg_id:
+                return True
+            msg = self.client.session.msg("interrupt_request", content={})
+            self.client.control_channel.send(msg)
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                try:
+                    reply = await self.client.control_channel.get_msg(
+                        timeout=remaining
+                    )
+                except queue.Empty:
+                    return False
+                if reply["parent_header"].get("msg_id") == msg["header"]["msg_id"]:
+                    return reply["content"]["status"] == "ok"
+
+    async def cancel(self, msg_id, timeout=5):
+        """
+        Stop the execution without touching the others on the kernel, a queued
+        execution is interrupted when it starts running. Return False if the
+        kernel does not reply the interrupt
+        """
+        if msg_id not in self.pending:
+            return True
+        if self.running_msg_id != msg_id:
+            self.cancelled.add(msg_id)
+            return True
+        return await self._stop_execution(msg_id, timeout)
+
+    async def _stop_execution(self, msg_id, timeout=5):
+        """
+        Interrupt the execution until it is not running, the kernel ignores the
+        interrupt between the busy status and the start of the code
+        """
+        deadline = time.monotonic() + timeout
+        while self.running_msg_id == msg_id:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if not await self.interrupt(remaining, msg_id=msg_id):
+                return False
+            # wait for the idle status before interrupting it again
+            waited_until = min(time.monotonic() + 0.5, deadline)
+            while self.running_msg_id == msg_id and time.monotonic() < waited_until:
+                await asyncio.sleep(0.05)
+        return True
 
     def execute(self, code):
         """
@@ -118,23 +291,28 @@ class KernelClient:
         """
         if not self.client:
             raise ValueError(f"no client is avaliable")
-        msg_id = self.client.execute(code)
+        # the error of an execution does not abort the queued ones of the others
+        msg_id = self.client.execute(code, stop_on_error=False)
         logger.debug("the execute msg id %s", msg_id)
+        self.pending.add(msg_id)
+        # register the queue before the messages of the execution arrive
+        self.queues[msg_id] = asyncio.Queue(maxsize=self.queue_size)
         return msg_id
 
     async def stop_watch(self):
-        if self.task and self.is_running:
+        if self.is_running:
             self.is_running = False
+            self.on_message_fn = None
             logger.info(
                 "stop the kernel client for connection_file %s", self.connection_file
             )
-            try:
-                self.task.cancel()
-                await self.task
-            except:
-                pass
 
     def stop_client(self):
+        if self.router_task:
+            self.router_task.cancel()
+            self.router_task = None
+        for task in self.interrupt_tasks:
+            task.cancel()
         if self.client:
             self.client.stop_channels()
             self.client = None
@@ -9,7 +9,10 @@ import subprocess
 import json
 import sys
 import pathlib
-from time import sleep
+import select
+import asyncio
+import uuid
+from .resource_limit import KernelCgroup, KernelLimits, read_usage
 
 logger = logging.getLogger(__name__)
 
@@ -19,18 +22,29 @@ The jupytor kernel manager used for
 - start kernel instance
 - stop kernel instance
 
+The launcher writes to a pipe once the connection file has been written, so
+the readiness of the kernel is detected without polling the connection file
+
 Typical usage example:
     config_path = "kernel_connection_file.json"
     workspace = "/mnt/workspace1"
     km = KernelManager(config_path, workspace)
     # start the kernel
     km.start()
+    # or start the kernel in the event loop
+    await km.astart()
 """
 
 
 class KernelManager:
 
-    def __init__(self, config_path: str, workspace: str, kernel: str = "python3"):
+    def __init__(
+        self,
+        config_path: str,
+        workspace: str,
+        kernel: str = "python3",
+        limits: KernelLimits = None,
+    ):
         if not config_path or not workspace:
             raise ValueError(
                 f"config path={config_path} or workspace={workspace} is empty"
@@ -45,48 +59,119 @@ class KernelManager:
             workspace,
         )
         self.kernel = kernel
+        self.limits = limits if limits else KernelLimits()
+        self.cgroup = None
 
-    def start(self):
+    def _launch(self):
         """
-        Start a kernel instance and generate the kernel connection file
+        launch the kernel process and return the read end of the ready pipe
         """
         self.is_running = True
-
         os.makedirs(self.workspace, exist_ok=True)
         launch_kernel_script_path = os.path.join(
             pathlib.Path(__file__).parent.resolve(), "launch_kernel.py"
         )
-        self.process = subprocess.Popen(
-            [
-                sys.executable,
-                launch_kernel_script_path,
-                "--connection_file=" + self.config_path,
-                "--kernel=" + self.kernel,
-            ],
-            cwd=self.workspace,
-        )
+        args = [
+            sys.executable,
+            launch_kernel_script_path,
+            "--connection_file=" + self.config_path,
+            "--kernel=" + self.kernel,
+        ]
+        if self.limits.cgroup_root:
+            # the cgroup limits the memory instead of the rlimit
+            self.cgroup = KernelCgroup(
+                os.path.join(self.limits.cgroup_root, "kernel_%s" % uuid.uuid4().hex)
+            )
+            self.cgroup.create(self.limits.memory_limit, self.limits.cpu_quota)
+            args.append("--cgroup=" + self.cgroup.path)
+        elif self.limits.memory_limit:
+            args.append("--memory_limit=%d" % self.limits.memory_limit)
+        if self.limits.cpu_time_limit:
+            args.append("--cpu_time_limit=%d" % self.limits.cpu_time_limit)
+        ready_r, ready_w = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                args + ["--ready_fd=%d" % ready_w],
+                cwd=self.workspace,
+                pass_fds=(ready_w,),
+            )
+        except Exception:
+            os.close(ready_r)
+            raise
+        finally:
+            os.close(ready_w)
         logger.info("Start the kernel with process id %s", str(self.process.pid))
-        while True:
-            if not os.path.isfile(self.config_path):
-                sleep(1)
-            else:
-                try:
-                    with open(self.config_path, "r") as fp:
-                        logger.info("connection file content %s", json.load(fp))
-                    break
-                except json.JSONDecodeError:
-                    pass
+        return ready_r
+
+    def _on_ready(self, signal: bytes):
+        # the pipe is closed without the signal if the launcher exits
+        if not signal:
+            self.stop()
+            raise RuntimeError(f"fail to start the kernel {self.kernel}")
+        with open(self.config_path, "r") as fp:
+            logger.info("connection file content %s", json.load(fp))
+
+    def start(self, timeout: float = 60):
+        """
+        Start a kernel instance and generate the kernel connection file
+        """
+        ready_r = self._launch()
+        try:
+            readable, _, _ = select.select([ready_r], [], [], timeout)
+            if not readable:
+                self.stop()
+                raise TimeoutError(f"start the kernel {self.kernel} timeout")
+            self._on_ready(os.read(ready_r, 1))
+        finally:
+            os.close(ready_r)
+
+    async def astart(self, timeout: float = 60):
+        """
+        Start a kernel instance without blocking the event loop
+        """
+        ready_r = self._launch()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def on_readable():
+            if not future.done():
+                future.set_result(os.read(ready_r, 1))
+
+        loop.add_reader(ready_r, on_readable)
+        try:
+            signal = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.stop()
+            raise TimeoutError(f"start the kernel {self.kernel} timeout")
+        except asyncio.CancelledError:
+            self.stop()
+            raise
+        finally:
+            loop.remove_reader(ready_r)
+            os.close(ready_r)
+        self._on_ready(signal)
 
     def stop(self):
         """
         stop the kernel instance
         """
         self.is_running = False
-        logger.info("stop the kernel with process id %s", str(self.process.pid))
         if self.process:
+            logger.info("stop the kernel with process id %s", str(self.process.pid))
             self.process.terminate()
             self.process.wait()
             self.process = None
+        if self.cgroup:
+            self.cgroup.remove()
+            self.cgroup = None
+
+    def usage(self):
+        """
+        return the cpu time in seconds and the rss in bytes of the kernel
+        """
+        if not self.process:
+            return 0, 0
+        return read_usage(self.process.pid)
 
     def __str__(self):
         return f'KernelManager(config_path="{self.config_path}", workspace="{self.workspace}")'
@@ -0,0 +1,315 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+from .kernel_mgr import KernelManager
+from .kernel_client import KernelClient
+from .resource_limit import KernelLimits, read_usages
+
+logger = logging.getLogger(__name__)
+
+"""
+The kernel pool hosts the isolated kernels of the sessions
+
+Every session has its own workspace subdirectory and a kernel for every kernel
+name. The session with an empty id uses the root workspace
+
+The pool keeps warm_size started python3 kernels with the preload code executed.
+A warm kernel is handed out by changing its working directory to the workspace
+of the session and the pool is refilled in the background
+
+Typical usage example:
+    pool = KernelPool(config_root_path, workspace, max_kernels=8, idle_timeout=1800,
+                      warm_size=1, preload_code="import pandas as pd")
+    pool.schedule_refill()
+    await pool.start("session1", "python3")
+    kernel = pool.get("session1", "python3")
+    msg_id = kernel.kc.execute("print(1)")
+"""
+
+
+class KernelPoolFullError(RuntimeError):
+    """the pool has no idle kernel to evict"""
+
+
+class PooledKernel:
+
+    def __init__(self, session_id, kernel_name, km, kc):
+        self.session_id = session_id
+        self.kernel_name = kernel_name
+        self.km = km
+        self.kc = kc
+        # the number of the running executions
+        self.busy = 0
+        self.last_used = time.monotonic()
+        # the sampled cpu time in seconds and rss in bytes of the kernel
+        self.cpu_time = 0
+        self.rss = 0
+        # the total wall time in seconds and the number of the executions
+        self.execution_time = 0
+        self.execution_count = 0
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    async def stop(self):
+        # the kernel manager waits for the kernel to exit, keep the loop responsive
+        await asyncio.to_thread(self.km.stop)
+        self.kc.stop_client()
+
+
+class KernelPool:
+
+    def __init__(
+        self,
+        config_root_path: str,
+        workspace: str,
+        max_kernels: int = 8,
+        idle_timeout: int = 0,
+        warm_size: int = 0,
+        preload_code: str = "",
+        start_timeout: int = 60,
+        limits: KernelLimits = None,
+    ):
+        self.config_root_path = config_root_path
+        self.workspace = workspace
+        self.max_kernels = max_kernels
+        # 0 means the idle kernel will never be stopped
+        self.idle_timeout = idle_timeout
+        # (session id, kernel name) -> PooledKernel
+        self.kernels = {}
+        # (session id, kernel name) -> the future of the kernel being started
+        self.starting = {}
+        self.lock = asyncio.Lock()
+        self.warm_size = warm_size
+        self.preload_code = preload_code
+        # the started python3 kernels waiting for the sessions
+        self.warm_kernels = []
+        self.refill_task = None
+        self.start_timeout = start_timeout
+        self.limits = limits
+
+    def get_workspace(self, session_id: str) -> str:
+        """
+        return the workspace of the session
+        """
+        if not session_id:
+            return self.workspace
+        name = re.sub(r"[^A-Za-z0-9_\-]", "_", session_id)[:64]
+        return os.path.join(self.workspace, "session_" + name)
+
+    def get(self, session_id: str, kernel_name: str):
+        """
+        return the kernel of the session or None if it has not been started
+        """
+        kernel = self.kernels.get((session_id, kernel_name))
+        if kernel:
+            kernel.touch()
+        return kernel
+
+    async def start(self, session_id: str, kernel_name: str) -> bool:
+        """
+        start the kernel for the session and return False if it has been started
+        """
+        key = (session_id, kernel_name)
+        while True:
+            # hold the lock only to reserve the slot, the slow launch runs outside
+            # it and the concurrent starts of the same kernel wait for the first one
+            async with self.lock:
+                if key in self.kernels:
+                    return False
+                starting = self.starting.get(key)
+                if not starting:
+                    victim = None
+                    if len(self.kernels) + len(self.starting) >= self.max_kernels:
+                        victim = self._evict()
+                    starting = asyncio.get_running_loop().create_future()
+                    self.starting[key] = starting
+                    warm_kernel = None
+                    if kernel_name == "python3" and self.warm_kernels:
+                        warm_kernel = self.warm_kernels.pop(0)
+                    break
+            # retry when the first start fails
+            if await asyncio.shield(starting):
+                return False
+        started = False
+        try:
+            if victim:
+                await victim.stop()
+            workspace = self.get_workspace(session_id)
+            km, kc = None, None
+            if warm_kernel:
+                km, kc = await self._hand_out_warm_kernel(warm_kernel, workspace)
+            if not km:
+                logger.info(
+                    "create a new kernel with kernel_name %s for session %s",
+                    kernel_name,
+                    session_id,
+                )
+                km, kc = await self._launch(workspace, kernel_name)
+            self.kernels[key] = PooledKernel(session_id, kernel_name, km, kc)
+            started = True
+        finally:
+            self.starting.pop(key, None)
+            starting.set_result(started)
+        self.schedule_refill()
+        return True
+
+    async def _launch(self, workspace: str, kernel_name: str):
+        connection_file = "%s/kernel-%s.json" % (
+            self.config_root_path,
+            uuid.uuid4(),
+        )
+        km = KernelManager(
+            connection_file, workspace, kernel=kernel_name, limits=self.limits
+        )
+        await km.astart(self.start_timeout)
+        kc = KernelClient(connection_file)
+        try:
+            await kc.start_client()
+        except Exception:
+            await asyncio.to_thread(km.stop)
+            raise
+        return km, kc
+
+    async def _hand_out_warm_kernel(self, warm_kernel, workspace: str):
+        km, kc = warm_kernel
+        try:
+            await kc.run_silently(
+                "import os\nos.makedirs(%r, exist_ok=True)\nos.chdir(%r)"
+                % (workspace, workspace)
+            )
+            km.workspace = workspace
+            logger.info("hand out the warm kernel to workspace %s", workspace)
+            return km, kc
+        except Exception:
+            logger.exception("fail to hand out the warm kernel")
+            await asyncio.to_thread(km.stop)
+            kc.stop_client()
+            return None, None
+
+    def schedule_refill(self):
+        """
+        refill the warm kernels in the background
+        """
+        if len(self.warm_kernels) >= self.warm_size:
+            return
+        if self.refill_task and not self.refill_task.done():
+            return
+        self.refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while len(self.warm_kernels) < self.warm_size:
+            try:
+                km, kc = await self._launch(self.workspace, "python3")
+            except Exception:
+                logger.exception("fail to start the warm kernel")
+                return
+            if self.preload_code:
+                try:
+                    await kc.run_silently(self.preload_code)
+                except Exception:
+                    logger.exception("fail to run the preload code")
+            self.warm_kernels.append((km, kc))
+            logger.info("%d warm kernels are ready", len(self.warm_kernels))
+
+    async def stop(self, session_id: str, kernel_name: str) -> bool:
+        """
+        stop the kernel of the session and return False if it has not been started
+        """
+        kernel = self.kernels.pop((session_id, kernel_name), None)
+        if not kernel:
+            return False
+        await kernel.stop()
+        return True
+
+    async def restart(self, session_id: str, kernel_name: str) -> bool:
+        """
+        replace the kernel of the session with a new one and return False if it
+        has not been started
+        """
+        if not await self.stop(session_id, kernel_name):
+            return False
+        return await self.start(session_id, kernel_name)
+
+    async def stop_all(self):
+        if self.refill_task:
+            self.refill_task.cancel()
+        kernels = list(self.kernels.values()) + [
+            PooledKernel("", "python3", km, kc) for km, kc in self.warm_kernels
+        ]
+        self.kernels = {}
+        self.warm_kernels = []
+        await asyncio.gather(*[kernel.stop() for kernel in kernels])
+
+    def _evict(self):
+        """
+        remove the least recently used idle kernel from the pool and return it,
+        the caller stops it outside the lock
+        """
+        idle_kernels = [k for k in self.kernels.values() if not k.busy]
+        if not idle_kernels:
+            raise KernelPoolFullError(f"the kernel pool is full with {self.max_kernels} kernels")
+        kernel = min(idle_kernels, key=lambda k: k.last_used)
+        logger.info(
+            "evict the kernel %s of session %s", kernel.kernel_name, kernel.session_id
+        )
+        return self.kernels.pop((kernel.session_id, kernel.kernel_name))
+
+    async def reap_idle_kernels(self):
+        """
+        stop the kernels that have been idle for more than idle timeout
+        """
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        for key, kernel in list(self.kernels.items()):
+            # the kernel may be replaced while the previous one is stopping
+            if self.kernels.get(key) is not kernel:
+                continue
+            if not kernel.busy and now - kernel.last_used >= self.idle_timeout:
+                logger.info(
+                    "stop the idle kernel %s of session %s",
+                    kernel.kernel_name,
+                    kernel.session_id,
+                )
+                await self.stop(*key)
+
+    async def run_reaper(self, interval: int = 60):
+        """
+        stop the idle kernels periodically
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap_idle_kernels()
+            except Exception:
+                logger.exception("fail to reap the idle kernels")
+
+    async def sample_usage(self):
+        """
+        sample the cpu time and the rss of the kernels
+        """
+        kernels = [(k, k.km.process.pid) for k in self.kernels.values() if k.km.process]
+        # scan the /proc in the thread pool to keep the loop responsive
+        usages = await asyncio.to_thread(read_usages, [pid for _, pid in kernels])
+        for kernel, pid in kernels:
+            kernel.cpu_time, kernel.rss = usages[pid]
+
+    async def run_sampler(self, interval: int = 10):
+        """
+        sample the usage of the kernels periodically
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sample_usage()
+            except Exception:
+                logger.exception("fail to sample the usage of the kernels")
@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+The resource limits and the resource usage of the kernel processes
+
+The rlimits are set by the kernel launcher before the kernel is started, so the
+kernel process inherits them. With a cgroup v2 root delegated to the kernel
+server, every kernel gets its own cgroup with the memory and cpu limits and the
+launcher moves itself into the cgroup before starting the kernel
+
+The usage is read from /proc and covers the launcher and all its descendants
+
+Typical usage example:
+    limits = KernelLimits(memory_limit=2 * 1024**3, cpu_time_limit=3600)
+    km = KernelManager(config_path, workspace, limits=limits)
+    cpu_time, rss = read_usage(km.process.pid)
+"""
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class KernelLimits:
+
+    def __init__(
+        self,
+        memory_limit: int = 0,
+        cpu_time_limit: int = 0,
+        cpu_quota: float = 0,
+        cgroup_root: str = "",
+    ):
+        # the max memory in bytes of a kernel process, 0 means no limit
+        self.memory_limit = memory_limit
+        # the max cpu time in seconds of a kernel process, 0 means no limit
+        self.cpu_time_limit = cpu_time_limit
+        # the cpu cores of the kernel cgroup, 0 means no limit
+        self.cpu_quota = cpu_quota
+        # the delegated cgroup v2 directory for the kernel cgroups
+        self.cgroup_root = cgroup_root
+
+
+def set_rlimits(memory_limit: int = 0, cpu_time_limit: int = 0):
+    """
+    set the rlimits of the current process, the child processes inherit them
+    """
+    import resource
+
+    if memory_limit > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if cpu_time_limit > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time_limit, cpu_time_limit))
+
+
+class KernelCgroup:
+    """
+    the cgroup v2 of a kernel
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def create(self, memory_limit: int = 0, cpu_quota: float = 0):
+        os.makedirs(self.path, exist_ok=True)
+        if memory_limit > 0:
+            self._write("memory.max", str(memory_limit))
+        if cpu_quota > 0:
+            period = 100000
+            self._write("cpu.max", "%d %d" % (int(cpu_quota * period), period))
+
+    def _write(self, filename: str, value: str):
+        with open(os.path.join(self.path, filename), "w") as fd:
+            fd.write(value)
+
+    def join(self):
+        """
+        move the current process into the cgroup
+        """
+        self._write("cgroup.procs", "0")
+
+    def remove(self):
+        try:
+            os.rmdir(self.path)
+        except OSError as ex:
+            logger.warning("fail to remove the cgroup %s for %s", self.path, ex)
+
+
+def _read_stat(pid: int):
+    """
+    return the parent pid, the cpu time in seconds and the rss in bytes of the process
+    """
+    with open("/proc/%d/stat" % pid, "r") as fd:
+        stat = fd.read()
+    # the command name in the brackets may contain spaces
+    fields = stat[stat.rindex(")") + 2 :].split()
+    ppid = int(fields[1])
+    cpu_time = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = int(fields[21]) * PAGE_SIZE
+    return ppid, cpu_time, rss
+
+
+def read_usages(pids):
+    """
+    return the pid -> (cpu time in seconds, rss in bytes) of the processes with
+    their descendants, /proc is scanned once for all the processes
+    """
+    stats = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            stats[int(name)] = _read_stat(int(name))
+        except (OSError, ValueError, IndexError):
+            # the process has exited
+            continue
+    children = {}
+    for child, (ppid, _, _) in stats.items():
+        children.setdefault(ppid, []).append(child)
+    usages = {}
+    for pid in pids:
+        cpu_time, rss = 0, 0
+        pending = [pid]
+        while pending:
+            current = pending.pop()
+            if current not in stats:
+                continue
+            _, process_cpu_time, process_rss = stats[current]
+            cpu_time += process_cpu_time
+            rss += process_rss
+            pending.extend(children.get(current, []))
+        usages[pid] = (cpu_time, rss)
+    return usages
+
+
+def read_usage(pid: int):
+    """
+    return the cpu time in seconds and the rss in bytes of the process and its
+    descendants
+    """
+    return read_usages([pid])[pid]
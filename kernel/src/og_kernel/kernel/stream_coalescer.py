@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+The stream coalescer merges the stdout and stderr fragments of an execution
+
+The fragments are buffered and flushed as one text when the buffer reaches
+flush_size, when the first buffered fragment is older than flush_interval
+seconds, when the stream name changes or when the execution ends. The text
+beyond max_output_bytes of an execution is dropped with a truncation marker
+
+Typical usage example:
+    coalescer = StreamCoalescer(flush_size=4096, flush_interval=0.05)
+    for name, text in coalescer.add("stdout", "hello"):
+        send(name, text)
+    if coalescer.due():
+        for name, text in coalescer.flush():
+            send(name, text)
+"""
+
+TRUNCATION_MARKER = "\n... the output is truncated after %d bytes\n"
+
+
+class StreamCoalescer:
+
+    def __init__(self, flush_size=4096, flush_interval=0.05, max_output_bytes=0):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        # 0 means no limit on the output of an execution
+        self.max_output_bytes = max_output_bytes
+        self.name = None
+        self.buffer = []
+        self.buffer_size = 0
+        self.buffered_at = 0
+        self.output_bytes = 0
+        self.truncated = False
+
+    def _limit(self, text):
+        if not self.max_output_bytes:
+            return text
+        if self.truncated:
+            return ""
+        data = text.encode("utf-8")
+        if self.output_bytes + len(data) <= self.max_output_bytes:
+            self.output_bytes += len(data)
+            return text
+        remaining = self.max_output_bytes - self.output_bytes
+        self.output_bytes = self.max_output_bytes
+        self.truncated = True
+        logger.warning("truncate the output after %d bytes", self.max_output_bytes)
+        return (
+            data[:remaining].decode("utf-8", errors="ignore")
+            + TRUNCATION_MARKER % self.max_output_bytes
+        )
+
+    def add(self, name, text):
+        """
+        buffer the text of the stream and return the (name, text) pairs to send
+        """
+        text = self._limit(text)
+        if not text:
+            return []
+        outputs = []
+        if self.name != name:
+            outputs = self.flush()
+            self.name = name
+        if not self.buffer:
+            self.buffered_at = time.monotonic()
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+        if self.buffer_size >= self.flush_size or self.due():
+            outputs.extend(self.flush())
+        return outputs
+
+    def due(self):
+        """
+        the buffered text has waited for the flush interval
+        """
+        return (
+            bool(self.buffer)
+            and time.monotonic() - self.buffered_at >= self.flush_interval
+        )
+
+    def flush(self):
+        """
+        return the buffered text as (name, text) pairs and clear the buffer
+        """
+        if not self.buffer:
+            return []
+        output = (self.name, "".join(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+        return [output]
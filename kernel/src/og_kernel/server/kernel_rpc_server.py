@@ -15,21 +15,22 @@ import functools
 import grpc
 import re
 import uuid
-import random
-import string
 import base64
-import tempfile
+import hashlib
+import time
 from pathlib import Path
 from typing import Awaitable, Callable, Optional, AsyncIterable
 from grpc.aio import ServicerContext, server, ServerInterceptor
 from google.rpc import status_pb2
 from dotenv import dotenv_values
-from ..kernel.kernel_mgr import KernelManager
+from ..kernel.kernel_pool import KernelPool, KernelPoolFullError
+from ..kernel.stream_coalescer import StreamCoalescer
+from ..kernel.resource_limit import KernelLimits
+from .transfer_token import TRANSFER_METHODS, verify_token
 from og_proto.kernel_server_pb2_grpc import KernelServerNodeServicer
 from og_proto.kernel_server_pb2_grpc import add_KernelServerNodeServicer_to_server
 from og_proto import kernel_server_pb2
 from og_proto import common_pb2
-from ..kernel.kernel_client import KernelClient
 import aiofiles
 from aiofiles import os as aio_os
 
@@ -60,10 +61,12 @@ class ApiKeyInterceptor(ServerInterceptor):
     the api key interceptor
     """
 
-    def __init__(self, header, value, code, error):
+    def __init__(self, header, value, code, error, token_header=None):
         self._header = header
         self._value = value
         self._terminator = _unary_unary_rpc_terminator(code, error)
+        # the transfer token signed with the api key is allowed for the file transfer
+        self._token_header = token_header
 
     async def intercept_service(
         self,
@@ -77,15 +80,59 @@ class ApiKeyInterceptor(ServerInterceptor):
             self._value,
         ) in handler_call_details.invocation_metadata:
             return await continuation(handler_call_details)
-        else:
-            return self._terminator
+        if self._token_header:
+            metadata = dict(handler_call_details.invocation_metadata)
+            op = TRANSFER_METHODS.get(handler_call_details.method.split("/")[-1])
+            token = metadata.get(self._token_header)
+            if op and token and verify_token(self._value, token, op):
+                return await continuation(handler_call_details)
+        return self._terminator
 
 
 class KernelRpcServer(KernelServerNodeServicer):
 
     def __init__(self):
-        self.kms = {}
-        self.kcs = {}
+        self.pool = KernelPool(
+            config["config_root_path"],
+            config["workspace"],
+            max_kernels=int(config.get("max_kernels", "8")),
+            idle_timeout=int(config.get("kernel_idle_timeout", "0")),
+            warm_size=int(config.get("warm_kernels", "1")),
+            preload_code=config.get("kernel_preload_code", ""),
+            start_timeout=int(config.get("kernel_start_timeout", "60")),
+            limits=KernelLimits(
+                memory_limit=int(config.get("kernel_memory_limit_mb", "0"))
+                * 1024
+                * 1024,
+                cpu_time_limit=int(config.get("kernel_cpu_time_limit", "0")),
+                cpu_quota=float(config.get("kernel_cpu_quota", "0")),
+                cgroup_root=config.get("kernel_cgroup_root", ""),
+            ),
+        )
+        # the seconds between the samples of the kernel usage
+        self.usage_sample_interval = int(config.get("usage_sample_interval", "10"))
+        # the overall timeout in seconds of an execution
+        self.execute_timeout = int(config.get("execute_timeout", "600"))
+        # the seconds to wait for the reply of the interrupt request
+        self.interrupt_timeout = int(config.get("interrupt_timeout", "5"))
+        # merge the stream output until the size or the interval in ms is reached,
+        # the stream_flush_size 0 sends every stream output at once
+        self.stream_flush_size = int(config.get("stream_flush_size", "4096"))
+        self.stream_flush_interval = (
+            int(config.get("stream_flush_interval", "50")) / 1000.0
+        )
+        # the stream output beyond the bytes of an execution is truncated, 0 means no limit
+        self.max_output_bytes = int(config.get("max_output_bytes", "1048576"))
+        # the chunk size in bytes of the file transfer
+        self.file_chunk_size = int(config.get("file_chunk_size", "1048576"))
+        # the partial files of the uploads
+        self.upload_dir = os.path.join(config["config_root_path"], "uploads")
+        # path -> ((size, mtime), sha256 digest)
+        self.digests = {}
+        # name the images by the digest of the content
+        self.content_addressed_images = (
+            config.get("content_addressed_images", "false").lower() == "true"
+        )
         self.auth_failed_status = status_pb2.Status(
             code=grpc.StatusCode.INVALID_ARGUMENT.value[0],
             message="api key is required",
@@ -99,6 +146,37 @@ class KernelRpcServer(KernelServerNodeServicer):
             f"start kernel rpc with config root path {config_root_path} and workspace {workspace}"
         )
 
+    def _get_session_id(self, context: ServicerContext) -> str:
+        """
+        the session id in the metadata, the empty session id uses the root workspace
+        """
+        metadata = dict(context.invocation_metadata())
+        if metadata.get("api_key") != config["rpc_key"] and metadata.get(
+            "transfer_token"
+        ):
+            # the session of the transfer token verified by the interceptor
+            payload = verify_token(config["rpc_key"], metadata["transfer_token"])
+            return payload["sid"] if payload else ""
+        return metadata.get("session_id", "")
+
+    async def _check_transfer(self, context: ServicerContext, op: str, filename: str):
+        """
+        check the transfer token has been issued for the file and return its
+        payload, the request with the api key is allowed and returns None
+        """
+        metadata = dict(context.invocation_metadata())
+        if metadata.get("api_key") == config["rpc_key"]:
+            return None
+        payload = verify_token(
+            config["rpc_key"], metadata.get("transfer_token", ""), op
+        )
+        if not payload or payload["f"] != filename:
+            await context.abort(
+                grpc.StatusCode.PERMISSION_DENIED,
+                "the transfer token is not issued for %s" % filename,
+            )
+        return payload
+
     async def stop(
         self, request: kernel_server_pb2.StopKernelRequest, context: ServicerContext
     ) -> kernel_server_pb2.StopKernelResponse:
@@ -107,15 +185,11 @@ class KernelRpcServer(KernelServerNodeServicer):
         """
 
         kernel_name = request.kernel_name if request.kernel_name else "python3"
-        if kernel_name not in self.kms or not self.kms[kernel_name]:
+        if not await self.pool.stop(self._get_session_id(context), kernel_name):
             logger.warning("no started kernel")
             return kernel_server_pb2.StopKernelResponse(
                 key="k", code=1, msg="no started kernel"
             )
-        self.kms[kernel_name].stop()
-        self.kcs[kernel_name].stop_client()
-        self.kms[kernel_name] = None
-        self.kcs[kernel_name] = None
         return kernel_server_pb2.StopKernelResponse(code=0, msg="ok")
 
     async def get_status(
@@ -123,11 +197,78 @@ class KernelRpcServer(KernelServerNodeServicer):
     ) -> kernel_server_pb2.GetStatusResponse:
         kernel_name = request.kernel_name if request.kernel_name else "python3"
         logger.debug("check the kernel %s status", kernel_name)
-        if kernel_name not in self.kms or not self.kms[kernel_name]:
+        kernel = self.pool.get(self._get_session_id(context), kernel_name)
+        if not kernel:
             return kernel_server_pb2.GetStatusResponse(is_alive=False, code=0, msg="ok")
-        is_alive = await self.kcs[kernel_name].is_alive()
+        is_alive = await kernel.kc.is_alive()
         return kernel_server_pb2.GetStatusResponse(is_alive=is_alive, code=0, msg="ok")
 
+    async def get_usage(
+        self, request: kernel_server_pb2.GetUsageRequest, context: ServicerContext
+    ) -> kernel_server_pb2.GetUsageResponse:
+        """
+        Get the sampled resource usage of the kernels
+        """
+        session_id = self._get_session_id(context)
+        usages = [
+            kernel_server_pb2.KernelUsage(
+                session_id=kernel.session_id,
+                kernel_name=kernel.kernel_name,
+                cpu_time=kernel.cpu_time,
+                rss=kernel.rss,
+                execution_time=kernel.execution_time,
+                execution_count=kernel.execution_count,
+                busy=kernel.busy,
+            )
+            for kernel in self.pool.kernels.values()
+            if request.all_sessions or kernel.session_id == session_id
+        ]
+        return kernel_server_pb2.GetUsageResponse(usages=usages, code=0, msg="ok")
+
+    async def interrupt(
+        self,
+        request: kernel_server_pb2.InterruptKernelRequest,
+        context: ServicerContext,
+    ) -> kernel_server_pb2.InterruptKernelResponse:
+        """
+        Interrupt the running execution of the kernel
+        """
+        kernel_name = request.kernel_name if request.kernel_name else "python3"
+        kernel = self.pool.get(self._get_session_id(context), kernel_name)
+        if not kernel:
+            return kernel_server_pb2.InterruptKernelResponse(
+                code=1, msg="no started kernel"
+            )
+        if not await kernel.kc.interrupt(self.interrupt_timeout):
+            logger.warning("the kernel %s does not reply the interrupt", kernel_name)
+            return kernel_server_pb2.InterruptKernelResponse(
+                code=1, msg="fail to interrupt the kernel"
+            )
+        return kernel_server_pb2.InterruptKernelResponse(code=0, msg="ok")
+
+    async def restart(
+        self, request: kernel_server_pb2.RestartKernelRequest, context: ServicerContext
+    ) -> kernel_server_pb2.RestartKernelResponse:
+        """
+        Restart the kernel
+        """
+        kernel_name = request.kernel_name if request.kernel_name else "python3"
+        try:
+            restarted = await self.pool.restart(
+                self._get_session_id(context), kernel_name
+            )
+        except KernelPoolFullError as ex:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(ex))
+        except RuntimeError as ex:
+            await context.abort(grpc.StatusCode.INTERNAL, str(ex))
+        except TimeoutError as ex:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, str(ex))
+        if not restarted:
+            return kernel_server_pb2.RestartKernelResponse(
+                code=1, msg="no started kernel"
+            )
+        return kernel_server_pb2.RestartKernelResponse(code=0, msg="ok")
+
     async def start(
         self, request: kernel_server_pb2.StartKernelRequest, context: ServicerContext
     ) -> kernel_server_pb2.StartKernelResponse:
@@ -135,43 +276,96 @@ class KernelRpcServer(KernelServerNodeServicer):
         Start the kernel
         """
         kernel_name = request.kernel_name if request.kernel_name else "python3"
-        if kernel_name in self.kms and self.kms[kernel_name]:
+        try:
+            started = await self.pool.start(self._get_session_id(context), kernel_name)
+        except KernelPoolFullError as ex:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(ex))
+        except RuntimeError as ex:
+            await context.abort(grpc.StatusCode.INTERNAL, str(ex))
+        except TimeoutError as ex:
+            await context.abort(grpc.StatusCode.DEADLINE_EXCEEDED, str(ex))
+        if not started:
             logger.warning(
                 "the request will be ignored for that the kernel has been started"
             )
             return kernel_server_pb2.StartKernelResponse(
                 code=0, msg="the kernel has been started"
             )
-        logging.info("create a new kernel with kernel_name %s" % kernel_name)
-        connection_file = "%s/kernel-%s.json" % (
-            config["config_root_path"],
-            uuid.uuid4(),
-        )
-        km = KernelManager(connection_file, config["workspace"], kernel=kernel_name)
-        km.start()
-        kc = KernelClient(connection_file)
-        await kc.start_client()
-        self.kms[kernel_name] = km
-        self.kcs[kernel_name] = kc
         return kernel_server_pb2.StartKernelResponse(code=0, msg="ok")
 
+    def _file_digest(self, path) -> str:
+        """
+        return the sha256 hex digest of the file, the digest is cached until the
+        file changes
+        """
+        stat = os.stat(path)
+        cached = self.digests.get(path)
+        if cached and cached[0] == (stat.st_size, stat.st_mtime_ns):
+            return cached[1]
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as fd:
+            while True:
+                buffer = fd.read(self.file_chunk_size)
+                if not buffer:
+                    break
+                sha256.update(buffer)
+        digest = sha256.hexdigest()
+        self.digests[path] = ((stat.st_size, stat.st_mtime_ns), digest)
+        return digest
+
+    def _get_part_path(self, target_filename) -> str:
+        """
+        the partial file of the upload, it's kept for resuming the upload
+        """
+        key = hashlib.sha256(target_filename.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.upload_dir, key + ".part")
+
+    async def stat_file(
+        self, request: common_pb2.StatFileRequest, context: ServicerContext
+    ) -> common_pb2.StatFileResponse:
+        """
+        return the state of the uploaded file and the partial upload
+        """
+        await self._check_transfer(context, "upload", request.filename)
+        workspace = self.pool.get_workspace(self._get_session_id(context))
+        target_filename = f"{workspace}{os.sep}{request.filename}"
+        response = common_pb2.StatFileResponse()
+        part_path = self._get_part_path(target_filename)
+        if await aio_os.path.exists(part_path):
+            response.partial_length = await aio_os.path.getsize(part_path)
+        if await aio_os.path.exists(target_filename):
+            response.exists = True
+            response.length = await aio_os.path.getsize(target_filename)
+            if request.with_digest:
+                response.digest = await asyncio.to_thread(
+                    self._file_digest, target_filename
+                )
+        return response
+
     async def download(
         self, request: common_pb2.DownloadRequest, context: ServicerContext
     ) -> AsyncIterable[common_pb2.FileChunk]:
         """
-        download file
+        download file from the offset
         """
+        await self._check_transfer(context, "download", request.filename)
         filename = request.filename
-        workspace = config["workspace"]
+        workspace = self.pool.get_workspace(self._get_session_id(context))
         target_filename = f"{workspace}{os.sep}{filename}"
         if not await aio_os.path.exists(target_filename):
             await context.abort(10, "%s filename do not exist" % request.filename)
+        offset = request.offset
         async with aiofiles.open(target_filename, "rb") as afp:
+            if offset:
+                await afp.seek(offset)
             while True:
-                chunk = await afp.read(1024 * 128)
+                chunk = await afp.read(self.file_chunk_size)
                 if not chunk:
                     break
-                yield common_pb2.FileChunk(buffer=chunk, filename=request.filename)
+                yield common_pb2.FileChunk(
+                    buffer=chunk, filename=request.filename, offset=offset
+                )
+                offset += len(chunk)
 
     async def upload(
         self,
@@ -180,25 +374,94 @@ class KernelRpcServer(KernelServerNodeServicer):
     ) -> common_pb2.FileUploaded:
         """
         upload file
+
+        The chunks are appended to a partial file which is moved to the workspace
+        when the upload completes. The upload with the offset of the first chunk
+        resumes the partial file and the file is verified with the digest of the
+        first chunk. The upload is skipped if the file has the same digest
         """
-        temp_dir = tempfile.mkdtemp(prefix="octogen")
-        filename = "".join(random.choices(string.ascii_lowercase, k=16))
-        tmp_full_path = f"{temp_dir}{os.sep}{filename}"
+        workspace = self.pool.get_workspace(self._get_session_id(context))
+        await aio_os.makedirs(workspace, exist_ok=True)
+        await aio_os.makedirs(self.upload_dir, exist_ok=True)
         target_filename = None
-        logger.info(f"upload file to temp file {tmp_full_path}")
+        part_path = None
+        max_size = 0
+        digest = ""
         length = 0
-        async with aiofiles.open(tmp_full_path, "wb") as afp:
+        afp = None
+        # the status to abort the upload with after the request stream is drained,
+        # the client still sending the chunks fails with an internal error
+        rejected = None
+        try:
             async for chunk in request:
+                if rejected:
+                    continue
+                if not afp:
+                    transfer = await self._check_transfer(
+                        context, "upload", chunk.filename
+                    )
+                    max_size = transfer.get("max", 0) if transfer else 0
+                    target_filename = "%s/%s" % (workspace, chunk.filename)
+                    digest = chunk.digest
+                    if (
+                        not chunk.offset
+                        and digest
+                        and await aio_os.path.exists(target_filename)
+                        and digest
+                        == await asyncio.to_thread(self._file_digest, target_filename)
+                    ):
+                        logger.info(f"skip the upload of the same {target_filename}")
+                        return common_pb2.FileUploaded(
+                            length=await aio_os.path.getsize(target_filename),
+                            skipped=True,
+                        )
+                    part_path = self._get_part_path(target_filename)
+                    if chunk.offset:
+                        part_length = (
+                            await aio_os.path.getsize(part_path)
+                            if await aio_os.path.exists(part_path)
+                            else 0
+                        )
+                        if part_length != chunk.offset:
+                            rejected = (
+                                grpc.StatusCode.FAILED_PRECONDITION,
+                                "the partial file has %d bytes" % part_length,
+                            )
+                            continue
+                    logger.info(
+                        f"upload file to {part_path} from offset {chunk.offset}"
+                    )
+                    afp = await aiofiles.open(part_path, "ab" if chunk.offset else "wb")
+                    length = chunk.offset
+                if max_size and length + len(chunk.buffer) > max_size:
+                    rejected = (
+                        grpc.StatusCode.INVALID_ARGUMENT,
+                        "exceed the max file limit",
+                    )
+                    continue
                 length = length + await afp.write(chunk.buffer)
-                logger.debug(f"write the {tmp_full_path} with {length}")
-                if not target_filename:
-                    target_filename = "%s/%s" % (config["workspace"], chunk.filename)
-        if length != 0:
-            logging.info(f"move file from {tmp_full_path} to  {target_filename}")
-            await aio_os.rename(tmp_full_path, target_filename)
-        else:
+                logger.debug(f"write the {part_path} with {length}")
+        finally:
+            # the partial file of the interrupted upload is kept for resuming
+            if afp:
+                await afp.close()
+        if rejected:
+            await context.abort(*rejected)
+        if length == 0:
             logging.warning("empty file")
-        await aio_os.rmdir(temp_dir)
+            if part_path:
+                await aio_os.remove(part_path)
+            return common_pb2.FileUploaded(length=length)
+        if digest and digest != await asyncio.to_thread(self._file_digest, part_path):
+            # the partial file is kept, the upload cancelled by the client can end
+            # like a completed one and it is resumed later. The client uploads the
+            # file again from the start if the resumed one mismatches too
+            await context.abort(
+                grpc.StatusCode.DATA_LOSS, "the digest of the uploaded file mismatches"
+            )
+        logging.info(f"move file from {part_path} to  {target_filename}")
+        self.digests.pop(part_path, None)
+        await aio_os.replace(part_path, target_filename)
         return common_pb2.FileUploaded(length=length)
 
     async def execute(
@@ -210,68 +473,171 @@ class KernelRpcServer(KernelServerNodeServicer):
         kernel_name = request.kernel_name if request.kernel_name else "python3"
         if not request.code:
             raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, "Invalid argument")
-        if (
-            kernel_name not in self.kms
-            or not self.kms[kernel_name]
-            or not self.kcs[kernel_name]
-        ):
+        session_id = self._get_session_id(context)
+        kernel = self.pool.get(session_id, kernel_name)
+        if not kernel:
             logger.warning(
                 "no started kernel for executing code for kernel name %s" % kernel_name
             )
             raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, "Invalid argument")
         logger.debug("the code %s with kernel %s", request.code, kernel_name)
-        # TODO check the busy status
-        msg_id = self.kcs[kernel_name].execute(request.code)
-        async for msg in self.kcs[kernel_name].read_response(context, 5):
-            try:
-                if context.cancelled() or not msg:
-                    break
-                if msg["parent_header"]["msg_id"] != msg_id:
-                    continue
-                if msg["msg_type"] in ["status", "execute_input"]:
-                    continue
-                respond = self._build_payload(msg, config["workspace"])
+        workspace = self.pool.get_workspace(session_id)
+        kernel.busy += 1
+        started_at = time.monotonic()
+        coalescer = StreamCoalescer(
+            self.stream_flush_size, self.stream_flush_interval, self.max_output_bytes
+        )
+        try:
+            msg_id = kernel.kc.execute(request.code)
+            async for msg in kernel.kc.read_response(
+                context,
+                msg_id,
+                timeout=self.execute_timeout,
+                tick_interval=(
+                    self.stream_flush_interval if self.stream_flush_size else None
+                ),
+            ):
+                try:
+                    if context.cancelled() or not msg:
+                        break
+                    if msg["msg_type"] in ["status", "execute_input"]:
+                        continue
+                    if msg["msg_type"] == "tick":
+                        outputs = coalescer.flush() if coalescer.due() else []
+                    elif msg["msg_type"] == "stream":
+                        outputs = coalescer.add(
+                            msg["content"]["name"], msg["content"]["text"]
+                        )
+                    else:
+                        # keep the order of the stream and the other output
+                        for respond in self._new_streams(
+                            coalescer.flush(), request.typed_output
+                        ):
+                            yield respond
+                        respond = await self._build_payload(
+                            msg, workspace, request.typed_output
+                        )
+                        yield respond
+                        continue
+                    for respond in self._new_streams(outputs, request.typed_output):
+                        yield respond
+                except Exception as ex:
+                    logger.exception("fail to handle the result")
+            if not context.cancelled():
+                for respond in self._new_streams(
+                    coalescer.flush(), request.typed_output
+                ):
+                    yield respond
+            else:
+                await self._interrupt_execution(kernel, msg_id)
+        except TimeoutError as ex:
+            logger.warning("the execution %s timeout", msg_id)
+            # stop the runaway code to release the kernel
+            await self._interrupt_execution(kernel, msg_id)
+            for respond in self._new_streams(coalescer.flush(), request.typed_output):
                 yield respond
-            except Exception as ex:
-                logger.exception("fail to handle the result")
+            yield self._new_traceback(str(ex), request.typed_output)
+        except asyncio.CancelledError:
+            # the client has cancelled the call or its deadline is exceeded
+            logger.warning("the execution %s is cancelled", msg_id)
+            await self._interrupt_execution(kernel, msg_id)
+            raise
+        finally:
+            kernel.busy -= 1
+            kernel.execution_time += time.monotonic() - started_at
+            kernel.execution_count += 1
+            kernel.touch()
+
+    async def _interrupt_execution(self, kernel, msg_id):
+        # only the execution of the request is stopped on the shared kernel
+        if not await kernel.kc.cancel(msg_id, self.interrupt_timeout):
+            logger.warning("fail to interrupt the execution %s", msg_id)
+
+    def _save_image(self, data, ext, workspace) -> str:
+        """
+        decode the base64 image and save it to the workspace, return the filename
+        """
+        buffer = base64.b64decode(data.encode("ascii"))
+        if not self.content_addressed_images:
+            filename = "octopus_%s.%s" % (uuid.uuid4().hex, ext)
+            with open("%s/%s" % (workspace, filename), "wb+") as fd:
+                fd.write(buffer)
+            return filename
+        # the identical images are stored once
+        filename = "octopus_%s.%s" % (hashlib.sha256(buffer).hexdigest()[:32], ext)
+        fullpath = "%s/%s" % (workspace, filename)
+        if not os.path.exists(fullpath):
+            tmp_path = "%s.%s.tmp" % (fullpath, uuid.uuid4().hex)
+            with open(tmp_path, "wb+") as fd:
+                fd.write(buffer)
+            os.replace(tmp_path, fullpath)
+        return filename
+
+    def _new_text(self, output_type, text, typed) -> kernel_server_pb2.ExecuteResponse:
+        if typed:
+            return kernel_server_pb2.ExecuteResponse(
+                output_type=output_type, text=text, typed=True
+            )
+        return kernel_server_pb2.ExecuteResponse(
+            output_type=output_type, output=json.dumps({"text": text})
+        )
+
+    def _new_streams(self, outputs, typed):
+        for name, text in outputs:
+            output_type = (
+                kernel_server_pb2.ExecuteResponse.StdoutType
+                if name == "stdout"
+                else kernel_server_pb2.ExecuteResponse.StderrType
+            )
+            yield self._new_text(output_type, text, typed)
+
+    def _new_traceback(self, traceback, typed) -> kernel_server_pb2.ExecuteResponse:
+        if typed:
+            return kernel_server_pb2.ExecuteResponse(
+                output_type=kernel_server_pb2.ExecuteResponse.TracebackType,
+                traceback=traceback,
+                typed=True,
+            )
+        return kernel_server_pb2.ExecuteResponse(
+            output_type=kernel_server_pb2.ExecuteResponse.TracebackType,
+            output=json.dumps({"traceback": traceback}),
+        )
+
+    def _new_result(self, result, typed) -> kernel_server_pb2.ExecuteResponse:
+        if typed:
+            return kernel_server_pb2.ExecuteResponse(
+                output_type=kernel_server_pb2.ExecuteResponse.ResultType,
+                result=result,
+                typed=True,
+            )
+        return kernel_server_pb2.ExecuteResponse(
+            output_type=kernel_server_pb2.ExecuteResponse.ResultType,
+            output=json.dumps(result),
+        )
 
-    def _build_payload(self, msg, workspace) -> kernel_server_pb2.ExecuteResponse:
+    async def _build_payload(
+        self, msg, workspace, typed=False
+    ) -> kernel_server_pb2.ExecuteResponse:
+        """
+        build the response from the kernel message, the typed fields are used
+        if the client asks for them, otherwise the output is json encoded
+        """
         if msg["msg_type"] == "display_data":
-            if "image/png" in msg["content"]["data"]:
-                filename = "octopus_%s.png" % uuid.uuid4().hex
-                fullpath = "%s/%s" % (workspace, filename)
-                with open(fullpath, "wb+") as fd:
-                    data = msg["content"]["data"]["image/png"].encode("ascii")
-                    buffer = base64.b64decode(data)
-                    fd.write(buffer)
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.ResultType,
-                    output=json.dumps({"image/png": filename}),
-                )
-            elif "image/gif" in msg["content"]["data"]:
-                filename = "octopus_%s.gif" % uuid.uuid4().hex
-                fullpath = "%s/%s" % (workspace, filename)
-                with open(fullpath, "wb+") as fd:
-                    data = msg["content"]["data"]["image/gif"].encode("ascii")
-                    buffer = base64.b64decode(data)
-                    fd.write(buffer)
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.ResultType,
-                    output=json.dumps({"image/gif": filename}),
+            for mime, ext in [("image/png", "png"), ("image/gif", "gif")]:
+                if mime not in msg["content"]["data"]:
+                    continue
+                # decode and write the image in the thread pool to keep the loop responsive
+                filename = await asyncio.to_thread(
+                    self._save_image, msg["content"]["data"][mime], ext, workspace
                 )
-            elif "text/plain" in msg["content"]["data"]:
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.ResultType,
-                    output=json.dumps(
-                        {"text/plain": msg["content"]["data"]["text/plain"]}
-                    ),
+                return self._new_result({mime: filename}, typed)
+            if "text/plain" in msg["content"]["data"]:
+                return self._new_result(
+                    {"text/plain": msg["content"]["data"]["text/plain"]}, typed
                 )
             else:
                 logger.warning(f" unsupported display_data {msg}")
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.ResultType,
-                    output=json.dumps({}),
-                )
+                return self._new_result({}, typed)
                 # keys = ",".join(msg["content"]["data"].keys())
                 # raise Exception(
                 #    f"unsupported display data type {keys} for the result {msg}"
@@ -279,20 +645,21 @@ class KernelRpcServer(KernelServerNodeServicer):
 
         if msg["msg_type"] == "execute_result":
             logger.debug("result data %s", msg["content"]["data"]["text/plain"])
-            return kernel_server_pb2.ExecuteResponse(
-                output_type=kernel_server_pb2.ExecuteResponse.ResultType,
-                output=json.dumps({"text/plain": msg["content"]["data"]["text/plain"]}),
+            return self._new_result(
+                {"text/plain": msg["content"]["data"]["text/plain"]}, typed
             )
         elif msg["msg_type"] == "stream":
             if msg["content"]["name"] == "stdout":
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.StdoutType,
-                    output=json.dumps({"text": msg["content"]["text"]}),
+                return self._new_text(
+                    kernel_server_pb2.ExecuteResponse.StdoutType,
+                    msg["content"]["text"],
+                    typed,
                 )
             else:
-                return kernel_server_pb2.ExecuteResponse(
-                    output_type=kernel_server_pb2.ExecuteResponse.StderrType,
-                    output=json.dumps({"text": msg["content"]["text"]}),
+                return self._new_text(
+                    kernel_server_pb2.ExecuteResponse.StderrType,
+                    msg["content"]["text"],
+                    typed,
                 )
         elif msg["msg_type"] == "error":
             if len(msg["content"]["traceback"]) > 6:
@@ -300,10 +667,7 @@ class KernelRpcServer(KernelServerNodeServicer):
                 traceback = traceback + "\n".join(msg["content"]["traceback"][-3:])
             else:
                 traceback = "\n".join(msg["content"]["traceback"])
-            return kernel_server_pb2.ExecuteResponse(
-                output_type=kernel_server_pb2.ExecuteResponse.TracebackType,
-                output=json.dumps({"traceback": ansi_escape.sub("", traceback)}),
-            )
+            return self._new_traceback(ansi_escape.sub("", traceback), typed)
         raise Exception(f"unsupported msg type {msg}")
 
 
@@ -319,14 +683,26 @@ async def serve() -> None:
             config["rpc_key"],
             grpc.StatusCode.ABORTED.value[0],
             "api key is required or invalid",
+            token_header="transfer_token",
         )
     ]
     serv = server(interceptors=interceptors)
-    add_KernelServerNodeServicer_to_server(KernelRpcServer(), serv)
+    kernel_server = KernelRpcServer()
+    add_KernelServerNodeServicer_to_server(kernel_server, serv)
     listen_addr = "%s:%s" % (config["rpc_host"], config["rpc_port"])
     serv.add_insecure_port(listen_addr)
     await serv.start()
-    await serv.wait_for_termination()
+    kernel_server.pool.schedule_refill()
+    reaper = asyncio.create_task(kernel_server.pool.run_reaper())
+    sampler = asyncio.create_task(
+        kernel_server.pool.run_sampler(kernel_server.usage_sample_interval)
+    )
+    try:
+        await serv.wait_for_termination()
+    finally:
+        reaper.cancel()
+        sampler.cancel()
+        await kernel_server.pool.stop_all()
 
 
 def server_main():
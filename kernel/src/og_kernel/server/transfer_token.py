@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+"""
+The short-lived token for transferring a file with the kernel directly
+
+The agent signs the token with the api key of the kernel, the client sends it
+in the transfer_token metadata to the upload, download and stat_file rpcs of the
+kernel. The token is bound to the session, the operation and the filename
+
+Typical usage example:
+    token = issue_token(kernel_key, session_id, "upload", "data.csv", ttl=300)
+    payload = verify_token(kernel_key, token, "upload")
+"""
+
+# the rpc method -> the operation of the token
+TRANSFER_METHODS = {
+    "upload": "upload",
+    "stat_file": "upload",
+    "download": "download",
+}
+
+
+def _sign(secret: str, payload: bytes) -> str:
+    return hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+
+
+def issue_token(
+    secret: str,
+    session_id: str,
+    op: str,
+    filename: str,
+    ttl: int = 300,
+    max_size: int = 0,
+) -> str:
+    """
+    return the token of the operation on the file, it expires in ttl seconds and
+    the upload is limited to max_size bytes if it's not 0
+    """
+    payload = json.dumps(
+        {
+            "sid": session_id,
+            "op": op,
+            "f": filename,
+            "exp": int(time.time()) + ttl,
+            "max": max_size,
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    encoded = base64.urlsafe_b64encode(payload).decode("ascii")
+    return "%s.%s" % (encoded, _sign(secret, payload))
+
+
+def verify_token(secret: str, token: str, op: str = None):
+    """
+    return the payload of the valid token or None, the operation is not checked
+    if op is None
+    """
+    try:
+        encoded, signature = token.split(".", 1)
+        payload = base64.urlsafe_b64decode(encoded.encode("ascii"))
+        if not hmac.compare_digest(_sign(secret, payload), signature):
+            return None
+        data = json.loads(payload)
+    except Exception as ex:
+        logger.warning("invalid transfer token for %s", ex)
+        return None
+    if (op and data.get("op") != op) or data.get("exp", 0) < time.time():
+        return None
+    return data
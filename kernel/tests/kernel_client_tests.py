@@ -12,6 +12,7 @@ import pytest
 import logging
 from og_kernel.kernel.kernel_mgr import KernelManager
 from og_kernel.kernel.kernel_client import KernelClient
+from og_kernel.kernel.resource_limit import KernelLimits
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +28,7 @@ class MockContext:
 
 @pytest.fixture
 def kernel_manager():
-    config_path = os.path.join("/tmp", str(random.randint(1, 100000)))
+    config_path = os.path.join("/tmp", "kernel-%d.json" % random.randint(1, 100000))
     workspace = os.path.join("/tmp", str(random.randint(1, 100000)))
     kernel_manager = KernelManager(config_path, workspace)
     kernel_manager.start()
@@ -37,7 +38,7 @@ def kernel_manager():
 
 @pytest.fixture
 def ts_kernel_manager():
-    config_path = os.path.join("/tmp", str(random.randint(1, 100000)))
+    config_path = os.path.join("/tmp", "kernel-%d.json" % random.randint(1, 100000))
     workspace = os.path.join("/tmp", str(random.randint(1, 100000)))
     kernel_manager = KernelManager(config_path, workspace, "tslab")
     kernel_manager.start()
@@ -73,10 +74,10 @@ async def test_result_occurs(kernel_manager):
     code = """
 5
 """
-    kernel_client.execute(code)
+    msg_id = kernel_client.execute(code)
     messages = []
     context = MockContext()
-    async for msg in kernel_client.read_response(context):
+    async for msg in kernel_client.read_response(context, msg_id):
         if not msg:
             break
         messages.append(msg)
@@ -98,11 +99,11 @@ async def test_stderr_occurs(kernel_manager):
 import sys
 print('Hello world', file=sys.stderr)
 """
-    kernel_client.execute(code)
+    msg_id = kernel_client.execute(code)
     messages = []
 
     context = MockContext()
-    async for msg in kernel_client.read_response(context):
+    async for msg in kernel_client.read_response(context, msg_id):
         if not msg:
             break
         messages.append(msg)
@@ -123,11 +124,11 @@ async def test_stdout_occurs(kernel_manager):
     code = """
 print("hello world!")
 """
-    kernel_client.execute(code)
+    msg_id = kernel_client.execute(code)
     messages = []
 
     context = MockContext()
-    async for msg in kernel_client.read_response(context):
+    async for msg in kernel_client.read_response(context, msg_id):
         if not msg:
             break
         messages.append(msg)
@@ -151,11 +152,11 @@ b = 20
 if (a < b)
     print('a is less than b')
 """
-    kernel_client.execute(code)
+    msg_id = kernel_client.execute(code)
     messages = []
 
     context = MockContext()
-    async for msg in kernel_client.read_response(context):
+    async for msg in kernel_client.read_response(context, msg_id):
         if not msg:
             break
         messages.append(msg)
@@ -184,11 +185,11 @@ plt.pie(data, labels=labels, autopct='%1.1f%%')
 plt.title('Pie Chart')
 plt.show() 
 """
-    kernel_client.execute(code)
+    msg_id = kernel_client.execute(code)
     messages = []
 
     context = MockContext()
-    async for msg in kernel_client.read_response(context):
+    async for msg in kernel_client.read_response(context, msg_id):
         if msg:
             logger.debug(f"{msg}")
             messages.append(msg)
@@ -198,3 +199,145 @@ plt.show()
     await asyncio.sleep(2)
     await kernel_client.stop_watch()
     kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_silent_computation_completes(kernel_manager):
+    """Test the long silent computation is not cut off"""
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    code = """
+import time
+time.sleep(3)
+print("done")
+"""
+    msg_id = kernel_client.execute(code)
+    messages = []
+    context = MockContext()
+    async for msg in kernel_client.read_response(context, msg_id, timeout=10):
+        if not msg:
+            break
+        messages.append(msg)
+    streams = list(filter(lambda x: x["msg_type"] == "stream", messages))
+    assert streams[0]["content"]["text"] == "done\n"
+    assert messages[-1]["msg_type"] == "status"
+    assert messages[-1]["content"]["execution_state"] == "idle"
+    kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_execution_timeout(kernel_manager):
+    """Test the execution exceeds the timeout"""
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    msg_id = kernel_client.execute("import time\ntime.sleep(3)")
+    context = MockContext()
+    with pytest.raises(TimeoutError):
+        async for msg in kernel_client.read_response(context, msg_id, timeout=1):
+            pass
+    kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_executions(kernel_manager):
+    """Test the messages are routed to the execution"""
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    context = MockContext()
+
+    async def read_stdout(msg_id):
+        outputs = []
+        async for msg in kernel_client.read_response(context, msg_id, timeout=20):
+            if not msg:
+                break
+            if msg["msg_type"] == "stream":
+                outputs.append(msg["content"]["text"])
+        return "".join(outputs)
+
+    msg_id1 = kernel_client.execute("import time\ntime.sleep(1)\nprint('first')")
+    msg_id2 = kernel_client.execute("print('second')")
+    outputs = await asyncio.gather(read_stdout(msg_id2), read_stdout(msg_id1))
+    assert outputs == ["second\n", "first\n"]
+    assert not kernel_client.queues
+    kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_interrupt(kernel_manager):
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    msg_id = kernel_client.execute("import time\ntime.sleep(60)")
+    await asyncio.sleep(1)
+    assert await kernel_client.interrupt()
+    errors = []
+    async for msg in kernel_client.read_response(MockContext(), msg_id, timeout=10):
+        if not msg:
+            break
+        if msg["msg_type"] == "error":
+            errors.append(msg["content"]["ename"])
+    assert errors == ["KeyboardInterrupt"]
+    kernel_client.stop_client()
+
+
+async def _read_errors(kernel_client, msg_id):
+    errors = []
+    outputs = []
+    async for msg in kernel_client.read_response(MockContext(), msg_id, timeout=20):
+        if not msg:
+            break
+        if msg["msg_type"] == "error":
+            errors.append(msg["content"]["ename"])
+        elif msg["msg_type"] == "stream":
+            outputs.append(msg["content"]["text"])
+    return errors, "".join(outputs)
+
+
+@pytest.mark.asyncio
+async def test_cancel_only_the_execution(kernel_manager):
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    running_id = kernel_client.execute("import time\ntime.sleep(2)\nprint('a')")
+    queued_id = kernel_client.execute("time.sleep(60)")
+    next_id = kernel_client.execute("print('c')")
+    await asyncio.sleep(0.5)
+    assert kernel_client.running_msg_id == running_id
+    # the queued execution is interrupted when it starts
+    assert await kernel_client.cancel(queued_id)
+    assert await _read_errors(kernel_client, running_id) == ([], "a\n")
+    assert await _read_errors(kernel_client, queued_id) == (["KeyboardInterrupt"], "")
+    assert await _read_errors(kernel_client, next_id) == ([], "c\n")
+    assert not kernel_client.pending and not kernel_client.cancelled
+    kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_kernel_died(kernel_manager):
+    kernel_client = KernelClient(kernel_manager.config_path, time_to_dead=1)
+    await kernel_client.start_client()
+    msg_id = kernel_client.execute("import time\ntime.sleep(60)")
+    await asyncio.sleep(0.5)
+    kernel_manager.process.kill()
+    errors = await asyncio.wait_for(_read_errors(kernel_client, msg_id), 10)
+    assert errors == (["DeadKernelError"], "")
+    kernel_client.stop_client()
+
+
+@pytest.mark.asyncio
+async def test_memory_limit():
+    config_path = os.path.join("/tmp", "kernel-%d.json" % random.randint(1, 100000))
+    workspace = os.path.join("/tmp", str(random.randint(1, 100000)))
+    limits = KernelLimits(memory_limit=2 * 1024**3)
+    kernel_manager = KernelManager(config_path, workspace, limits=limits)
+    kernel_manager.start()
+    kernel_client = KernelClient(kernel_manager.config_path)
+    await kernel_client.start_client()
+    msg_id = kernel_client.execute("data = bytearray(4 * 1024**3)")
+    errors = []
+    async for msg in kernel_client.read_response(MockContext(), msg_id):
+        if not msg:
+            break
+        if msg["msg_type"] == "error":
+            errors.append(msg["content"]["ename"])
+    kernel_client.stop_client()
+    kernel_manager.stop()
+    assert errors == ["MemoryError"]
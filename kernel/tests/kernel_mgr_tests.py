@@ -3,6 +3,7 @@
 #
 # SPDX-License-Identifier: Elastic-2.0
 
+import os
 import pytest
 
 from og_kernel.kernel.kernel_mgr import KernelManager
@@ -52,3 +53,41 @@ def test_stop_kernel():
     km.stop()
     assert not km.is_running
     assert km.process is None
+
+
+@pytest.mark.asyncio
+async def test_astart_kernel():
+    km = KernelManager(
+        config_path="/tmp/kernel_connection_file3.json",
+        workspace="/tmp/workspace3",
+    )
+    await km.astart()
+    assert km.is_running
+    assert os.path.isfile(km.config_path)
+    km.stop()
+    assert km.process is None
+
+
+@pytest.mark.asyncio
+async def test_astart_kernel_timeout():
+    km = KernelManager(
+        config_path="/tmp/kernel_connection_file4.json",
+        workspace="/tmp/workspace4",
+    )
+    with pytest.raises(TimeoutError):
+        await km.astart(timeout=0.01)
+    assert not km.is_running
+    assert km.process is None
+
+
+def test_kernel_usage():
+    km = KernelManager(
+        config_path="/tmp/kernel_connection_file5.json",
+        workspace="/tmp/workspace5",
+    )
+    assert km.usage() == (0, 0)
+    km.start()
+    cpu_time, rss = km.usage()
+    km.stop()
+    assert cpu_time > 0
+    assert rss > 0
@@ -0,0 +1,154 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+import os
+import random
+import asyncio
+import pytest
+import pytest_asyncio
+import logging
+from og_kernel.kernel.kernel_pool import KernelPool
+
+logger = logging.getLogger(__name__)
+
+
+class MockContext:
+    """
+    Mock the grpc request context
+    """
+
+    def done(self):
+        return False
+
+
+async def execute(kernel, code):
+    msg_id = kernel.kc.execute(code)
+    outputs = []
+    async for msg in kernel.kc.read_response(MockContext(), msg_id):
+        if not msg:
+            break
+        if msg["msg_type"] == "stream":
+            outputs.append(msg["content"]["text"])
+    return "".join(outputs)
+
+
+@pytest_asyncio.fixture
+async def kernel_pool():
+    config_root_path = os.path.join("/tmp", "kernel_config_%d" % random.randint(1, 100000))
+    workspace = os.path.join("/tmp", str(random.randint(1, 100000)))
+    os.makedirs(config_root_path, exist_ok=True)
+    kernel_pool = KernelPool(config_root_path, workspace, max_kernels=2)
+    yield kernel_pool
+    await kernel_pool.stop_all()
+
+
+def test_get_workspace():
+    pool = KernelPool("/tmp/config", "/tmp/ws")
+    assert pool.get_workspace("") == "/tmp/ws"
+    assert pool.get_workspace("abc") == "/tmp/ws/session_abc"
+    assert pool.get_workspace("../abc") == "/tmp/ws/session____abc"
+
+
+@pytest.mark.asyncio
+async def test_isolated_sessions(kernel_pool):
+    assert await kernel_pool.start("session1", "python3")
+    assert not await kernel_pool.start("session1", "python3")
+    assert await kernel_pool.start("session2", "python3")
+    kernel1 = kernel_pool.get("session1", "python3")
+    kernel2 = kernel_pool.get("session2", "python3")
+    await execute(kernel1, "a = 1")
+    output = await execute(kernel2, "print('a' in globals())")
+    assert output.strip() == "False"
+    output = await execute(kernel1, "import os\nprint(os.getcwd())")
+    assert output.strip() == kernel_pool.get_workspace("session1")
+
+
+@pytest.mark.asyncio
+async def test_evict_and_reap(kernel_pool):
+    await kernel_pool.start("session1", "python3")
+    await kernel_pool.start("session2", "python3")
+    kernel_pool.get("session1", "python3")
+    # the least recently used kernel is evicted
+    await kernel_pool.start("session3", "python3")
+    assert kernel_pool.get("session2", "python3") is None
+    assert kernel_pool.get("session1", "python3")
+    kernel_pool.get("session3", "python3").busy = 1
+    kernel_pool.get("session1", "python3").busy = 1
+    with pytest.raises(RuntimeError):
+        await kernel_pool.start("session4", "python3")
+    kernel_pool.get("session1", "python3").busy = 0
+    kernel_pool.idle_timeout = 0.01
+    kernel_pool.get("session1", "python3").last_used -= 1
+    await kernel_pool.reap_idle_kernels()
+    assert kernel_pool.get("session1", "python3") is None
+    assert kernel_pool.get("session3", "python3")
+    assert await kernel_pool.stop("session3", "python3")
+    assert not await kernel_pool.stop("session3", "python3")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_start(kernel_pool):
+    first = asyncio.create_task(kernel_pool.start("session1", "python3"))
+    await asyncio.sleep(0.1)
+    # the lock is released while the kernel is launching
+    assert not kernel_pool.lock.locked()
+    assert ("session1", "python3") in kernel_pool.starting
+    results = await asyncio.gather(
+        first,
+        kernel_pool.start("session1", "python3"),
+        kernel_pool.start("session2", "python3"),
+    )
+    assert results == [True, False, True]
+    assert kernel_pool.get("session1", "python3")
+    assert kernel_pool.get("session2", "python3")
+    assert not kernel_pool.starting
+
+
+@pytest.mark.asyncio
+async def test_stop_without_blocking(kernel_pool):
+    await kernel_pool.start("session1", "python3")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    try:
+        assert await kernel_pool.stop("session1", "python3")
+    finally:
+        ticker.cancel()
+    # the loop keeps running while the kernel is stopping
+    assert ticks > 0
+
+
+@pytest.mark.asyncio
+async def test_warm_kernel(kernel_pool):
+    kernel_pool.warm_size = 1
+    kernel_pool.preload_code = "preloaded = 42"
+    kernel_pool.schedule_refill()
+    await kernel_pool.refill_task
+    assert len(kernel_pool.warm_kernels) == 1
+    assert await kernel_pool.start("session1", "python3")
+    assert len(kernel_pool.warm_kernels) == 0
+    kernel = kernel_pool.get("session1", "python3")
+    output = await execute(kernel, "import os\nprint(preloaded, os.getcwd())")
+    assert output.strip() == "42 %s" % kernel_pool.get_workspace("session1")
+    # the warm kernel is refilled in the background
+    await kernel_pool.refill_task
+    assert len(kernel_pool.warm_kernels) == 1
+
+
+@pytest.mark.asyncio
+async def test_sample_usage(kernel_pool):
+    await kernel_pool.start("session1", "python3")
+    kernel = kernel_pool.get("session1", "python3")
+    assert kernel.rss == 0
+    await kernel_pool.sample_usage()
+    assert kernel.cpu_time > 0
+    assert kernel.rss > 0
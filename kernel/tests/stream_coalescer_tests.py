@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+import time
+import logging
+from og_kernel.kernel.stream_coalescer import StreamCoalescer, TRUNCATION_MARKER
+
+logger = logging.getLogger(__name__)
+
+
+def test_coalesce_by_size():
+    coalescer = StreamCoalescer(flush_size=10, flush_interval=60)
+    assert coalescer.add("stdout", "hello") == []
+    assert coalescer.add("stdout", "world!") == [("stdout", "helloworld!")]
+    assert coalescer.flush() == []
+
+
+def test_coalesce_by_stream_name():
+    coalescer = StreamCoalescer(flush_size=100, flush_interval=60)
+    assert coalescer.add("stdout", "a") == []
+    assert coalescer.add("stdout", "b") == []
+    assert coalescer.add("stderr", "c") == [("stdout", "ab")]
+    assert coalescer.flush() == [("stderr", "c")]
+
+
+def test_coalesce_by_interval():
+    coalescer = StreamCoalescer(flush_size=100, flush_interval=0.01)
+    assert coalescer.add("stdout", "a") == []
+    assert not coalescer.due()
+    time.sleep(0.02)
+    assert coalescer.due()
+    assert coalescer.add("stdout", "b") == [("stdout", "ab")]
+    assert not coalescer.due()
+
+
+def test_truncate_output():
+    coalescer = StreamCoalescer(flush_size=0, max_output_bytes=8)
+    assert coalescer.add("stdout", "12345") == [("stdout", "12345")]
+    assert coalescer.add("stdout", "67890") == [
+        ("stdout", "678" + TRUNCATION_MARKER % 8)
+    ]
+    assert coalescer.truncated
+    assert coalescer.add("stderr", "error") == []
@@ -0,0 +1,28 @@
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+""" """
+import logging
+from og_kernel.server.transfer_token import issue_token, verify_token
+
+logger = logging.getLogger(__name__)
+
+
+def test_verify_token():
+    token = issue_token("key", "session1", "upload", "data.csv", max_size=10)
+    payload = verify_token("key", token, "upload")
+    assert payload["sid"] == "session1"
+    assert payload["f"] == "data.csv"
+    assert payload["max"] == 10
+    assert verify_token("key", token)
+    assert not verify_token("key", token, "download")
+    assert not verify_token("bad_key", token, "upload")
+    assert not verify_token("key", token[:-1], "upload")
+    assert not verify_token("key", "bad_token", "upload")
+
+
+def test_expired_token():
+    token = issue_token("key", "session1", "download", "data.csv", ttl=-1)
+    assert not verify_token("key", token, "download")
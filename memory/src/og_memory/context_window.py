@@ -0,0 +1,143 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+"""
+
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRUNCATED_MARK = "\n...(the output is truncated)...\n"
+
+
+class ContextWindow:
+    """
+    Select and compact the chat messages to fit the token budget
+
+    The steps to compact the messages
+    1. trim the function outputs from the oldest one, the latest output is kept intact
+    2. drop the oldest messages, the latest user message and the latest function
+       call with its outputs are always kept
+    3. trim the latest function output if the messages still exceed the budget
+    The dropped messages will be summarized with a short note if summarize is True
+
+    The trimmed function outputs can be cached by the caller with trim and passed to
+    compact, so the older outputs are not encoded again in every step
+
+    Typical usage example:
+        window = ContextWindow(encoding, 3000)
+        messages, token_count = window.compact(system_message, system_token_count,
+                                               chat_messages, chat_token_counts)
+    """
+
+    def __init__(self, encoding, token_budget, trimmed_output_token_count=64, summarize=True):
+        self.encoding = encoding
+        self.token_budget = token_budget
+        self.trimmed_output_token_count = trimmed_output_token_count
+        self.summarize = summarize
+        self.mark_token_count = len(encoding.encode(TRUNCATED_MARK))
+
+    def compact(self, system_message, system_token_count, messages, token_counts, trimmed=None):
+        """
+        return the compacted messages including the system message and the token count of them
+
+        trimmed - the cached trim results of the function outputs, None for the other messages
+        """
+        total = system_token_count + sum(token_counts)
+        if total <= self.token_budget:
+            return [system_message] + messages, total
+        messages = list(messages)
+        token_counts = list(token_counts)
+        last_output_index = self._last_index(messages, lambda m: m.get("role") == "function")
+        for index, message in enumerate(messages):
+            if total <= self.token_budget:
+                break
+            if index == last_output_index or message.get("role") != "function":
+                continue
+            total -= token_counts[index]
+            if trimmed and trimmed[index]:
+                messages[index], token_counts[index] = trimmed[index]
+            else:
+                messages[index], token_counts[index] = self.trim(message)
+            total += token_counts[index]
+        if total > self.token_budget:
+            messages, token_counts, total = self._drop(messages, token_counts, total)
+        last_output_index = self._last_index(messages, lambda m: m.get("role") == "function")
+        if total > self.token_budget and last_output_index >= 0:
+            overflow = total - self.token_budget
+            limit = max(self.trimmed_output_token_count, token_counts[last_output_index] - overflow - self.mark_token_count)
+            total -= token_counts[last_output_index]
+            messages[last_output_index], token_counts[last_output_index] = self.trim(
+                messages[last_output_index], limit, keep_tail=True)
+            total += token_counts[last_output_index]
+        if total > self.token_budget:
+            logger.warning(f"the messages with {total} tokens still exceed the budget {self.token_budget}")
+        return [system_message] + messages, total
+
+    def _drop(self, messages, token_counts, total):
+        last_user_index = self._last_index(messages, lambda m: m.get("role") == "user")
+        last_call_index = self._last_index(messages, lambda m: m.get("function_call"))
+        protected_start = last_call_index if last_call_index >= 0 else len(messages) - 1
+        dropped = set()
+        summary = self._summary_message(0)
+        summary_token_count = len(self.encoding.encode(summary["content"])) if self.summarize else 0
+        index = 0
+        while index < protected_start and total + summary_token_count > self.token_budget:
+            if index == last_user_index:
+                index += 1
+                continue
+            dropped.add(index)
+            total -= token_counts[index]
+            index += 1
+            # the function outputs should be dropped with the function call
+            while index < protected_start and messages[index].get("role") == "function":
+                dropped.add(index)
+                total -= token_counts[index]
+                index += 1
+        if not dropped:
+            return messages, token_counts, total
+        logger.debug(f"drop {len(dropped)} messages to fit the budget {self.token_budget}")
+        kept_messages = [m for i, m in enumerate(messages) if i not in dropped]
+        kept_token_counts = [c for i, c in enumerate(token_counts) if i not in dropped]
+        if self.summarize:
+            summary = self._summary_message(len(dropped))
+            summary_token_count = len(self.encoding.encode(summary["content"]))
+            kept_messages.insert(0, summary)
+            kept_token_counts.insert(0, summary_token_count)
+            total += summary_token_count
+        return kept_messages, kept_token_counts, total
+
+    def _summary_message(self, dropped_count):
+        return {
+            "role": "system",
+            "content": f"{dropped_count} earlier messages of the conversation were omitted to fit the context window",
+        }
+
+    def trim(self, message, limit=None, keep_tail=False):
+        """
+        return the message with the content trimmed to the limit of tokens and the token count
+        """
+        limit = limit if limit else self.trimmed_output_token_count
+        tokens = self.encoding.encode(message.get("content") or "")
+        if len(tokens) <= limit:
+            return message, len(tokens)
+        if keep_tail:
+            head_count = limit // 2
+            content = (self.encoding.decode(tokens[:head_count]) + TRUNCATED_MARK
+                       + self.encoding.decode(tokens[len(tokens) - (limit - head_count):]))
+        else:
+            content = self.encoding.decode(tokens[:limit]) + TRUNCATED_MARK
+        trimmed_message = dict(message)
+        trimmed_message["content"] = content
+        return trimmed_message, limit + self.mark_token_count
+
+    def _last_index(self, messages, predicate):
+        for index in range(len(messages) - 1, -1, -1):
+            if predicate(messages[index]):
+                return index
+        return -1
@@ -13,15 +13,20 @@ import logging
 from abc import ABC, abstractmethod
 from pydantic import BaseModel, Field
 from og_proto.memory_pb2 import AgentMemory as AgentMemoryProto
+from og_proto.memory_pb2 import ChatMessage
 from jinja2 import Environment
 from jinja2.loaders import PackageLoader
 import tiktoken
+from .context_window import ContextWindow, TRUNCATED_MARK
 logger = logging.getLogger(__name__)
 
 env = Environment(loader=PackageLoader("og_memory", "template"))
 env.filters['from_json'] = lambda s: json.loads(s)
 context_tpl = env.get_template("agent.jinja")
 encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+# the function output longer than the chars per token of the context token limit
+# can not fit the context window, the middle of it is cut before it is stored
+OUTPUT_CHARS_PER_TOKEN = 8
 
 
 def agent_memory_to_context(instruction, guide_memory, options):
@@ -72,6 +77,13 @@ class BaseAgentMemory(ABC):
         """
         pass
 
+    @abstractmethod
+    def to_messages_with_token_count(self):
+        """
+        Convert the memory to messages and return the token count of the messages
+        """
+        pass
+
     @abstractmethod
     def reset_memory(self):
         """
@@ -93,6 +105,7 @@ class AgentMemoryOption(BaseModel):
     """
     show_function_instruction: bool = Field(False, description="Show the function instruction")
     disable_output_format: bool = Field(False, description="Disable the output format")
+    context_token_limit: int = Field(0, description="The token budget of the messages, 0 means no limit")
 
 class MemoryAgentMemory(BaseAgentMemory):
     """
@@ -104,35 +117,128 @@ class MemoryAgentMemory(BaseAgentMemory):
         self.user_id = user_id
         self.guide_memory = []
         self.chat_memory = []
+        # the token count of every chat message
+        self.chat_token_counts = []
+        # the cached trimmed function outputs and the token counts of them
+        self.chat_trimmed = []
         self.instruction = None
         self.options = AgentMemoryOption(show_function_instruction=True)
+        # the version will be increased when the instruction, guides or options change
+        self.version = 0
+        # the cache of (version, system message, token count of system message)
+        self.system_message_cache = None
+        # the cache of (version, function definitions)
+        self.functions_cache = None
 
     def update_options(self, options):
+        if options != self.options:
+            self.version += 1
         self.options = options
 
     def reset_memory(self):
         self.guide_memory = []
         self.chat_memory = []
+        self.chat_token_counts = []
+        self.chat_trimmed = []
+        self.version += 1
 
     def append_guide(self, guide):
         self.guide_memory.append(guide)
+        self.version += 1
 
     def append_chat_message(self, message):
+        if message.get("role") == "function" and self.options.context_token_limit > 0:
+            message = self._bound_output(message)
         self.chat_memory.append(message)
+        content = message.get("content")
+        token_count = len(encoding.encode(content)) if content else 0
+        function_call = message.get("function_call")
+        if function_call:
+            token_count += len(encoding.encode(function_call.get("arguments", "")))
+        self.chat_token_counts.append(token_count)
+
+    def _bound_output(self, message):
+        content = message.get("content") or ""
+        max_chars = self.options.context_token_limit * OUTPUT_CHARS_PER_TOKEN
+        if len(content) <= max_chars:
+            return message
+        bounded_message = dict(message)
+        bounded_message["content"] = content[:max_chars // 2] + TRUNCATED_MARK + content[len(content) - max_chars // 2:]
+        return bounded_message
+
+    def _get_trimmed_outputs(self, window):
+        """
+        trim the new function outputs once, the older ones are read from the cache
+        """
+        for message in self.chat_memory[len(self.chat_trimmed):]:
+            self.chat_trimmed.append(window.trim(message) if message.get("role") == "function" else None)
+        return self.chat_trimmed
 
     def swap_instruction(self, instruction):
         self.instruction = instruction
+        self.version += 1
 
     def get_functions(self):
-        return [{"name": action.name, "description": action.desc, "parameters":
-          json.loads(action.parameters)} for action in self.instruction.actions]
+        if not self.functions_cache or self.functions_cache[0] != self.version:
+            functions = [{"name": action.name, "description": action.desc, "parameters":
+              json.loads(action.parameters)} for action in self.instruction.actions]
+            self.functions_cache = (self.version, functions)
+        return self.functions_cache[1]
+
+    def _get_system_message(self):
+        if not self.system_message_cache or self.system_message_cache[0] != self.version:
+            system_message = {
+              "role":"system",
+              "content":agent_memory_to_context(self.instruction, self.guide_memory, options = self.options)
+            }
+            logger.debug(f"system message: {system_message}")
+            self.system_message_cache = (self.version, system_message,
+                                         len(encoding.encode(system_message["content"])))
+        return self.system_message_cache[1], self.system_message_cache[2]
 
     def to_messages(self):
-        system_message = {
-          "role":"system",
-          "content":agent_memory_to_context(self.instruction, self.guide_memory, options = self.options)
-        }
-        logging.debug(f"system message: {system_message}")
+        system_message, _ = self._get_system_message()
         return [system_message] + self.chat_memory
 
+    def to_messages_with_token_count(self):
+        system_message, system_token_count = self._get_system_message()
+        if self.options.context_token_limit > 0:
+            window = ContextWindow(encoding, self.options.context_token_limit)
+            return window.compact(system_message, system_token_count, self.chat_memory,
+                                  self.chat_token_counts, self._get_trimmed_outputs(window))
+        return [system_message] + self.chat_memory, system_token_count + sum(self.chat_token_counts)
 
+    def to_proto(self):
+        """
+        Convert the memory to the AgentMemory message
+        """
+        chat_memory = []
+        for message in self.chat_memory:
+            function_call = message.get("function_call")
+            chat_memory.append(ChatMessage(
+                role_name=message["role"],
+                content=message.get("content") or "",
+                function_name=message.get("name", ""),
+                function_call=json.dumps(function_call) if function_call else ""))
+        return AgentMemoryProto(instruction=self.instruction, user_id=self.user_id,
+                                user_name=self.user_name, guide_memory=self.guide_memory,
+                                chat_memory=chat_memory, memory_id=self.memory_id)
+
+    @classmethod
+    def from_proto(cls, memory_proto):
+        """
+        Create the memory from the AgentMemory message
+        """
+        memory = cls(memory_proto.memory_id, memory_proto.user_name, memory_proto.user_id)
+        memory.swap_instruction(memory_proto.instruction)
+        for guide in memory_proto.guide_memory:
+            memory.append_guide(guide)
+        for chat_message in memory_proto.chat_memory:
+            message = {"role": chat_message.role_name, "content": chat_message.content}
+            if chat_message.function_name:
+                message["name"] = chat_message.function_name
+            if chat_message.function_call:
+                message["function_call"] = json.loads(chat_message.function_call)
+                message["content"] = chat_message.content or None
+            memory.append_chat_message(message)
+        return memory
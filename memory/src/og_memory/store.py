@@ -0,0 +1,115 @@
+# vim:fenc=utf-8
+
+# SPDX-FileCopyrightText: 2023 imotai <jackwang@octogen.dev>
+# SPDX-FileContributor: imotai
+#
+# SPDX-License-Identifier: Elastic-2.0
+
+"""
+
+"""
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class BaseMemoryStore(ABC):
+    """
+    Base class for the agent memory store
+    """
+
+    @abstractmethod
+    async def get(self, memory_id):
+        """
+        Get the memory by the memory id and return None if the memory does not exist
+        """
+        pass
+
+    @abstractmethod
+    async def put(self, memory):
+        """
+        Put the memory to the store
+        """
+        pass
+
+    @abstractmethod
+    async def delete(self, memory_id):
+        """
+        Delete the memory from the store
+        """
+        pass
+
+
+class MemoryStore(BaseMemoryStore):
+    """
+    The memory store with a LRU and TTL in memory tier
+
+    The memory will be evicted when the store is full or the memory has not been
+    accessed for ttl seconds. The evicted memory will be written to the spill store
+    and reloaded from it on the next get
+
+    Typical usage example:
+        store = MemoryStore(spill_store=spill_store, max_size=64, ttl=1800)
+        await store.put(agent_memory)
+        agent_memory = await store.get(memory_id)
+    """
+
+    def __init__(self, spill_store=None, max_size=1024, ttl=0):
+        self.spill_store = spill_store
+        self.max_size = max_size
+        # 0 means the memory never expires
+        self.ttl = ttl
+        # the memory id -> (memory, the last access time)
+        self.memories = OrderedDict()
+
+    async def get(self, memory_id):
+        await self._evict_expired()
+        if memory_id in self.memories:
+            memory, _ = self.memories.pop(memory_id)
+            self.memories[memory_id] = (memory, time.monotonic())
+            return memory
+        if not self.spill_store:
+            return None
+        memory = await self.spill_store.get(memory_id)
+        if memory:
+            logger.debug(f"reload the memory {memory_id} from the spill store")
+            await self._add(memory)
+        return memory
+
+    async def put(self, memory):
+        await self._evict_expired()
+        self.memories.pop(memory.memory_id, None)
+        await self._add(memory)
+
+    async def delete(self, memory_id):
+        self.memories.pop(memory_id, None)
+        if self.spill_store:
+            await self.spill_store.delete(memory_id)
+
+    async def _add(self, memory):
+        self.memories[memory.memory_id] = (memory, time.monotonic())
+        while len(self.memories) > self.max_size:
+            memory_id, (evicted_memory, _) = self.memories.popitem(last=False)
+            await self._spill(memory_id, evicted_memory)
+
+    async def _evict_expired(self):
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        # the memories are ordered by the last access time
+        while self.memories:
+            memory_id, (memory, access_time) = next(iter(self.memories.items()))
+            if now - access_time < self.ttl:
+                break
+            self.memories.pop(memory_id)
+            await self._spill(memory_id, memory)
+
+    async def _spill(self, memory_id, memory):
+        if not self.spill_store:
+            logger.info(f"drop the memory {memory_id} without the spill store")
+            return
+        logger.debug(f"spill the memory {memory_id}")
+        await self.spill_store.put(memory)
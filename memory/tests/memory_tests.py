@@ -9,12 +9,18 @@
 
 """
 import json
-from og_memory.memory import agent_memory_to_context, AgentMemoryOption
+from og_memory.memory import agent_memory_to_context, AgentMemoryOption, MemoryAgentMemory
+from og_memory.context_window import ContextWindow
+from og_memory.store import BaseMemoryStore, MemoryStore
 from og_proto.memory_pb2 import AgentMemory, ChatMessage, GuideMemory, Feedback
 from og_proto.prompt_pb2 import AgentPrompt, ActionDesc
 # defina a logger variable
 import logging
+import time
+import pytest
+import tiktoken
 logger = logging.getLogger(__name__)
+encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
 
 def test_agent_memory_to_context_smoke_test():
     """
@@ -68,3 +74,214 @@ Use the following actions to help you finishing your task
     saved_filenames(array):A list of filenames that were created by the code
     """
     assert context == expected_context, "context is not expected"
+
+
+def test_to_messages_with_token_count():
+    """
+    test the cached token count of the memory
+    """
+    prompt = AgentPrompt(role="You are the QA engineer", rules=["rule1"], output_format="")
+    memory = MemoryAgentMemory("id", "user", "user_id")
+    memory.swap_instruction(prompt)
+    memory.append_chat_message({"role": "user", "content": "write a hello world in python"})
+    memory.append_chat_message({"role": "assistant", "content": None, "function_call": {"name": "execute", "arguments": "{}"}})
+    memory.append_chat_message({"role": "function", "name": "execute", "content": "hello world"})
+
+    def expected_count():
+        count = sum([len(encoding.encode(m["content"])) for m in memory.to_messages() if m["content"]])
+        return count + len(encoding.encode("{}"))
+
+    messages, token_count = memory.to_messages_with_token_count()
+    assert len(messages) == 4
+    assert token_count == expected_count()
+    memory.append_guide(GuideMemory(name="pandas", what_it_can_do="load the csv file", how_to_use="import pandas"))
+    _, token_count = memory.to_messages_with_token_count()
+    assert token_count == expected_count()
+    memory.swap_instruction(AgentPrompt(role="You are the data analyst", rules=["rule1", "rule2"], output_format="output json"))
+    _, token_count = memory.to_messages_with_token_count()
+    assert token_count == expected_count()
+    memory.update_options(AgentMemoryOption(show_function_instruction=True, disable_output_format=True))
+    _, token_count = memory.to_messages_with_token_count()
+    assert token_count == expected_count()
+    memory.reset_memory()
+    messages, token_count = memory.to_messages_with_token_count()
+    assert len(messages) == 1
+    assert token_count == sum([len(encoding.encode(m["content"])) for m in messages])
+
+
+def test_system_message_cache():
+    """
+    test the system message and functions are rendered once until the memory changes
+    """
+    action = ActionDesc(name="execute", desc="run code", parameters=json.dumps({
+            "type": "object",
+            "properties": {
+                "code": {
+                    "type": "string",
+                    "description": "the code to be executed",
+                },
+            },
+        }))
+    prompt = AgentPrompt(role="You are the QA engineer", actions=[action], output_format="")
+    memory = MemoryAgentMemory("id", "user", "user_id")
+    memory.swap_instruction(prompt)
+    system_message = memory.to_messages()[0]
+    functions = memory.get_functions()
+    assert memory.to_messages()[0] is system_message
+    assert memory.get_functions() is functions
+    memory.update_options(AgentMemoryOption(show_function_instruction=True))
+    assert memory.to_messages()[0] is system_message
+    memory.update_options(AgentMemoryOption(show_function_instruction=False))
+    assert memory.to_messages()[0] is not system_message
+    assert "execute: run code" not in memory.to_messages()[0]["content"]
+    system_message = memory.to_messages()[0]
+    memory.append_guide(GuideMemory(name="pandas", what_it_can_do="load the csv file", how_to_use="import pandas"))
+    assert "pandas" in memory.to_messages()[0]["content"]
+    memory.swap_instruction(AgentPrompt(role="You are the data analyst", actions=[], output_format=""))
+    assert "data analyst" in memory.to_messages()[0]["content"]
+    assert memory.get_functions() == []
+
+
+def test_context_window_compact():
+    """
+    test the context window drops and trims the oldest messages first
+    """
+    system_message = {"role": "system", "content": "You are the data analyst"}
+    messages = []
+    for i in range(10):
+        messages.append({"role": "user", "content": f"step {i} load the data"})
+        messages.append({"role": "assistant", "content": None,
+                         "function_call": {"name": "execute", "arguments": json.dumps({"code": f"print({i})"})}})
+        messages.append({"role": "function", "name": "execute", "content": f"output {i} " * 200})
+    token_counts = []
+    for m in messages:
+        count = len(encoding.encode(m["content"])) if m["content"] else 0
+        if m.get("function_call"):
+            count += len(encoding.encode(m["function_call"]["arguments"]))
+        token_counts.append(count)
+    system_token_count = len(encoding.encode(system_message["content"]))
+    window = ContextWindow(encoding, 10000)
+    compacted, token_count = window.compact(system_message, system_token_count, messages, token_counts)
+    assert compacted == [system_message] + messages
+    assert token_count == system_token_count + sum(token_counts)
+    window = ContextWindow(encoding, 1000)
+    compacted, token_count = window.compact(system_message, system_token_count, messages, token_counts)
+    assert token_count <= 1000
+    assert compacted[0] == system_message
+    assert compacted[1]["role"] == "system"
+    assert "omitted" in compacted[1]["content"]
+    # the latest function call and its output are kept intact
+    assert compacted[-2:] == messages[-2:]
+    assert compacted[-3] == messages[-3]
+    # the older outputs are trimmed
+    assert "truncated" in compacted[-4]["content"]
+    window = ContextWindow(encoding, 300)
+    compacted, token_count = window.compact(system_message, system_token_count, messages, token_counts)
+    assert token_count <= 300
+    assert compacted[-2] == messages[-2]
+    assert "truncated" in compacted[-1]["content"]
+    assert compacted[-1]["content"].endswith(messages[-1]["content"][-10:])
+
+
+def test_memory_with_context_token_limit():
+    """
+    test the memory applies the context token limit
+    """
+    prompt = AgentPrompt(role="You are the QA engineer", rules=["rule1"], output_format="")
+    memory = MemoryAgentMemory("id", "user", "user_id")
+    memory.swap_instruction(prompt)
+    memory.update_options(AgentMemoryOption(show_function_instruction=True, context_token_limit=200))
+    for i in range(5):
+        memory.append_chat_message({"role": "user", "content": "print the data"})
+        memory.append_chat_message({"role": "assistant", "content": None, "function_call": {"name": "execute", "arguments": "{}"}})
+        memory.append_chat_message({"role": "function", "name": "execute", "content": "data " * 100})
+    messages, token_count = memory.to_messages_with_token_count()
+    assert token_count <= 200
+    assert len(messages) < len(memory.to_messages())
+    # the function outputs are trimmed once
+    assert len(memory.chat_trimmed) == len(memory.chat_memory)
+    assert "truncated" in memory.chat_trimmed[2][0]["content"]
+    assert memory.to_messages_with_token_count() == (messages, token_count)
+    # the output which can not fit the context window is bounded when it's stored
+    memory.append_chat_message({"role": "function", "name": "execute", "content": "data " * 10000})
+    assert len(memory.chat_memory[-1]["content"]) < 200 * 8 + 100
+    assert memory.to_messages_with_token_count()[1] <= 200
+
+
+class DictMemoryStore(BaseMemoryStore):
+    """
+    the spill store for testing, the memory is saved as serialized message
+    """
+
+    def __init__(self):
+        self.memories = {}
+
+    async def get(self, memory_id):
+        if memory_id not in self.memories:
+            return None
+        memory_proto = AgentMemory()
+        memory_proto.ParseFromString(self.memories[memory_id])
+        return MemoryAgentMemory.from_proto(memory_proto)
+
+    async def put(self, memory):
+        self.memories[memory.memory_id] = memory.to_proto().SerializeToString()
+
+    async def delete(self, memory_id):
+        self.memories.pop(memory_id, None)
+
+
+def new_memory(memory_id):
+    memory = MemoryAgentMemory(memory_id, "user", "user_id")
+    memory.swap_instruction(AgentPrompt(role="You are the QA engineer", rules=["rule1"], output_format=""))
+    memory.append_guide(GuideMemory(name="pandas", what_it_can_do="load the csv file", how_to_use="import pandas"))
+    memory.append_chat_message({"role": "user", "content": "write a hello world in python"})
+    memory.append_chat_message({"role": "assistant", "content": None, "function_call": {"name": "execute", "arguments": "{\"code\": \"print(1)\"}"}})
+    memory.append_chat_message({"role": "function", "name": "execute", "content": "1"})
+    return memory
+
+
+def test_memory_proto_round_trip():
+    """
+    test the memory can be restored from the AgentMemory message
+    """
+    memory = new_memory("id")
+    restored = MemoryAgentMemory.from_proto(memory.to_proto())
+    assert restored.memory_id == memory.memory_id
+    assert restored.chat_memory == memory.chat_memory
+    assert restored.to_messages_with_token_count() == memory.to_messages_with_token_count()
+
+
+@pytest.mark.asyncio
+async def test_memory_store_lru():
+    """
+    test the least recently used memory is spilled and reloaded
+    """
+    spill_store = DictMemoryStore()
+    store = MemoryStore(spill_store=spill_store, max_size=2)
+    for memory_id in ["id1", "id2"]:
+        await store.put(new_memory(memory_id))
+    assert await store.get("id1")
+    await store.put(new_memory("id3"))
+    assert list(spill_store.memories.keys()) == ["id2"]
+    memory = await store.get("id2")
+    assert memory.chat_memory == new_memory("id2").chat_memory
+    assert "id1" in spill_store.memories
+    await store.delete("id2")
+    assert await store.get("id2") is None
+    assert await MemoryStore().get("id1") is None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_ttl():
+    """
+    test the expired memory is spilled
+    """
+    spill_store = DictMemoryStore()
+    store = MemoryStore(spill_store=spill_store, ttl=0.1)
+    await store.put(new_memory("id1"))
+    time.sleep(0.2)
+    await store.put(new_memory("id2"))
+    assert "id1" not in store.memories
+    assert "id1" in spill_store.memories
+    assert await store.get("id1")
+    assert "id1" in store.memories
@@ -4,6 +4,8 @@
 # SPDX-License-Identifier: Elastic-2.0
 
 """ """
+import os
+import asyncio
 import logging
 import grpc
 from grpc import aio
@@ -11,11 +13,29 @@ from og_proto import agent_server_pb2, common_pb2
 from og_proto.agent_server_pb2_grpc import AgentServerStub
 import aiofiles
 from typing import AsyncIterable
-from .utils import generate_chunk, generate_async_chunk
+from .kernel_sdk import KernelSDK
+from .utils import (
+    CHUNK_SIZE,
+    file_digest,
+    generate_chunk,
+    get_upload_offset,
+    upload_resumable,
+)
 
 logger = logging.getLogger(__name__)
 
 
+def _process_options(state_on_every_message, timeout):
+    """
+    the options of the task, the agent uses the default options if it's None
+    """
+    if not state_on_every_message and not timeout:
+        return None
+    return agent_server_pb2.ProcessOptions(
+        state_on_every_message=state_on_every_message, timeout=timeout
+    )
+
+
 class AgentSyncSession:
 
     def __init__(self, agent_sdk):
@@ -135,23 +155,47 @@ class AgentSyncSDK(AgentBaseSDK):
             for chunk in self.stub.download(request, metadata=self.metadata):
                 fd.write(chunk.buffer)
 
-    def upload_file(self, filepath, filename):
+    def stat_file(self, filename, with_digest=False):
         """
-        upload file to agent
+        get the state of the uploaded file and the partial upload
         """
+        request = common_pb2.StatFileRequest(filename=filename, with_digest=with_digest)
+        return self.stub.stat_file(request, metadata=self.metadata)
 
-        # TODO limit the file size
+    def upload_file(self, filepath, filename, chunk_size=CHUNK_SIZE):
+        """
+        upload file to agent, the interrupted upload is resumed and the upload is
+        skipped if the agent has the same file
+        """
 
+        # TODO limit the file size
+        digest = file_digest(filepath)
+        stat = self.stat_file(filename, with_digest=True)
+        offset = get_upload_offset(stat, digest, os.path.getsize(filepath))
+        if offset < 0:
+            return common_pb2.FileUploaded(length=stat.length, skipped=True)
         return self.stub.upload(
-            generate_chunk(filepath, filename), metadata=self.metadata
+            generate_chunk(filepath, filename, chunk_size, offset, digest),
+            metadata=self.metadata,
         )
 
-    def prompt(self, prompt, files=[], context_id=None):
+    def prompt(
+        self,
+        prompt,
+        files=[],
+        context_id=None,
+        state_on_every_message=False,
+        timeout=0,
+    ):
         """
-        ask the ai with prompt and  uploaded files
+        ask the ai with prompt and  uploaded files, the task is cancelled after
+        timeout seconds if it's not 0
         """
         request = agent_server_pb2.ProcessTaskRequest(
-            task=prompt, input_files=files, context_id=context_id
+            task=prompt,
+            input_files=files,
+            context_id=context_id,
+            options=_process_options(state_on_every_message, timeout),
         )
         for respond in self.stub.process_task(request, metadata=self.metadata):
             yield respond
@@ -182,12 +226,23 @@ class AgentProxySDK(AgentBaseSDK):
         response = await self.stub.add_kernel(request, metadata=metadata)
         return response
 
-    async def prompt(self, prompt, api_key, files=[], context_id=None):
+    async def prompt(
+        self,
+        prompt,
+        api_key,
+        files=[],
+        context_id=None,
+        state_on_every_message=False,
+        timeout=0,
+    ):
         metadata = aio.Metadata(
             ("api_key", api_key),
         )
         request = agent_server_pb2.ProcessTaskRequest(
-            task=prompt, input_files=files, context_id=context_id
+            task=prompt,
+            input_files=files,
+            context_id=context_id,
+            options=_process_options(state_on_every_message, timeout),
         )
         async for respond in self.stub.process_task(request, metadata=metadata):
             yield respond
@@ -228,20 +283,66 @@ class AgentSDK(AgentBaseSDK):
         """
         return AgentAsyncSession(self)
 
-    async def prompt(self, prompt, files=[], context_id=None):
+    async def prompt(
+        self,
+        prompt,
+        files=[],
+        context_id=None,
+        state_on_every_message=False,
+        timeout=0,
+    ):
         """
-        ask the ai with prompt and  uploaded files
+        ask the ai with prompt and  uploaded files, the task is cancelled after
+        timeout seconds if it's not 0
         """
         request = agent_server_pb2.ProcessTaskRequest(
-            task=prompt, input_files=files, context_id=context_id
+            task=prompt,
+            input_files=files,
+            context_id=context_id,
+            options=_process_options(state_on_every_message, timeout),
         )
         async for respond in self.stub.process_task(request, metadata=self.metadata):
             yield respond
 
-    async def download_file(self, filename, parent_path):
-        request = common_pb2.DownloadRequest(filename=filename)
+    async def _connect_kernel(self, filename, op):
+        """
+        return the kernel sdk with the transfer token of the file or None if the
+        agent disables the direct transfer
+        """
+        request = agent_server_pb2.TransferTokenRequest(filename=filename, op=op)
+        try:
+            response = await self.stub.create_transfer_token(
+                request, metadata=self.metadata
+            )
+        except aio.AioRpcError as ex:
+            # the agent before the direct transfer does not have the rpc
+            if ex.code() != grpc.StatusCode.UNIMPLEMENTED:
+                raise
+            logger.debug("fallback to the agent transfer for %s", ex.details())
+            return None
+        if response.code != 0:
+            logger.debug("fallback to the agent transfer for %s", response.msg)
+            return None
+        kernel_sdk = KernelSDK(response.endpoint, "", transfer_token=response.token)
+        kernel_sdk.connect()
+        return kernel_sdk
+
+    async def download_file(self, filename, parent_path, direct=True):
+        """
+        download file from the kernel directly if the agent allows it, otherwise
+        through the agent
+        """
         fullpath = "%s/%s" % (parent_path, filename)
+        kernel_sdk = await self._connect_kernel(filename, "download") if direct else None
         async with aiofiles.open(fullpath, "wb+") as afd:
+            if kernel_sdk:
+                try:
+                    async for chunk in kernel_sdk.download_file(filename):
+                        await afd.write(chunk.buffer)
+                finally:
+                    await kernel_sdk.close()
+                return
+            request = common_pb2.DownloadRequest(filename=filename)
             async for chunk in self.stub.download(request, metadata=self.metadata):
                 await afd.write(chunk.buffer)
 
@@ -250,13 +351,31 @@ class AgentSDK(AgentBaseSDK):
             return await self.stub.upload(chunks, metadata=self.metadata)
         except Exception as ex:
             logger.error("upload file ex %s", ex)
+            raise
 
-    async def upload_file(self, filepath, filename):
+    async def stat_file(self, filename, with_digest=False):
         """
-        upload file to agent
+        get the state of the uploaded file and the partial upload
         """
+        request = common_pb2.StatFileRequest(filename=filename, with_digest=with_digest)
+        return await self.stub.stat_file(request, metadata=self.metadata)
+
+    async def upload_file(self, filepath, filename, chunk_size=CHUNK_SIZE, direct=True):
+        """
+        upload file to agent, the interrupted upload is resumed and the upload is
+        skipped if the agent has the same file. The file is uploaded to the kernel
+        directly if the agent allows it
+        """
+        kernel_sdk = await self._connect_kernel(filename, "upload") if direct else None
+        if kernel_sdk:
+            try:
+                return await kernel_sdk.upload_file(filepath, filename, chunk_size)
+            finally:
+                await kernel_sdk.close()
         # TODO limit the file size
-        return await self.upload_binary(generate_async_chunk(filepath, filename))
+        return await upload_resumable(
+            self.upload_binary, self.stat_file, filepath, filename, chunk_size
+        )
 
     async def close(self):
         if self.channel:
@@ -5,6 +5,8 @@
 
 """ """
 
+import os
+import asyncio
 import logging
 import grpc
 from grpc import aio
@@ -12,18 +14,30 @@ from og_proto import kernel_server_pb2
 from og_proto import common_pb2
 from og_proto.kernel_server_pb2_grpc import KernelServerNodeStub
 from typing import AsyncIterable
+from .utils import CHUNK_SIZE, upload_resumable
 
 logger = logging.getLogger(__name__)
 
 
 class KernelSDK:
 
-    def __init__(self, endpoint, api_key):
+    def __init__(self, endpoint, api_key, session_id=None, transfer_token=None):
+        """
+        the kernel server hosts an isolated kernel and workspace for every session
+
+        the sdk with the transfer token issued by the agent can only transfer the
+        file of the token
+        """
         self.endpoint = endpoint
         self.stub = None
+        self.session_id = session_id
         self.metadata = aio.Metadata(
             ("api_key", api_key),
         )
+        if session_id:
+            self.metadata.add("session_id", session_id)
+        if transfer_token:
+            self.metadata.add("transfer_token", transfer_token)
 
     def connect(self):
         """
@@ -41,13 +55,44 @@ class KernelSDK:
         response = await self.stub.stop(request, metadata=self.metadata)
         return response
 
+    async def interrupt(self, kernel_name=None):
+        """
+        Interrupt the running execution of the kernel
+        """
+        request = kernel_server_pb2.InterruptKernelRequest(kernel_name=kernel_name)
+        response = await self.stub.interrupt(request, metadata=self.metadata)
+        return response
+
+    async def restart(self, kernel_name=None):
+        """
+        Restart the kernel, the variables of the kernel are lost
+        """
+        request = kernel_server_pb2.RestartKernelRequest(kernel_name=kernel_name)
+        response = await self.stub.restart(request, metadata=self.metadata)
+        return response
+
     async def is_alive(self, kernel_name=None):
         request = kernel_server_pb2.GetStatusRequest(kernel_name=kernel_name)
         response = await self.stub.get_status(request, metadata=self.metadata)
         return response.is_alive
 
-    async def download_file(self, filename):
-        request = common_pb2.DownloadRequest(filename=filename)
+    async def get_usage(self, all_sessions=False):
+        """
+        Get the resource usage of the kernels of the session or all the sessions
+        """
+        request = kernel_server_pb2.GetUsageRequest(all_sessions=all_sessions)
+        response = await self.stub.get_usage(request, metadata=self.metadata)
+        return response
+
+    async def stat_file(self, filename, with_digest=False):
+        """
+        Get the state of the uploaded file and the partial upload
+        """
+        request = common_pb2.StatFileRequest(filename=filename, with_digest=with_digest)
+        return await self.stub.stat_file(request, metadata=self.metadata)
+
+    async def download_file(self, filename, offset=0):
+        request = common_pb2.DownloadRequest(filename=filename, offset=offset)
         async for chunk in self.stub.download(request, metadata=self.metadata):
             yield chunk
 
@@ -56,6 +101,16 @@ class KernelSDK:
             return await self.stub.upload(chunks, metadata=self.metadata)
         except Exception as ex:
             logger.error("upload file ex %s" % ex)
+            raise
+
+    async def upload_file(self, filepath, filename, chunk_size=CHUNK_SIZE):
+        """
+        Upload the file to the workspace, the interrupted upload is resumed and the
+        upload is skipped if the workspace has the same file
+        """
+        return await upload_resumable(
+            self.upload_binary, self.stat_file, filepath, filename, chunk_size
+        )
 
     async def start(self, kernel_name=None):
         """
@@ -65,15 +120,27 @@ class KernelSDK:
         response = await self.stub.start(request, metadata=self.metadata)
         return response
 
-    async def execute(self, code, kernel_name=None):
+    async def execute(self, code, kernel_name=None, typed_output=False, timeout=None):
         """
         Execute the python code
+
+        typed_output asks for the typed fields of the response, use
+        `get_execute_output` to read the response from both the new and old kernel.
+        timeout is the deadline in seconds of the call, the kernel interrupts the
+        code when it's exceeded
         """
-        request = kernel_server_pb2.ExecuteRequest(code=code, kernel_name=kernel_name)
-        async for respond in self.stub.execute(request, metadata=self.metadata):
-            yield respond
+        request = kernel_server_pb2.ExecuteRequest(
+            code=code, kernel_name=kernel_name, typed_output=typed_output
+        )
+        call = self.stub.execute(request, metadata=self.metadata, timeout=timeout)
+        try:
+            async for respond in call:
+                yield respond
+        finally:
+            # the kernel stops the code when the call is cancelled
+            call.cancel()
 
     async def close(self):
         if self.channel:
-            self.channel.close()
+            await self.channel.close()
             self.channel = None
@@ -4,43 +4,145 @@
 #
 # SPDX-License-Identifier: Elastic-2.0
 
+import os
 import re
+import json
+import asyncio
+import hashlib
 import string
 import random
 import aiofiles
 import logging
-from og_proto import agent_server_pb2, common_pb2
+from grpc import StatusCode, aio
+from og_proto import agent_server_pb2, common_pb2, kernel_server_pb2
 from typing import AsyncIterable
 
 logger = logging.getLogger(__name__)
 
 
-def generate_chunk(filepath, filename) -> common_pb2.FileChunk:
+# the default chunk size in bytes of the file transfer
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(filepath, chunk_size=CHUNK_SIZE) -> str:
+    """
+    return the sha256 hex digest of the file
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def generate_chunk(
+    filepath, filename, chunk_size=CHUNK_SIZE, offset=0, digest=""
+) -> common_pb2.FileChunk:
+    """
+    generate the chunks of the file from the offset, the digest of the file is
+    sent with the first chunk
+    """
     try:
         with open(filepath, "rb") as fp:
+            fp.seek(offset)
             while True:
-                chunk = fp.read(1024 * 128)
+                chunk = fp.read(chunk_size)
                 if not chunk:
                     break
-                yield common_pb2.FileChunk(buffer=chunk, filename=filename)
+                yield common_pb2.FileChunk(
+                    buffer=chunk, filename=filename, offset=offset, digest=digest
+                )
+                offset += len(chunk)
+                digest = ""
     except Exception as ex:
         logger.error("fail to read file %s" % ex)
 
 
 async def generate_async_chunk(
-    filepath, filename
+    filepath, filename, chunk_size=CHUNK_SIZE, offset=0, digest=""
 ) -> AsyncIterable[common_pb2.FileChunk]:
+    """
+    generate the chunks of the file from the offset, the digest of the file is
+    sent with the first chunk
+    """
     try:
         async with aiofiles.open(filepath, "rb") as afp:
+            await afp.seek(offset)
             while True:
-                chunk = await afp.read(1024 * 128)
+                chunk = await afp.read(chunk_size)
                 if not chunk:
                     break
-                yield common_pb2.FileChunk(buffer=chunk, filename=filename)
+                yield common_pb2.FileChunk(
+                    buffer=chunk, filename=filename, offset=offset, digest=digest
+                )
+                offset += len(chunk)
+                digest = ""
     except Exception as ex:
         logger.error("fail to read file %s", ex)
 
 
+def get_upload_offset(stat, digest, length) -> int:
+    """
+    return the offset to resume the upload from or -1 if the same file has been
+    uploaded
+    """
+    if stat.exists and stat.digest == digest:
+        return -1
+    if 0 < stat.partial_length < length:
+        return stat.partial_length
+    return 0
+
+
+async def upload_resumable(upload, stat_file, filepath, filename, chunk_size=CHUNK_SIZE):
+    """
+    Upload the file from the offset of the partial upload, the file is uploaded
+    again from the start if the partial upload is rejected and the upload is skipped
+    if the same file has been uploaded
+
+    Arguments
+    upload - the async function to upload the chunks
+    stat_file - the async function to get the state of the file
+    """
+    digest = await asyncio.to_thread(file_digest, filepath)
+    stat = await stat_file(filename, with_digest=True)
+    offset = get_upload_offset(stat, digest, os.path.getsize(filepath))
+    if offset < 0:
+        return common_pb2.FileUploaded(length=stat.length, skipped=True)
+    if offset:
+        try:
+            return await upload(
+                generate_async_chunk(filepath, filename, chunk_size, offset, digest)
+            )
+        except aio.AioRpcError as ex:
+            if ex.code() not in [StatusCode.FAILED_PRECONDITION, StatusCode.DATA_LOSS]:
+                raise
+            logger.warning("fail to resume the upload for %s", ex.details())
+    return await upload(generate_async_chunk(filepath, filename, chunk_size, 0, digest))
+
+
+def get_execute_output(respond):
+    """
+    return the text of the stdout and stderr, the traceback or the mime bundle of
+    the result. the json output from the kernel without the typed fields is decoded
+    """
+    output_type = respond.output_type
+    if respond.typed:
+        if output_type == kernel_server_pb2.ExecuteResponse.TracebackType:
+            return respond.traceback
+        if output_type == kernel_server_pb2.ExecuteResponse.ResultType:
+            return dict(respond.result)
+        return respond.text
+    output = json.loads(respond.output)
+    if output_type == kernel_server_pb2.ExecuteResponse.TracebackType:
+        return output["traceback"]
+    if output_type == kernel_server_pb2.ExecuteResponse.ResultType:
+        return output
+    return output["text"]
+
+
 def process_char_stream(stream):
     buffer = []
     i = 0
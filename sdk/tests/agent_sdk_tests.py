@@ -11,12 +11,20 @@ import asyncio
 import logging
 import json
 import random
+import hashlib
 import logging
 from tempfile import gettempdir
 from pathlib import Path
+import grpc
 from og_sdk.agent_sdk import AgentSDK, AgentSyncSDK
-from og_sdk.utils import random_str
+from og_sdk.kernel_sdk import KernelSDK
+from og_sdk.utils import random_str, file_digest, generate_async_chunk
+from og_proto import agent_server_pb2
 from og_proto.agent_server_pb2 import TaskResponse
+from og_proto.agent_server_pb2_grpc import (
+    AgentServerServicer,
+    add_AgentServerServicer_to_server,
+)
 import pytest_asyncio
 
 logger = logging.getLogger(__name__)
@@ -117,6 +125,107 @@ async def test_upload_and_download_test(agent_sdk):
     assert file_stats.st_size == file_stats2.st_size, "bad download_file size"
 
 
+@pytest.mark.asyncio
+async def test_direct_transfer_test(agent_sdk):
+    sdk = agent_sdk
+    await sdk.add_kernel(api_key, "127.0.0.1:9527")
+    path = os.path.abspath(__file__)
+    response = await sdk.stub.create_transfer_token(
+        agent_server_pb2.TransferTokenRequest(
+            filename="agent_sdk_tests.py", op="download"
+        ),
+        metadata=sdk.metadata,
+    )
+    assert response.code == 0
+    assert response.endpoint == "127.0.0.1:9527"
+    kernel_sdk = KernelSDK(response.endpoint, "", transfer_token=response.token)
+    kernel_sdk.connect()
+    # the token can only download the file it's issued for
+    with pytest.raises(grpc.aio.AioRpcError):
+        await kernel_sdk.start()
+    with pytest.raises(grpc.aio.AioRpcError) as ex:
+        async for chunk in kernel_sdk.download_file("other.py"):
+            pass
+    assert ex.value.code() == grpc.StatusCode.PERMISSION_DENIED
+    with pytest.raises(grpc.aio.AioRpcError):
+        await kernel_sdk.upload_file(path, "agent_sdk_tests.py")
+    await kernel_sdk.close()
+    # upload through the agent and download from the kernel directly
+    uploaded = await sdk.upload_file(path, "agent_sdk_direct.py", direct=False)
+    assert uploaded.length == os.path.getsize(path)
+    tmp_dir = gettempdir()
+    await sdk.download_file("agent_sdk_direct.py", tmp_dir)
+    fullpath = "%s%s%s" % (tmp_dir, os.sep, "agent_sdk_direct.py")
+    assert os.path.getsize(fullpath) == os.path.getsize(path)
+
+
+@pytest.mark.asyncio
+async def test_direct_transfer_fallback_test():
+    # the agent without the transfer token rpc
+    server = grpc.aio.server()
+    add_AgentServerServicer_to_server(AgentServerServicer(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    sdk = AgentSDK("127.0.0.1:%d" % port, api_key)
+    sdk.connect()
+    try:
+        assert await sdk._connect_kernel("agent_sdk_tests.py", "upload") is None
+    finally:
+        await sdk.close()
+        await server.stop(None)
+
+
+@pytest.mark.asyncio
+async def test_resumable_upload_test(agent_sdk, tmp_path):
+    sdk = agent_sdk
+    await sdk.add_kernel(api_key, "127.0.0.1:9527")
+    path = str(tmp_path / "data.bin")
+    with open(path, "wb") as fd:
+        fd.write(os.urandom(3 * 1024 * 1024 + 100))
+    other_path = str(tmp_path / "other.bin")
+    with open(other_path, "wb") as fd:
+        fd.write(os.urandom(3 * 1024 * 1024 + 100))
+    filename = "agent_resumable_%s.bin" % os.urandom(4).hex()
+
+    async def interrupted_chunks():
+        digest = file_digest(other_path)
+        async for chunk in generate_async_chunk(other_path, filename, digest=digest):
+            yield chunk
+            await asyncio.sleep(60)
+
+    # leave a partial upload of the other file in the kernel session of the agent
+    session_id = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:32]
+    kernel_sdk = KernelSDK("127.0.0.1:9527", api_key, session_id=session_id)
+    kernel_sdk.connect()
+    call = kernel_sdk.stub.upload(interrupted_chunks(), metadata=kernel_sdk.metadata)
+    await asyncio.sleep(1)
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+    await kernel_sdk.close()
+    stat = await sdk.stat_file(filename)
+    assert stat.partial_length == 1024 * 1024
+    # the status of the kernel is passed through the agent
+    with pytest.raises(grpc.aio.AioRpcError) as ex:
+        await sdk.stub.upload(
+            generate_async_chunk(path, filename, offset=100, digest=file_digest(path)),
+            metadata=sdk.metadata,
+        )
+    assert ex.value.code() == grpc.StatusCode.FAILED_PRECONDITION
+    # the resumed upload mismatches the digest and the file is uploaded again
+    uploaded = await sdk.upload_file(path, filename, direct=False)
+    assert uploaded.length == os.path.getsize(path)
+    stat = await sdk.stat_file(filename, with_digest=True)
+    assert stat.exists and stat.digest == file_digest(path)
+    # the file exceeds the max file size of the agent
+    large_path = str(tmp_path / "large.bin")
+    with open(large_path, "wb") as fd:
+        fd.write(os.urandom(11 * 1024 * 1024))
+    with pytest.raises(grpc.aio.AioRpcError) as ex:
+        await sdk.upload_file(large_path, "agent_large.bin", direct=False)
+    assert ex.value.code() == grpc.StatusCode.INVALID_ARGUMENT
+
+
 @pytest.mark.asyncio
 async def test_prompt_smoke_test(agent_sdk):
     sdk = agent_sdk
@@ -176,3 +285,18 @@ async def test_run_code_with_error(agent_sdk):
         )
     except Exception as ex:
         assert 0, str(ex)
+
+
+@pytest.mark.asyncio
+async def test_prompt_timeout_test(agent_sdk):
+    sdk = agent_sdk
+    await sdk.add_kernel(api_key, "127.0.0.1:9527")
+    responds = []
+    async for respond in sdk.prompt("sleep forever", timeout=3):
+        responds.append(respond)
+    assert responds[-1].response_type == TaskResponse.OnTaskTimeout
+    # the kernel is interrupted and free for the next task
+    responds = []
+    async for respond in sdk.prompt("write a hello world in python", timeout=30):
+        responds.append(respond)
+    assert responds[-1].response_type == TaskResponse.OnFinalAnswer
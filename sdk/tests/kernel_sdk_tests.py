@@ -7,10 +7,11 @@
 import os
 import asyncio
 import pytest
+import grpc
 import logging
 import json
 from og_sdk.kernel_sdk import KernelSDK
-from og_sdk.utils import generate_async_chunk
+from og_sdk.utils import generate_async_chunk, get_execute_output, file_digest
 from og_proto.kernel_server_pb2 import ExecuteResponse
 import aiofiles
 from typing import AsyncIterable
@@ -61,6 +62,51 @@ async def test_upload_and_download_smoke_test(kernel_sdk):
     assert length == file_stats.st_size, "bad upload file size"
 
 
+@pytest.mark.asyncio
+async def test_resumable_upload_test(kernel_sdk, tmp_path):
+    kernel_sdk.connect()
+    path = str(tmp_path / "data.bin")
+    with open(path, "wb") as fd:
+        fd.write(os.urandom(3 * 1024 * 1024 + 100))
+    filename = "resumable_%s.bin" % os.urandom(4).hex()
+    digest = file_digest(path)
+
+    async def interrupted_chunks():
+        async for chunk in generate_async_chunk(path, filename, digest=digest):
+            yield chunk
+            await asyncio.sleep(60)
+
+    call = kernel_sdk.stub.upload(interrupted_chunks(), metadata=kernel_sdk.metadata)
+    # drop the connection after the first chunk is written
+    await asyncio.sleep(1)
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+    stat = await kernel_sdk.stat_file(filename)
+    assert not stat.exists
+    assert stat.partial_length == 1024 * 1024
+    # the partial file does not match the offset
+    with pytest.raises(grpc.aio.AioRpcError) as ex:
+        await kernel_sdk.stub.upload(
+            generate_async_chunk(path, filename, offset=100, digest=digest),
+            metadata=kernel_sdk.metadata,
+        )
+    assert ex.value.code() == grpc.StatusCode.FAILED_PRECONDITION
+    response = await kernel_sdk.upload_file(path, filename)
+    assert response.length == os.path.getsize(path)
+    assert not response.skipped
+    stat = await kernel_sdk.stat_file(filename, with_digest=True)
+    assert stat.exists and stat.partial_length == 0
+    assert stat.digest == digest
+    response = await kernel_sdk.upload_file(path, filename)
+    assert response.skipped
+    chunks = []
+    async for chunk in kernel_sdk.download_file(filename, offset=100):
+        chunks.append(chunk.buffer)
+    with open(path, "rb") as fd:
+        assert b"".join(chunks) == fd.read()[100:]
+
+
 @pytest.mark.asyncio
 async def test_stop_kernel(kernel_sdk):
     kernel_sdk.connect()
@@ -106,3 +152,132 @@ async def test_sdk_result_test(kernel_sdk):
     assert responds[1].output_type == ExecuteResponse.ResultType
     assert json.loads(responds[0].output)["text"] == "hello world!\n"
     assert json.loads(responds[1].output)["text/plain"] == "5"
+
+
+@pytest.mark.asyncio
+async def test_sdk_typed_output_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+    code = """print('hello world!')
+5"""
+    responds = []
+    async for respond in kernel_sdk.execute(code, typed_output=True):
+        responds.append(respond)
+    async for respond in kernel_sdk.execute("1/0", typed_output=True):
+        responds.append(respond)
+    await kernel_sdk.stop()
+    assert len(responds) == 3
+    assert all(r.typed and not r.output for r in responds)
+    assert responds[0].output_type == ExecuteResponse.StdoutType
+    assert responds[0].text == "hello world!\n"
+    assert responds[1].output_type == ExecuteResponse.ResultType
+    assert dict(responds[1].result) == {"text/plain": "5"}
+    assert responds[2].output_type == ExecuteResponse.TracebackType
+    assert "ZeroDivisionError" in get_execute_output(responds[2])
+
+
+@pytest.mark.asyncio
+async def test_sdk_coalesce_stdout_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+    code = """for i in range(1000):
+    print(i)"""
+    responds = []
+    async for respond in kernel_sdk.execute(code, typed_output=True):
+        responds.append(respond)
+    await kernel_sdk.stop()
+    assert len(responds) < 100
+    assert all(r.output_type == ExecuteResponse.StdoutType for r in responds)
+    output = "".join(r.text for r in responds)
+    assert output == "".join("%d\n" % i for i in range(1000))
+
+
+@pytest.mark.asyncio
+async def test_sdk_interrupt_and_restart_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+
+    async def run(code):
+        return [r async for r in kernel_sdk.execute(code, typed_output=True)]
+
+    task = asyncio.create_task(run("import time\na = 1\ntime.sleep(60)"))
+    await asyncio.sleep(1)
+    response = await kernel_sdk.interrupt()
+    assert response.code == 0
+    responds = await asyncio.wait_for(task, 10)
+    assert responds[-1].output_type == ExecuteResponse.TracebackType
+    assert "KeyboardInterrupt" in responds[-1].traceback
+    responds = await run("print(a)")
+    assert responds[0].text == "1\n"
+    response = await kernel_sdk.restart()
+    assert response.code == 0
+    responds = await run("print('a' in globals())")
+    assert responds[0].text == "False\n"
+    await kernel_sdk.stop()
+    response = await kernel_sdk.restart()
+    assert response.code == 1
+
+
+@pytest.mark.asyncio
+async def test_sdk_execute_deadline_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+    with pytest.raises(grpc.aio.AioRpcError) as exc_info:
+        async for respond in kernel_sdk.execute(
+            "import time\na = 1\ntime.sleep(60)", timeout=1
+        ):
+            pass
+    assert exc_info.value.code() == grpc.StatusCode.DEADLINE_EXCEEDED
+    # the kernel interrupts the code after the deadline, the executions queued
+    # before the interrupt are aborted by the kernel
+    await asyncio.sleep(1)
+    responds = [
+        r
+        async for r in kernel_sdk.execute("print(a)", typed_output=True, timeout=10)
+    ]
+    await kernel_sdk.stop()
+    assert responds[0].text == "1\n"
+
+
+@pytest.mark.asyncio
+async def test_sdk_usage_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+    async for respond in kernel_sdk.execute("1 + 1"):
+        pass
+    response = await kernel_sdk.get_usage()
+    await kernel_sdk.stop()
+    assert len(response.usages) == 1
+    assert response.usages[0].kernel_name == "python3"
+    assert response.usages[0].execution_count == 1
+    assert response.usages[0].execution_time > 0
+
+
+@pytest.mark.asyncio
+async def test_sdk_image_test(kernel_sdk):
+    kernel_sdk.connect()
+    if not await kernel_sdk.is_alive():
+        await kernel_sdk.start()
+    code = """import matplotlib.pyplot as plt
+plt.plot([1, 2, 3])
+plt.show()"""
+    responds = []
+    async for respond in kernel_sdk.execute(code):
+        responds.append(respond)
+    await kernel_sdk.stop()
+    images = [
+        json.loads(r.output)
+        for r in responds
+        if r.output_type == ExecuteResponse.ResultType
+        and "image/png" in json.loads(r.output)
+    ]
+    assert len(images) == 1
+    length = 0
+    async for chunk in kernel_sdk.download_file(images[0]["image/png"]):
+        length += len(chunk.buffer)
+    assert length > 0
@@ -6,7 +6,38 @@
 """ """
 import pytest
 import json
-from og_sdk.utils import process_char_stream
+from og_sdk.utils import (
+    generate_chunk,
+    get_execute_output,
+    get_upload_offset,
+    process_char_stream,
+)
+from og_proto.common_pb2 import StatFileResponse
+from og_proto.kernel_server_pb2 import ExecuteResponse
+
+
+def test_get_execute_output():
+    json_respond = ExecuteResponse(
+        output_type=ExecuteResponse.StdoutType, output=json.dumps({"text": "hello"})
+    )
+    typed_respond = ExecuteResponse(
+        output_type=ExecuteResponse.StdoutType, text="hello", typed=True
+    )
+    assert get_execute_output(json_respond) == get_execute_output(typed_respond)
+    json_respond = ExecuteResponse(
+        output_type=ExecuteResponse.ResultType,
+        output=json.dumps({"image/png": "a.png"}),
+    )
+    typed_respond = ExecuteResponse(
+        output_type=ExecuteResponse.ResultType,
+        result={"image/png": "a.png"},
+        typed=True,
+    )
+    assert get_execute_output(json_respond) == get_execute_output(typed_respond)
+    typed_respond = ExecuteResponse(
+        output_type=ExecuteResponse.TracebackType, traceback="error", typed=True
+    )
+    assert get_execute_output(typed_respond) == "error"
 
 
 def test_process_char_stream_case2():
@@ -68,3 +99,22 @@ def test_special_characters():
         process_char_stream("ab!@#$%^&*()_+{}|:\";'<>,.?/`~")
         == "ab!@#$%^&*()_+{}|:\";'<>,.?/`~"
     )
+
+
+def test_generate_chunk_from_offset(tmp_path):
+    path = str(tmp_path / "data.txt")
+    with open(path, "w") as fd:
+        fd.write("0123456789")
+    chunks = list(generate_chunk(path, "data.txt", chunk_size=4, offset=2, digest="d"))
+    assert [c.buffer for c in chunks] == [b"2345", b"6789"]
+    assert [c.offset for c in chunks] == [2, 6]
+    assert [c.digest for c in chunks] == ["d", ""]
+
+
+def test_get_upload_offset():
+    stat = StatFileResponse(exists=True, length=10, digest="a")
+    assert get_upload_offset(stat, "a", 10) == -1
+    assert get_upload_offset(stat, "b", 10) == 0
+    stat = StatFileResponse(partial_length=4)
+    assert get_upload_offset(stat, "a", 10) == 4
+    assert get_upload_offset(stat, "a", 4) == 0